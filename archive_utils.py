@@ -0,0 +1,248 @@
+import fnmatch
+import hashlib
+import os
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# py7zr and rarfile are imported inside the functions that need them, so
+# zip-only builds and the headless CLI start without loading them
+
+ARCHIVE_EXTENSIONS = ('.zip', '.7z', '.rar')
+
+# File types the game reads from Override, Modules or the game root
+GAME_EXTENSIONS = (
+    '.2da', '.are', '.bik', '.dlg', '.dwk', '.erf', '.fac', '.git', '.gui', '.ifo',
+    '.jrl', '.lip', '.ltr', '.lyt', '.mdl', '.mdx', '.mod', '.mp3', '.ncs', '.pth',
+    '.pwk', '.rim', '.ssf', '.tga', '.tlk', '.tpc', '.txi', '.utc', '.utd', '.ute',
+    '.uti', '.utm', '.utp', '.uts', '.utt', '.utw', '.vis', '.wav', '.wok',
+)
+
+
+class MemberFilter:
+    """Decides which archive members are worth extracting.
+
+    Rules are case-insensitive glob patterns matched against the member's
+    '/' separated path, where '*' also matches across folders (so
+    '*.tga' matches at any depth and 'Override/**' matches everything
+    under Override). A member is kept if it matches no deny pattern and,
+    when allow patterns are given, at least one of them.
+    """
+
+    def __init__(self, allow=(), deny=(), allow_extensions=(), deny_extensions=()):
+        self.allow = [self._normalize(p) for p in allow] + [f"*{e.lower()}" for e in allow_extensions]
+        self.deny = [self._normalize(p) for p in deny] + [f"*{e.lower()}" for e in deny_extensions]
+
+    @staticmethod
+    def _normalize(pattern):
+        return pattern.replace('\\', '/').replace('**', '*').lower()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a filter from a dict with allow/deny/allow_extensions/deny_extensions lists"""
+        return cls(config.get("allow", ()), config.get("deny", ()),
+                   config.get("allow_extensions", ()), config.get("deny_extensions", ()))
+
+    def matches(self, member_name):
+        """Check if an archive member should be extracted"""
+        name = member_name.replace('\\', '/').lstrip('/').lower()
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.deny):
+            return False
+        return not self.allow or any(fnmatch.fnmatchcase(name, pattern) for pattern in self.allow)
+
+    def signature(self):
+        """Short stable fingerprint of the rules, used in cache keys"""
+        rules = "\n".join(["allow"] + sorted(self.allow) + ["deny"] + sorted(self.deny))
+        return hashlib.blake2b(rules.encode('utf-8'), digest_size=4).hexdigest()
+
+
+# Keeps game files and drops readmes, screenshots, source art and bundled tools
+GAME_FILES_FILTER = MemberFilter(
+    allow_extensions=GAME_EXTENSIONS,
+    deny=['__macosx/*', '*/__macosx/*', 'source/*', '*/source/*',
+          'screenshots/*', '*/screenshots/*'],
+)
+
+
+def is_archive(path):
+    """Check if a path looks like a supported mod archive"""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def extract_archive(archive_path, extract_path, member_filter=None):
+    """Extract a .zip, .7z or .rar archive into extract_path.
+
+    With a member_filter only matching files are decompressed to disk.
+    Returns the number of files that were skipped.
+    """
+    lower = archive_path.lower()
+    os.makedirs(extract_path, exist_ok=True)
+
+    def keep(name):
+        return member_filter is None or member_filter.matches(name)
+
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            files = [m for m in zip_ref.infolist() if not m.is_dir()]
+            selected = [m for m in files if keep(m.filename)]
+            zip_ref.extractall(extract_path, members=selected)
+    elif lower.endswith('.7z'):
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, 'r') as sz:
+            files = [m.filename for m in sz.list() if not m.is_directory]
+            selected = [name for name in files if keep(name)]
+            if member_filter is None:
+                sz.extractall(extract_path)
+            elif selected:
+                sz.extract(extract_path, targets=selected)
+    elif lower.endswith('.rar'):
+        import rarfile
+        with rarfile.RarFile(archive_path, 'r') as rf:
+            files = [m for m in rf.infolist() if not m.is_dir()]
+            selected = [m for m in files if keep(m.filename)]
+            rf.extractall(extract_path, members=selected)
+    else:
+        raise ValueError(f"Unsupported archive type: {os.path.basename(archive_path)}")
+    return len(files) - len(selected)
+
+
+def list_members(archive_path):
+    """Return (name, uncompressed_size) for every file in an archive"""
+    lower = archive_path.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            return [(m.filename, m.file_size) for m in zip_ref.infolist() if not m.is_dir()]
+    elif lower.endswith('.7z'):
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, 'r') as sz:
+            return [(m.filename, m.uncompressed) for m in sz.list() if not m.is_directory]
+    elif lower.endswith('.rar'):
+        import rarfile
+        with rarfile.RarFile(archive_path, 'r') as rf:
+            return [(m.filename, m.file_size) for m in rf.infolist() if not m.is_dir()]
+    raise ValueError(f"Unsupported archive type: {os.path.basename(archive_path)}")
+
+
+def read_member(archive_path, member_name):
+    """Return the contents of one file in an archive without extracting the rest"""
+    lower = archive_path.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            return zip_ref.read(member_name)
+    elif lower.endswith('.7z'):
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, 'r') as sz:
+            return sz.read(targets=[member_name])[member_name].read()
+    elif lower.endswith('.rar'):
+        import rarfile
+        with rarfile.RarFile(archive_path, 'r') as rf:
+            return rf.read(member_name)
+    raise ValueError(f"Unsupported archive type: {os.path.basename(archive_path)}")
+
+
+def find_problems(archive_path):
+    """Check an archive for encryption and CRC errors without extracting it.
+
+    This reads and decompresses every member, so it can take a while on
+    big archives. Returns a list of human readable problems.
+    """
+    lower = archive_path.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+            if any(m.flag_bits & 0x1 for m in zip_ref.infolist()):
+                return ["archive is password protected"]
+            bad_member = zip_ref.testzip()
+    elif lower.endswith('.7z'):
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, 'r') as sz:
+            if sz.needs_password():
+                return ["archive is password protected"]
+            bad_member = sz.testzip()
+    elif lower.endswith('.rar'):
+        import rarfile
+        with rarfile.RarFile(archive_path, 'r') as rf:
+            if rf.needs_password():
+                return ["archive is password protected"]
+            try:
+                rf.testrar()
+                bad_member = None
+            except rarfile.Error as e:
+                return [f"archive test failed: {e}"]
+    else:
+        return ["unsupported archive type"]
+    if bad_member:
+        return [f"CRC error in {bad_member}"]
+    return []
+
+
+def staging_name(index, archive_path):
+    """Name of the staging directory for the archive at a load-order position"""
+    mod_name = os.path.splitext(os.path.basename(archive_path))[0]
+    return f"{index:03d}_{mod_name}"
+
+
+def default_workers(job_count):
+    """Number of extraction processes to use for job_count archives"""
+    return max(1, min(job_count, os.cpu_count() or 1))
+
+
+def extract_many(jobs, max_workers=None, extract=extract_archive):
+    """Run extract(*job) for every job tuple in a process pool.
+
+    Yields (job, result, error) as each archive finishes, where error is
+    None on success. Closing the generator cancels archives that have not
+    started.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    workers = max_workers or default_workers(len(jobs))
+
+    # A pool is pure overhead for a single archive
+    if workers == 1:
+        for job in jobs:
+            try:
+                yield job, extract(*job), None
+            except Exception as e:
+                yield job, None, e
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(extract, *job): job for job in jobs}
+        try:
+            for future in as_completed(futures):
+                error = future.exception()
+                yield futures[future], (None if error else future.result()), error
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def merge_tree(source_dir, dest_dir):
+    """Link every file from source_dir into dest_dir, replacing existing files.
+
+    Files are hard-linked where possible (copied otherwise) so the staged
+    tree keeps each mod's own copy. Returns the '/' separated relative
+    paths that were merged. Merging staged mods in load order gives the
+    same result as extracting them on top of each other.
+    """
+    merged = []
+    for root, dirs, files in os.walk(source_dir):
+        rel_root = os.path.relpath(root, source_dir)
+        target_root = os.path.normpath(os.path.join(dest_dir, rel_root))
+        if os.path.isfile(target_root):
+            os.remove(target_root)
+        os.makedirs(target_root, exist_ok=True)
+        for file in files:
+            source = os.path.join(root, file)
+            target = os.path.join(target_root, file)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.lexists(target):
+                os.remove(target)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+            merged.append(os.path.normpath(os.path.join(rel_root, file)).replace(os.sep, '/'))
+    return merged
@@ -0,0 +1,137 @@
+import argparse
+import os
+import random
+import sys
+import zipfile
+
+STAND_IN_PATCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stand_in_patcher.py")
+TEXTURE_EXTENSIONS = ('.tga', '.tpc', '.txi', '.mdl', '.mdx', '.2da')
+
+
+def make_payload(rng, size):
+    """File content that compresses roughly like game textures (about 2:1)"""
+    noise = rng.getrandbits(size // 2 * 8).to_bytes(size // 2, 'little') if size >= 2 else b''
+    return noise + bytes(size - len(noise))
+
+
+def write_archive(archive_path, files):
+    """Write {member name: bytes} as a .zip or .7z archive"""
+    if archive_path.endswith('.7z'):
+        import py7zr
+        with py7zr.SevenZipFile(archive_path, 'w') as sz:
+            for name, data in files.items():
+                sz.writestr(data, name)
+    else:
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, data in files.items():
+                zf.writestr(name, data)
+
+
+def loose_mod_files(rng, index, files_per_mod, file_size, depth, overlap, shared_names):
+    """Members of one loose-file mod: Override files, nested folders and a readme"""
+    files = {"readme.txt": b"Synthetic benchmark mod\n"}
+    for i in range(files_per_mod):
+        if rng.random() < overlap:
+            name = rng.choice(shared_names)
+        else:
+            name = f"mod{index:03d}_{i:05d}{rng.choice(TEXTURE_EXTENSIONS)}"
+        folders = ["Override"] + [f"part{rng.randrange(4)}" for _ in range(rng.randrange(depth + 1))]
+        # Some mods ship without an Override folder to exercise the loose-folder layout
+        if index % 4 == 3:
+            folders[0] = f"Mod{index:03d}"
+        files["/".join(folders + [name])] = make_payload(rng, max(1, int(rng.uniform(0.5, 1.5) * file_size)))
+    return files
+
+
+def tsl_mod_files(rng, index, files_per_mod, file_size):
+    """Members of one TSLPatcher mod driven by the stand-in patcher.
+
+    Every third mod ships two install options through namespaces.ini.
+    """
+    root = f"PatchMod{index:03d}"
+    table = "appearance.2da" if index % 2 == 0 else f"mod{index:03d}.2da"
+    files = {
+        f"{root}/TSLPatcher.exe": b"MZ stand-in",
+        f"{root}/tslpatchdata/{table}": b"2DA V2.0\n\nlabel\tname\n0\tbase\n",
+    }
+    options = [""] if index % 3 != 2 else ["standard", "alternate"]
+    for option in options:
+        data_dir = f"{root}/tslpatchdata/{option}/" if option else f"{root}/tslpatchdata/"
+        names = [f"patch{index:03d}_{i:04d}.tga" for i in range(files_per_mod)]
+        changes = ["[InstallList]", "install_folder0=Override", "", "[install_folder0]"]
+        changes += [f"File{i}={name}" for i, name in enumerate(names)]
+        changes += ["", "[2DAList]", f"Table0={table}", ""]
+        files[f"{data_dir}changes.ini"] = "\n".join(changes).encode("utf-8")
+        for name in names:
+            files[f"{data_dir}{name}"] = make_payload(rng, file_size)
+    if len(options) > 1:
+        namespaces = ["[Namespaces]"] + [f"Namespace{i + 1}={o}" for i, o in enumerate(options)]
+        for option in options:
+            namespaces += ["", f"[{option}]", "IniName=changes.ini", f"DataPath={option}",
+                           f"Name={option.title()} install"]
+        files[f"{root}/tslpatchdata/namespaces.ini"] = "\n".join(namespaces).encode("utf-8")
+    return files
+
+
+def generate_corpus(dest_dir, mods=20, files_per_mod=200, file_size=64 * 1024, depth=2,
+                    overlap=0.1, tsl_mods=4, tsl_files=20, formats=("zip",), seed=1):
+    """Write a synthetic mod corpus and a build manifest for it.
+
+    Returns the path of the manifest, which uses the stand-in patcher
+    instead of TSLPatcher.exe.
+    """
+    rng = random.Random(seed)
+    mods_dir = os.path.join(dest_dir, "mods")
+    os.makedirs(mods_dir, exist_ok=True)
+    if "7z" in formats:
+        try:
+            import py7zr  # noqa: F401
+        except ImportError:
+            print("py7zr is not installed; writing .zip archives only")
+            formats = tuple(f for f in formats if f != "7z") or ("zip",)
+
+    shared_names = [f"shared_{i:05d}.tga" for i in range(max(1, files_per_mod))]
+    loose = []
+    for index in range(mods):
+        archive = os.path.join(mods_dir, f"loose{index:03d}.{formats[index % len(formats)]}")
+        write_archive(archive, loose_mod_files(rng, index, files_per_mod, file_size, depth, overlap, shared_names))
+        loose.append(archive)
+    tslpatcher = []
+    for index in range(tsl_mods):
+        archive = os.path.join(mods_dir, f"patcher{index:03d}.{formats[index % len(formats)]}")
+        write_archive(archive, tsl_mod_files(rng, index, tsl_files, file_size))
+        tslpatcher.append(archive)
+
+    manifest_path = os.path.join(dest_dir, "build.toml")
+
+    def toml_list(paths):
+        return "[" + ", ".join('"' + os.path.relpath(p, dest_dir).replace(os.sep, "/") + '"' for p in paths) + "]"
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        f.write('output = "out"\n')
+        f.write(f"loose = {toml_list(loose)}\n")
+        f.write(f"tslpatcher = {toml_list(tslpatcher)}\n")
+        f.write(f'patcher_command = ["{sys.executable.replace(os.sep, "/")}", '
+                f'"{STAND_IN_PATCHER.replace(os.sep, "/")}"]\n')
+    return manifest_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic KOTOR mod corpus')
+    parser.add_argument('dest', help='Directory to write the corpus into')
+    parser.add_argument('--mods', type=int, default=20, help='Number of loose-file mods')
+    parser.add_argument('--files', type=int, default=200, help='Files per loose-file mod')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='Average file size in bytes')
+    parser.add_argument('--depth', type=int, default=2, help='Maximum folder nesting below Override')
+    parser.add_argument('--overlap', type=float, default=0.1, help='Fraction of files shared between mods')
+    parser.add_argument('--tsl-mods', type=int, default=4, help='Number of stand-in TSLPatcher mods')
+    parser.add_argument('--formats', default='zip', help='Comma separated archive formats (zip,7z)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    manifest = generate_corpus(args.dest, args.mods, args.files, args.size, args.depth, args.overlap,
+                               args.tsl_mods, formats=tuple(args.formats.split(',')), seed=args.seed)
+    print(f"Wrote corpus manifest: {manifest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive_utils  # noqa: E402
+from corpus import generate_corpus  # noqa: E402
+from engine import InstallEngine, Reporter, load_build_manifest  # noqa: E402
+from export import export_package  # noqa: E402
+from overlay import plan_overlay  # noqa: E402
+from package_sync import list_tree  # noqa: E402
+from reaper import Reaper  # noqa: E402
+
+DEFAULT_TOLERANCE = 0.25
+# Slowdowns smaller than this are timer noise, whatever the percentage
+MIN_REGRESSION_SECONDS = 0.05
+
+
+class QuietReporter(Reporter):
+    """Swallows engine log lines so they don't skew the timings"""
+
+    def log(self, message):
+        pass
+
+
+def tree_stats(root_dir):
+    """(files, bytes) below root_dir"""
+    files = list_tree(root_dir) if os.path.isdir(root_dir) else []
+    return len(files), sum(os.path.getsize(os.path.join(root_dir, rel)) for rel in files)
+
+
+def timed(name, results, func, count_dir=None, count=None):
+    """Run func, then record its time and throughput in results[name].
+
+    Files and bytes are counted below count_dir, or by count(value).
+    """
+    started = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - started
+    if count is not None:
+        files, nbytes = count(value)
+    else:
+        files, nbytes = tree_stats(count_dir) if count_dir else (0, 0)
+    results[name] = {
+        "seconds": round(seconds, 4),
+        "files": files,
+        "bytes": nbytes,
+        "files_per_sec": round(files / seconds, 1) if seconds else 0.0,
+        "mb_per_sec": round(nbytes / 1024 ** 2 / seconds, 2) if seconds else 0.0,
+    }
+    print(f"{name:<28} {seconds:8.3f}s  {files:7d} files  {results[name]['mb_per_sec']:8.1f} MB/s")
+    return value
+
+
+def run_suite(corpus_dir):
+    """Time each pipeline stage against the corpus in corpus_dir"""
+    output_dir, loose_files, tsl_files, options = load_build_manifest(os.path.join(corpus_dir, "build.toml"))
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    results = {}
+
+    # Raw archive extraction, one archive after another
+    raw_dir = os.path.join(corpus_dir, "raw_extract")
+
+    def extract_all():
+        for i, file_path in enumerate(loose_files + tsl_files):
+            archive_utils.extract_archive(file_path, os.path.join(raw_dir, archive_utils.staging_name(i, file_path)))
+    timed("extract_archive", results, extract_all, raw_dir)
+    shutil.rmtree(raw_dir)
+
+    # One reaper for every engine, drained before the corpus is deleted
+    reaper = Reaper(log=lambda message: None)
+
+    def engine():
+        return InstallEngine(output_dir, loose_files, tsl_files, options, reporter=QuietReporter(), reaper=reaper)
+
+    try:
+        android_dir = engine().android_dir
+        timed("install_cold", results, lambda: engine().install(), android_dir)
+        timed("install_warm", results, lambda: engine().install(), android_dir)
+
+        work_dir = engine().work_dir
+        timed("plan_overlay", results, lambda: plan_overlay(work_dir), count=lambda plan: (len(plan), 0))
+        timed("combine_mods_incremental", results, lambda: engine().combine_mods(), android_dir)
+        full = engine()
+        full.options["full_rebuild"] = True
+        timed("combine_mods_full", results, full.combine_mods, android_dir)
+
+        export_path = os.path.join(output_dir, "bench_export.zip")
+        timed("export_zip", results, lambda: export_package(plan_overlay(work_dir), export_path),
+              count=lambda archive_bytes: tree_stats(android_dir))
+    finally:
+        reaper.wait()
+        reaper.shutdown()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a line per benchmark that got slower than baseline by more than tolerance"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous or not previous["seconds"]:
+            continue
+        change = current["seconds"] / previous["seconds"] - 1
+        if change > tolerance and current["seconds"] - previous["seconds"] > MIN_REGRESSION_SECONDS:
+            regressions.append(f"{name}: {previous['seconds']:.3f}s -> {current['seconds']:.3f}s (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the install pipeline on a synthetic corpus')
+    parser.add_argument('--corpus', help='Existing corpus directory (default: generate a temporary one)')
+    parser.add_argument('--mods', type=int, default=20, help='Number of loose-file mods to generate')
+    parser.add_argument('--files', type=int, default=200, help='Files per generated mod')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='Average generated file size in bytes')
+    parser.add_argument('--depth', type=int, default=2, help='Maximum generated folder nesting')
+    parser.add_argument('--overlap', type=float, default=0.1, help='Fraction of files shared between mods')
+    parser.add_argument('--tsl-mods', type=int, default=4, help='Number of stand-in TSLPatcher mods')
+    parser.add_argument('--formats', default='zip,7z', help='Comma separated archive formats (zip,7z)')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Fail if slower than this saved results file')
+    parser.add_argument('--save-baseline', help='Write results to this file for later comparison')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    temp_dir = None
+    corpus_dir = args.corpus
+    if corpus_dir is None or not os.path.exists(os.path.join(corpus_dir, "build.toml")):
+        if corpus_dir is None:
+            corpus_dir = temp_dir = tempfile.mkdtemp(prefix="kotor-bench-")
+        print(f"Generating corpus in {corpus_dir}...")
+        generate_corpus(corpus_dir, args.mods, args.files, args.size, args.depth, args.overlap,
+                        args.tsl_mods, formats=tuple(args.formats.split(',')))
+
+    try:
+        results = run_suite(corpus_dir)
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = {"python": sys.version.split()[0], "results": results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Wrote {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n✓ No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import configparser
+import os
+import shutil
+import sys
+import time
+
+# Stand-in for TSLPatcher.exe used by the benchmarks. It is run from the
+# folder that holds tslpatchdata and gets the game directory as its last
+# argument. It understands the parts of changes.ini the synthetic corpus
+# uses:
+#
+#   [InstallList]   install_folder0=Override   ->  [install_folder0] File0=x.tga
+#   [2DAList]       Table0=appearance.2da      ->  append a row to the table
+#
+# Set STAND_IN_PATCHER_DELAY to a number of seconds to mimic a slow patcher.
+
+
+def read_changes(tslpatchdata):
+    """Load changes.ini with case-sensitive keys"""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.optionxform = str
+    config.read(os.path.join(tslpatchdata, "changes.ini"), encoding="utf-8")
+    return config
+
+
+def install_files(config, tslpatchdata, game_dir):
+    """Copy the files listed under each install folder"""
+    if not config.has_section("InstallList"):
+        return
+    for section, folder in config.items("InstallList"):
+        dest_dir = game_dir if folder in (".", "") else os.path.join(game_dir, folder)
+        os.makedirs(dest_dir, exist_ok=True)
+        if not config.has_section(section):
+            continue
+        for _, file in config.items(section):
+            shutil.copy2(os.path.join(tslpatchdata, file), os.path.join(dest_dir, file))
+
+
+def patch_tables(config, tslpatchdata, game_dir, mod_name):
+    """Append a marker row to every listed 2DA, seeding it from tslpatchdata"""
+    if not config.has_section("2DAList"):
+        return
+    override = os.path.join(game_dir, "Override")
+    os.makedirs(override, exist_ok=True)
+    for _, table in config.items("2DAList"):
+        target = os.path.join(override, table)
+        if not os.path.exists(target):
+            shutil.copy2(os.path.join(tslpatchdata, table), target)
+        with open(target, "a", encoding="utf-8") as f:
+            f.write(f"{mod_name}\t{mod_name}\n")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("usage: stand_in_patcher.py <game directory>")
+        return 2
+    game_dir = sys.argv[-1]
+    tslpatchdata = os.path.join(os.getcwd(), "tslpatchdata")
+    if not os.path.isdir(tslpatchdata):
+        print(f"No tslpatchdata folder in {os.getcwd()}")
+        return 1
+
+    delay = float(os.environ.get("STAND_IN_PATCHER_DELAY", "0"))
+    if delay:
+        time.sleep(delay)
+
+    config = read_changes(tslpatchdata)
+    mod_name = os.path.basename(os.getcwd())
+    install_files(config, tslpatchdata, game_dir)
+    patch_tables(config, tslpatchdata, game_dir, mod_name)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,14 @@
 import os
-import shutil
 from pathlib import Path
 
+from reaper import Reaper
+
 def cleanup():
     """Clean up temporary directories and files"""
     print("Cleaning up temporary files and directories...")
+    # Directories are renamed aside at once and deleted in parallel in the background
+    reaper = Reaper()
+    reaper.sweep('.')
     
     # Directories to clean
     temp_dirs = [
@@ -19,7 +23,7 @@ def cleanup():
         if os.path.exists(dir_name):
             print(f"Removing {dir_name}...")
             try:
-                shutil.rmtree(dir_name)
+                reaper.discard(dir_name)
                 print(f"✓ Removed {dir_name}")
             except Exception as e:
                 print(f"❌ Error removing {dir_name}: {str(e)}")
@@ -31,13 +35,15 @@ def cleanup():
         response = input("Do you want to keep final_package? (y/n): ").lower()
         if response == 'n':
             try:
-                shutil.rmtree('final_package')
+                reaper.discard('final_package')
                 print("✓ Removed final_package")
             except Exception as e:
                 print(f"❌ Error removing final_package: {str(e)}")
         else:
             print("✓ Kept final_package")
     
+    print("\nWaiting for deletions to finish...")
+    reaper.wait()
     print("\nCleanup complete!")
     
     # Print reminder about copying files
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+
+from hashing import hash_file
+
+PACKAGE_MANIFEST_NAME = "package_manifest.json"
+SHIPPED_MANIFEST_NAME = "shipped_manifest.json"
+DELTA_DIR_NAME = "delta"
+DELETE_LIST_NAME = "delete_list.txt"
+
+
+def load_package_manifest(manifest_path):
+    """Load the {path: {"size", "hash", ...}} records of a package manifest, or an empty map"""
+    if not manifest_path or not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_package_manifest(manifest_path, files):
+    """Write a package manifest atomically"""
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({"files": files}, f, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def describe_package(plan, hash_store=None):
+    """Size and content hash of every file an OverlayPlan puts in the package.
+
+    With a hash_store, sources hashed earlier in the build (or in an
+    earlier build, if unchanged) are not read again.
+    """
+    winners = list(plan.winners())
+    if hash_store is not None:
+        digests = hash_store.hash_many([src_path for dest_rel, src_path, origin in winners])
+    else:
+        digests = {src_path: hash_file(src_path) for dest_rel, src_path, origin in winners}
+    return {
+        dest_rel: {"size": os.path.getsize(src_path), "hash": digests[src_path], "source": src_path}
+        for dest_rel, src_path, origin in winners
+    }
+
+
+def compare(shipped, current):
+    """Return sorted (added, changed, deleted) paths going from shipped to current"""
+    added = sorted(rel for rel in current if rel not in shipped)
+    changed = sorted(rel for rel in current
+                     if rel in shipped and (shipped[rel]["hash"] != current[rel]["hash"]
+                                            or shipped[rel]["size"] != current[rel]["size"]))
+    deleted = sorted(rel for rel in shipped if rel not in current)
+    return added, changed, deleted
+
+
+def write_delta(current, shipped, delta_dir, prefix="", copier=None):
+    """Write the files that differ from a shipped package, plus a deletion list.
+
+    delta_dir is rebuilt from scratch. Added and changed files are copied
+    below delta_dir/prefix; the paths to delete on the device go in
+    delete_list.txt (relative to prefix). Returns (added, changed, deleted).
+    """
+    added, changed, deleted = compare(shipped, current)
+    if os.path.exists(delta_dir):
+        shutil.rmtree(delta_dir)
+    files_dir = os.path.join(delta_dir, prefix) if prefix else delta_dir
+    os.makedirs(files_dir)
+    for rel in added + changed:
+        dest_path = os.path.join(files_dir, rel)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if copier is not None:
+            copier.copy(current[rel]["source"], dest_path)
+        else:
+            shutil.copy2(current[rel]["source"], dest_path)
+    with open(os.path.join(delta_dir, DELETE_LIST_NAME), 'w', encoding='utf-8') as f:
+        f.write("# Delete these files on the device before copying the delta over it\n")
+        for rel in deleted:
+            f.write(f"{prefix}/{rel}\n" if prefix else f"{rel}\n")
+    with open(os.path.join(delta_dir, "delta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"added": added, "changed": changed, "deleted": deleted}, f, indent=1)
+    return added, changed, deleted
+
+
+def mark_shipped(output_dir):
+    """Record the last build's package manifest as what is now on the device"""
+    source = os.path.join(output_dir, PACKAGE_MANIFEST_NAME)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"No build found in {output_dir} ({PACKAGE_MANIFEST_NAME} is missing)")
+    shutil.copy2(source, os.path.join(output_dir, SHIPPED_MANIFEST_NAME))
+    return len(load_package_manifest(source))
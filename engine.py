@@ -0,0 +1,1097 @@
+import datetime
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import archive_utils
+from delta import (DELETE_LIST_NAME, DELTA_DIR_NAME, PACKAGE_MANIFEST_NAME, describe_package,
+                   load_package_manifest, save_package_manifest, write_delta)
+from erf import ErfError, compare_archives, comparison_lines, is_module_archive, merge_archives
+from export import export_entries, export_package
+from extract_cache import CACHE_DIR_NAME, ExtractCache, extract_cached, tree_stats
+from fastcopy import AUTO, Copier, link_tree, read_only_tree
+from hashing import HASH_STORE_NAME, HashStore
+from journal import EXTRACT_STEP, MERGE_STEP, PATCH_STEP, InstallJournal
+from overlay import (MERGED_2DA_ORIGIN, MERGED_ORIGIN, MERGED_TLK_ORIGIN, OPTIMIZED_TEXTURE_ORIGIN, plan_overlay,
+                     save_origins)
+from package_sync import MANIFEST_NAME, sync_package
+from patcher_cache import PATCHER_CACHE_DIR_NAME, PatcherCache, TreeState, step_key
+from preflight import INDEX_NAME, ByteProgress, PreflightIndex
+from profiling import PROFILE_NAME, REPORT_NAME, RunProfile, cprofile_session, profiling_requested
+from reaper import STAGING_SUFFIX, Reaper, recover_swap, swap_into_place
+from textures import TEXTURE_CACHE_DIR_NAME, TEXTURE_REPORT_NAME, TextureCache, optimize_many, pure_python_estimate
+from tlk import TLK_NAME, TalkTable, TlkError, diff_tlk, merge_tlk
+from tslpatcher import option_footprint, plan_waves, prepare_option, select_option
+from twoda import TABLE_CACHE_DIR_NAME, TableCache, TwoDAError, diff_tables, merge_tables, write_binary
+
+ANDROID_SUBDIR = "Android/data/com.aspyr.swkotor/files"
+WORK_SUBDIRS = [
+    'dummy_kotor/Override',
+    'dummy_kotor/Modules',
+    'final_override',
+    'TSLPatcher',
+    'patcher_mods',
+]
+# TSLPatcher runs allowed side by side when their changes.ini files don't overlap
+DEFAULT_PATCHER_WORKERS = 4
+# Texture conversions expected to take longer than this without numpy say so in the log
+SLOW_TEXTURES_SECONDS = 60
+
+
+class InstallCancelled(Exception):
+    """Raised inside the engine when the user cancels an install"""
+
+
+class Reporter:
+    """Receives log lines, status and progress from an InstallEngine.
+
+    The default implementation prints log lines to stdout; the GUI
+    replaces it with one that forwards everything to the Tk thread.
+    """
+
+    def log(self, message):
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        print(f"[{timestamp}] {message}", flush=True)
+
+    def set_status(self, message):
+        pass
+
+    def set_progress(self, value, detail=""):
+        pass
+
+    def is_cancelled(self):
+        return False
+
+    def patched(self, archive_path):
+        """Called once a TSLPatcher mod's changes are in dummy_kotor, in load order"""
+        pass
+
+
+def load_build_manifest(manifest_path):
+    """Read a TOML build manifest into (output_dir, loose_files, tsl_files, options).
+
+    Relative paths are resolved against the manifest's directory. Example:
+
+        output = "builds/nightly"
+        loose = ["mods/hd_textures.7z", "mods/ui_fix.zip"]
+        tslpatcher = ["mods/k1cp.7z"]
+        copy_mode = "auto"
+        full_rebuild = false
+        skip_non_game_files = true
+        patcher_command = ["python", "stand_in_patcher.py"]   # optional
+        profile = false              # run under cProfile
+        reuse_patcher_results = true # replay recorded TSLPatcher runs
+        patcher_workers = 4          # TSLPatcher mods touching different files run side by side
+        export = "kotor_mods.zip"    # optional, single archive for the device (.zip or .tar)
+        write_tree = true            # set to false to only write the export archive
+        delta_against = "builds/nightly/shipped_manifest.json"   # optional, see mark-shipped
+        merge_modules = false        # merge conflicting .mod/.erf/.rim files resource by resource
+        base_tlk = "game/dialog.tlk" # optional, merge several mods' dialog.tlk against it
+        base_2da_dir = "game/2da"    # optional, merge several mods' .2da files against these
+        max_texture_size = 1024      # optional, downscale larger .tga textures
+        compress_textures = false    # convert .tga textures to DXT compressed .tpc
+
+        [filter]                     # optional, replaces the default game-file filter
+        allow_extensions = [".tga", ".tpc", ".2da"]
+        deny = ["*/source/*"]
+
+        [patcher_options]            # optional, install option per TSLPatcher mod
+        "mods/k1cp.7z" = "K1CP: Standard"
+    """
+    return parse_build_manifest(read_toml(manifest_path), os.path.dirname(os.path.abspath(manifest_path)),
+                                manifest_path)
+
+
+def read_toml(path):
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        import tomli as tomllib
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+def parse_build_manifest(manifest, base_dir, manifest_path):
+    """Turn the tables of a build manifest into (output_dir, loose_files, tsl_files, options).
+
+    Relative paths are resolved against base_dir; manifest_path is only
+    used in error messages.
+    """
+
+    def resolve(path):
+        return os.path.normpath(os.path.join(base_dir, os.path.expanduser(path)))
+
+    if "output" not in manifest:
+        raise ValueError(f"{manifest_path} does not set an output directory")
+    options = default_options()
+    options["full_rebuild"] = manifest.get("full_rebuild", False)
+    options["copy_mode"] = manifest.get("copy_mode", AUTO)
+    if "filter" in manifest:
+        options["loose_filter"] = archive_utils.MemberFilter.from_config(manifest["filter"])
+    if not manifest.get("skip_non_game_files", True):
+        options["loose_filter"] = None
+    options["profile"] = manifest.get("profile", False)
+    options["reuse_patcher_results"] = manifest.get("reuse_patcher_results", True)
+    options["patcher_workers"] = manifest.get("patcher_workers", DEFAULT_PATCHER_WORKERS)
+    options["export_path"] = resolve(manifest["export"]) if "export" in manifest else None
+    options["write_tree"] = manifest.get("write_tree", True)
+    if not options["write_tree"] and not options["export_path"]:
+        raise ValueError(f"{manifest_path} turns off write_tree without setting export")
+    options["delta_base"] = resolve(manifest["delta_against"]) if "delta_against" in manifest else None
+    options["merge_modules"] = manifest.get("merge_modules", False)
+    options["base_tlk"] = resolve(manifest["base_tlk"]) if "base_tlk" in manifest else None
+    options["base_2da_dir"] = resolve(manifest["base_2da_dir"]) if "base_2da_dir" in manifest else None
+    options["max_texture_size"] = manifest.get("max_texture_size")
+    options["compress_textures"] = manifest.get("compress_textures", False)
+    options["patcher_choices"] = {resolve(path): name for path, name in manifest.get("patcher_options", {}).items()}
+    if "patcher_command" in manifest:
+        options["patcher_command"] = [
+            resolve(arg) if os.path.exists(resolve(arg)) else arg for arg in manifest["patcher_command"]
+        ]
+    return (resolve(manifest["output"]),
+            [resolve(p) for p in manifest.get("loose", [])],
+            [resolve(p) for p in manifest.get("tslpatcher", [])],
+            options)
+
+
+def default_options():
+    """Build options used when none are given"""
+    return {
+        "full_rebuild": False,
+        "copy_mode": AUTO,
+        "loose_filter": archive_utils.GAME_FILES_FILTER,
+        # Command run instead of each mod's TSLPatcher.exe (used by the benchmarks);
+        # it gets the dummy game directory as its last argument
+        "patcher_command": None,
+        # Run under cProfile (also enabled by the KOTOR_PROFILE environment variable)
+        "profile": False,
+        # Replay recorded TSLPatcher results when a mod meets the same game state again
+        "reuse_patcher_results": True,
+        # Archive path -> name of the tslpatchdata option set to install; default is the first
+        "patcher_choices": {},
+        # Also stream the final package into this .zip or .tar for transferring to the device
+        "export_path": None,
+        # Write the final package as a folder tree (turn off to only export)
+        "write_tree": True,
+        # Shipped package manifest to write a delta package against, or None
+        "delta_base": None,
+        # Combine same-named .mod/.erf/.rim files resource by resource instead of letting the last one win
+        "merge_modules": False,
+        # Unmodified dialog.tlk to merge the strings of several mods' dialog.tlk against, or None
+        "base_tlk": None,
+        # Folder with the game's unmodified .2da files to merge several mods' copies against, or None
+        "base_2da_dir": None,
+        # Halve Override .tga textures until their longest side fits, or None to leave sizes alone
+        "max_texture_size": None,
+        # Convert Override .tga textures to DXT compressed .tpc where the game can use them
+        "compress_textures": False,
+        # TSLPatcher mods whose changes.ini files touch different game files run side by side,
+        # this many at a time; 1 runs every patcher in turn
+        "patcher_workers": DEFAULT_PATCHER_WORKERS,
+        # Folder for the extraction and TSLPatcher caches instead of the work directory,
+        # so several output directories can share them (see matrix.py)
+        "cache_dir": None,
+        # Trim the caches to their size limits after use; off while other builds use the same ones
+        "evict_caches": True,
+        # Continue an interrupted install from its last finished step instead of starting over
+        "resume": False,
+    }
+
+
+class InstallEngine:
+    """GUI-free extract/patch/combine pipeline for one output directory"""
+
+    def __init__(self, output_dir, loose_files, tsl_files, options=None, reporter=None, preflight=None,
+                 reaper=None):
+        self.output_dir = output_dir
+        self.loose_files = list(loose_files)
+        self.tsl_files = list(tsl_files)
+        self.options = dict(default_options(), **(options or {}))
+        self.reporter = reporter or Reporter()
+        self.work_dir = os.path.join(output_dir, "work")
+        self.android_dir = os.path.join(output_dir, ANDROID_SUBDIR)
+        # Holds the extraction and TSLPatcher caches
+        self.cache_dir = self.options["cache_dir"] or self.work_dir
+        self.preflight = preflight
+        self.errors = []
+        self.profile = RunProfile()
+        self.archive_digests = {}
+        # Cache entries this install used, so whoever evicts a shared cache can keep them
+        self.used_extract_keys = set()
+        self.used_patcher_keys = set()
+        self.hash_store = HashStore(os.path.join(self.work_dir, HASH_STORE_NAME))
+        self.journal = InstallJournal(self.work_dir)
+        # Deletes replaced trees in the background; the GUI shares one across installs
+        self.reaper = reaper or Reaper(log=self.log)
+
+    def log(self, message):
+        self.reporter.log(message)
+
+    def set_status(self, message):
+        self.reporter.set_status(message)
+
+    def error(self, message):
+        """Report a problem that doesn't stop the install"""
+        self.errors.append(message)
+        self.set_status(message)
+        self.log(message)
+
+    def check_cancelled(self):
+        """Stop between files if the user cancelled"""
+        if self.reporter.is_cancelled():
+            raise InstallCancelled()
+
+    def setup_directories(self):
+        """Create necessary directories if they don't exist"""
+        for directory in WORK_SUBDIRS:
+            os.makedirs(os.path.join(self.work_dir, directory), exist_ok=True)
+        self.log(f"Created working directories in: {self.work_dir}")
+
+    def reset_directory(self, path):
+        """Empty a directory that is rebuilt on every install; the old contents are deleted in the background"""
+        self.reaper.discard(path)
+        os.makedirs(path, exist_ok=True)
+
+    def check_archives(self):
+        """Warn about bad or misplaced archives and return their byte weights"""
+        if self.preflight is None:
+            self.preflight = PreflightIndex(os.path.join(self.work_dir, INDEX_NAME))
+        self.preflight.submit(self.loose_files + self.tsl_files)
+        weights = {}
+        with self.profile.span("preflight") as span:
+            for i, file_path in enumerate(self.loose_files + self.tsl_files):
+                self.check_cancelled()
+                name = os.path.basename(file_path)
+                info = self.preflight.get(file_path)
+                weights[file_path] = max(info["bytes"], info["size"], 1)
+                span.add(files=1)
+                for problem in info["problems"]:
+                    self.log(f"Warning: {name}: {problem}")
+                is_tsl = i >= len(self.loose_files)
+                if info["tslpatchdata"] and not is_tsl:
+                    self.log(f"Warning: {name} contains tslpatchdata; it probably belongs in the TSLPatcher list")
+                elif is_tsl and not info["tslpatchdata"]:
+                    self.log(f"Warning: {name} has no tslpatchdata folder")
+        return weights
+
+    def extract_all(self, jobs, on_extracted):
+        """Extract (archive_path, extract_path, member_filter) jobs in parallel through the cache.
+
+        Returns the archive paths that were extracted successfully.
+        """
+        cache = ExtractCache(os.path.join(self.cache_dir, CACHE_DIR_NAME))
+        cache_jobs = [
+            (archive_path, extract_path, cache.cache_dir,
+             cache.known_digest(archive_path) or self.hash_store.cached(archive_path),
+             self.options["copy_mode"], member_filter)
+            for archive_path, extract_path, member_filter in jobs
+        ]
+        extracted = set()
+        results = archive_utils.extract_many(cache_jobs, extract=extract_cached)
+        try:
+            for (archive_path, extract_path, *_), result, error in results:
+                if error is None:
+                    digest, key, tree_bytes, hit, stats = result
+                    cache.record(archive_path, digest, key, tree_bytes)
+                    self.archive_digests[archive_path] = digest
+                    self.hash_store.record(archive_path, digest)
+                    self.journal.record(EXTRACT_STEP, archive_path, digest)
+                    self.profile.record("extract", os.path.basename(archive_path), **stats)
+                    self.used_extract_keys.add(key)
+                    extracted.add(archive_path)
+                    source = "cache" if hit else "archive"
+                    self.log(f"Extracted: {os.path.basename(archive_path)} to {extract_path} (from {source})")
+                    self.set_status(f"Extracted {os.path.basename(archive_path)}")
+                else:
+                    self.error(f"Error extracting {os.path.basename(archive_path)}: {str(error)}")
+                on_extracted(archive_path)
+                self.check_cancelled()
+        finally:
+            results.close()
+            if self.options["evict_caches"]:
+                for key, info in cache.evict(keep=self.used_extract_keys):
+                    self.log(f"Evicted cached extraction of {info['name']}")
+            cache.save()
+        return extracted
+
+    def merge_loose_mods(self, loose_jobs, extracted):
+        """Link staged loose-file mods into final_override in load order"""
+        final_override = os.path.join(self.work_dir, "final_override")
+        origins = {}
+        for file_path, stage_path, _ in loose_jobs:
+            self.check_cancelled()
+            if file_path in extracted:
+                mod_name = os.path.basename(file_path)
+                with self.profile.span("merge", mod_name) as span:
+                    merged = archive_utils.merge_tree(stage_path, final_override)
+                    span.add(files=len(merged))
+                for rel_path in merged:
+                    origins.setdefault(rel_path, []).append((mod_name, os.path.join(stage_path, rel_path)))
+                self.log(f"Merged {len(merged)} files from {mod_name}")
+
+        # Copy dialog.tlk to dummy_kotor, combining it first if several mods ship one
+        dialog_tlk = os.path.join(final_override, TLK_NAME)
+        if os.path.exists(dialog_tlk):
+            if len(origins.get(TLK_NAME, [])) > 1:
+                self.combine_talk_tables(dialog_tlk, origins)
+            shutil.copy2(dialog_tlk, os.path.join(self.work_dir, "dummy_kotor", TLK_NAME))
+        save_origins(self.work_dir, origins,
+                     [stage_path for file_path, stage_path, _ in loose_jobs if file_path in extracted])
+
+    def combine_talk_tables(self, dialog_tlk, origins):
+        """Merge the dialog.tlk of every loose-file mod against the base game's table.
+
+        Without a base table the last mod's file still wins; what each
+        earlier version loses is logged instead.
+        """
+        versions = origins[TLK_NAME]
+        base_tlk = self.options["base_tlk"]
+        if not base_tlk:
+            self.log(f"{len(versions)} mods ship {TLK_NAME}; using the one from {versions[-1][0]} "
+                     f"(set Base dialog.tlk in the GUI or base_tlk in a build manifest to merge their strings)")
+            try:
+                with TalkTable(versions[-1][1]) as last:
+                    for mod_name, staged_path in versions[:-1]:
+                        with TalkTable(staged_path) as earlier:
+                            changed, added, removed = diff_tlk(earlier, last)
+                        if changed or added or removed:
+                            self.log(f"    {mod_name}: {len(changed)} strings replaced, "
+                                     f"{len(removed)} dropped, {len(added)} added by {versions[-1][0]}")
+            except (OSError, TlkError) as e:
+                self.log(f"Warning: could not compare {TLK_NAME} versions: {str(e)}")
+            return
+        with self.profile.span("tlk_merge") as span:
+            try:
+                changes, conflicts = merge_tlk(base_tlk, [path for _, path in versions], dialog_tlk)
+            except (OSError, TlkError) as e:
+                self.error(f"Could not merge {TLK_NAME}: {str(e)}")
+                return
+            span.add(bytes_written=os.path.getsize(dialog_tlk), files=len(versions))
+        names = {path: mod_name for mod_name, path in versions}
+        self.log(f"Merged {TLK_NAME} from {len(versions)} mods: " +
+                 ", ".join(f"{names[path]} ({count} strings)" for path, count in changes.items()))
+        for index, paths in conflicts:
+            self.log(f"{TLK_NAME} conflict: string {index} set by {', '.join(names[p] for p in paths)}; "
+                     f"{names[paths[-1]]} wins")
+        versions.append((MERGED_TLK_ORIGIN, dialog_tlk))
+
+    def choose_patcher_option(self, file_path):
+        """Pick which tslpatchdata option set of a mod to install, from the preflight listing"""
+        name = os.path.basename(file_path)
+        option_sets = self.preflight.get(file_path)["patchers"]
+        if not option_sets:
+            # check_archives has already warned about this
+            return None
+        choice = self.options["patcher_choices"].get(file_path)
+        option = select_option(option_sets, choice)
+        if option is None:
+            self.error(f"{name} has no install option named '{choice}'")
+        elif choice is None and len(option_sets) > 1:
+            others = ", ".join(o["name"] for o in option_sets[1:])
+            self.log(f"{name} has {len(option_sets)} install options; installing '{option['name']}' "
+                     f"(others: {others})")
+        return option
+
+    def run_patcher(self, file_path, extract_path, option, game_dir):
+        """Run TSLPatcher for one option set of an extracted mod against game_dir.
+
+        Returns True if it ran cleanly.
+        """
+        mod_name = os.path.splitext(os.path.basename(file_path))[0]
+        self.set_status(f"Running TSLPatcher for {mod_name}")
+
+        # The patcher sits next to tslpatchdata; the configured stand-in runs from the same folder
+        if self.options["patcher_command"]:
+            command = list(self.options["patcher_command"])
+        elif option["executable"]:
+            command = [os.path.join(extract_path, *option["executable"].split('/'))]
+        else:
+            self.error(f"No TSLPatcher executable found next to tslpatchdata in {mod_name}")
+            return False
+        try:
+            cwd = prepare_option(extract_path, option)
+            subprocess.run(command + [os.path.abspath(game_dir)], cwd=cwd, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.error(f"Error running TSLPatcher for {mod_name}: {str(e)}")
+            return False
+        return True
+
+    def patcher_id(self):
+        """What runs the patchers, as part of the patcher cache key"""
+        return " ".join(self.options["patcher_command"] or ["TSLPatcher.exe"])
+
+    def patch_key(self, file_path, option, state_key):
+        """Patcher cache key of applying one mod's option to a tree with the given TreeState key"""
+        return step_key(state_key, self.archive_digests[file_path],
+                        f"{self.patcher_id()}\n{option['tslpatchdata']}\n{option['name']}")
+
+    def replay_patch(self, file_path, key, state, patcher_cache):
+        """Apply a cached patcher result to dummy_kotor. Returns (changed digests, deleted paths)"""
+        mod_name = os.path.splitext(os.path.basename(file_path))[0]
+        with self.profile.span("tslpatcher", f"{mod_name} (cached)") as span:
+            changed, deleted, nbytes = patcher_cache.replay(key, state.root_dir)
+            state.apply(changed, deleted)
+            span.add(bytes_read=nbytes, bytes_written=nbytes, files=len(changed) + len(deleted))
+        self.log(f"Reused cached TSLPatcher result for {mod_name} ({len(changed)} files)")
+        return changed, deleted
+
+    def patch_in_place(self, file_path, extract_path, option, state):
+        """Run one patcher against the directory state tracks. Returns (changed, deleted, clean)"""
+        mod_name = os.path.splitext(os.path.basename(file_path))[0]
+        with self.profile.span("tslpatcher", mod_name) as span:
+            clean = self.run_patcher(file_path, extract_path, option, state.root_dir)
+            changed, deleted = state.refresh()
+            span.add(bytes_read=tree_stats(extract_path)[1],
+                     bytes_written=sum(state.stats[rel][0] for rel in changed),
+                     files=len(changed) + len(deleted))
+        return changed, deleted, clean
+
+    def patch_in_clone(self, file_path, extract_path, option, state, clone_dir, copiers):
+        """Run one patcher against a private copy of the tree state tracks.
+
+        Only the files its changes.ini touches, and dialog.tlk, are
+        really copied, since patchers edit files in place. The rest are
+        hard-linked from the tree, which patch_wave keeps read-only while
+        the wave runs. copiers are the (share, own) Copiers for
+        link_tree. Returns (clone state, changed, deleted, clean).
+        """
+        link_tree(state.root_dir, clone_dir, option_footprint(extract_path, option) | {TLK_NAME}, *copiers)
+        clone = TreeState(clone_dir, known=state.digests)
+        changed, deleted, clean = self.patch_in_place(file_path, extract_path, option, clone)
+        return clone, changed, deleted, clean
+
+    def plan_patcher_waves(self, runs, extracted):
+        """Choose each mod's install option and group the runs into waves.
+
+        runs are (archive path, extract path) in load order. Returns
+        waves of (archive path, extract path, option) tuples; mods whose
+        changes.ini files touch disjoint game files share a wave.
+        Archives that weren't extracted, or whose option couldn't be
+        chosen, get extract path None and a wave of their own.
+        """
+        footprints = []
+        for file_path, extract_path in runs:
+            errors_before = len(self.errors)
+            option = self.choose_patcher_option(file_path) if file_path in extracted else None
+            if file_path not in extracted or len(self.errors) > errors_before:
+                footprints.append(((file_path, None, None), None))
+                continue
+            footprint = frozenset() if option is None else option_footprint(extract_path, option)
+            footprints.append(((file_path, extract_path, option), footprint))
+        if self.options["patcher_workers"] <= 1:
+            return [[run] for run, _ in footprints]
+        waves = plan_waves(footprints)
+        if len(waves) == 1 and len(runs) > 1:
+            self.log(f"Running {len(runs)} TSLPatcher mods side by side; they touch different files")
+        elif len(waves) < len(runs):
+            self.log(f"Running {len(runs)} TSLPatcher mods in {len(waves)} waves of mods that touch different files")
+        return waves
+
+    def patch_wave(self, wave, state, patcher_cache):
+        """Apply a wave of TSLPatcher mods to dummy_kotor.
+
+        A wave of one mod runs in place, as does a mod whose cached
+        result disappeared before it was replayed. In a bigger wave every mod that
+        isn't cached runs side by side in its own copy of dummy_kotor,
+        and the copies' changes are moved into dummy_kotor in load order
+        once all of them have finished. Yields (archive path, cache key,
+        changed digests, deleted paths, clean) in load order as each
+        mod's changes land.
+        """
+        state_key = state.key()
+        keys = {file_path: self.patch_key(file_path, option, state_key)
+                for file_path, _, option in wave if option is not None}
+        cached = {file_path for file_path, key in keys.items()
+                  if self.options["reuse_patcher_results"] and patcher_cache.has(key)}
+        to_run = [run for run in wave if run[2] is not None and run[0] not in cached]
+        runs_dir = os.path.join(self.work_dir, "patcher_runs")
+        results = {}
+        try:
+            if len(wave) > 1 and to_run:
+                self.set_status(f"Running {len(to_run)} TSLPatcher mods side by side")
+                copiers = (Copier(), Copier(allow_hardlink=False))
+                os.makedirs(runs_dir, exist_ok=True)
+                for copier in copiers:
+                    # Probe once up front, outside the tree the clones are walking
+                    copier.strategies_for(state.root_dir, runs_dir)
+                # The pool waits for every run before the tree is made writable again
+                with read_only_tree(state.root_dir), ThreadPoolExecutor(
+                        max_workers=min(self.options["patcher_workers"], len(to_run)),
+                        thread_name_prefix="patcher") as pool:
+                    futures = {file_path: pool.submit(self.patch_in_clone, file_path, extract_path, option, state,
+                                                      os.path.join(runs_dir, f"{i:03d}"), copiers)
+                               for i, (file_path, extract_path, option) in enumerate(to_run)}
+                for file_path, future in futures.items():
+                    try:
+                        results[file_path] = future.result()
+                    except OSError as e:
+                        self.error(f"Could not copy the game directory for {os.path.basename(file_path)}: {str(e)}")
+                        results[file_path] = None
+
+            touched = {}
+            for file_path, extract_path, option in wave:
+                mod_name = os.path.splitext(os.path.basename(file_path))[0]
+                key = keys.get(file_path)
+                if extract_path is None or option is None:
+                    # Not extracted, or nothing to install
+                    yield file_path, None, {}, [], extract_path is not None
+                    continue
+                replayed = None
+                if file_path in cached:
+                    try:
+                        replayed = self.replay_patch(file_path, key, state, patcher_cache)
+                    except OSError as e:
+                        # Evicted by another build sharing the cache since has() said yes
+                        self.log(f"Cached TSLPatcher result for {mod_name} is gone ({str(e)}); "
+                                 f"running the patcher instead")
+                if replayed is not None:
+                    changed, deleted = replayed
+                    clean = True
+                elif len(wave) == 1 or file_path not in results:
+                    changed, deleted, clean = self.patch_in_place(file_path, extract_path, option, state)
+                    changed = {rel: state.digests[rel] for rel in changed}
+                    # Only clean runs are worth replaying
+                    if clean:
+                        patcher_cache.store(key, mod_name, state.root_dir, changed, deleted)
+                elif results[file_path] is None:
+                    yield file_path, key, {}, [], False
+                    continue
+                else:
+                    clone, changed, deleted, clean = results[file_path]
+                    changed = {rel: clone.digests[rel] for rel in changed}
+                    if clean:
+                        patcher_cache.store(key, mod_name, clone.root_dir, changed, deleted)
+                    self.merge_clone(clone, changed, deleted, state)
+                for rel in list(changed) + deleted:
+                    if rel.lower() in touched:
+                        self.log(f"Warning: {mod_name} and {touched[rel.lower()]} both changed {rel}, though "
+                                 f"their changes.ini files don't overlap; {mod_name}'s version is kept")
+                    touched[rel.lower()] = mod_name
+                yield file_path, key, changed, deleted, clean
+        finally:
+            self.reaper.discard(runs_dir)
+
+    def merge_clone(self, clone, changed, deleted, state):
+        """Move a patcher run's changes from its copy of the game directory into the one state tracks"""
+        for rel in deleted:
+            path = os.path.join(state.root_dir, rel)
+            if os.path.exists(path):
+                os.remove(path)
+        for rel in changed:
+            dest_path = os.path.join(state.root_dir, rel)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            os.replace(os.path.join(clone.root_dir, rel), dest_path)
+        state.apply(changed, deleted)
+
+    def combine_mods(self, progress=None):
+        """Combine all mods into final Android directory structure"""
+        self.log(f"\nCreating final package in: {self.android_dir}")
+
+        # Decide which source wins every final path before copying anything
+        self.log("Resolving TSLPatcher results and loose-file mods...")
+        with self.profile.span("resolve") as span:
+            plan = plan_overlay(self.work_dir)
+            span.add(files=len(plan))
+
+        # Hash every candidate once, in parallel; sync, the manifest and the report all reuse it
+        self.set_status("Hashing package files...")
+        with self.profile.span("hash") as span:
+            hashed_before = self.hash_store.hashed_bytes
+            digests = self.hash_store.hash_many(plan.sources())
+            span.add(bytes_read=self.hash_store.hashed_bytes - hashed_before, files=len(digests))
+        duplicates, conflicts = plan.classify(digests)
+        modules = self.check_module_conflicts(conflicts)
+        report_path = os.path.join(self.work_dir, "conflict_report.json")
+        plan.write_report(report_path, digests, modules)
+        self.log(f"Resolved {len(plan)} files, {len(conflicts)} shadowed by later mods, "
+                 f"{len(duplicates)} identical copies ignored (see {report_path})")
+        for (dest_rel, src_path, origin), shadowed in conflicts:
+            losers = ", ".join(o for _, _, o in shadowed)
+            self.log(f"Conflict: {dest_rel} from {origin} shadows {losers}")
+            if dest_rel in modules:
+                for line in comparison_lines(modules[dest_rel], modules[dest_rel]["origins"]):
+                    self.log(f"    {line}")
+        if self.options["merge_modules"] and modules:
+            self.merge_modules(plan, conflicts, modules)
+        if any(dest_rel.lower().endswith('.2da') for (dest_rel, _, _), _ in conflicts):
+            self.merge_2da_tables(plan, conflicts, digests)
+        if self.options["max_texture_size"] or self.options["compress_textures"]:
+            self.optimize_textures(plan, digests)
+
+        if self.options["write_tree"]:
+            self.write_package_tree(plan, progress)
+
+        if self.options["export_path"]:
+            self.export_archive(plan, progress)
+
+        # Record what this build contains and, if asked, what changed since the last shipped build
+        manifest_path = os.path.join(self.output_dir, PACKAGE_MANIFEST_NAME)
+        with self.profile.span("manifest") as span:
+            current = describe_package(plan, self.hash_store)
+            save_package_manifest(manifest_path, current)
+            span.add(files=len(current))
+        if self.options["delta_base"]:
+            self.write_delta_package(current)
+
+        self.log("\nMod installation complete!")
+        if self.options["write_tree"]:
+            self.log(f"Files are ready in: {self.android_dir}")
+
+    def package_copier(self):
+        """Copier for files leaving work/ for the package.
+
+        dummy_kotor and final_override are modified in place by later
+        builds (and by resumed ones), so their files are never hard-linked
+        into a package.
+        """
+        return Copier(self.options["copy_mode"],
+                      protect=[os.path.join(self.work_dir, name) for name in ("dummy_kotor", "final_override")])
+
+    def recover_package_tree(self):
+        """Move in the package tree a run built but didn't get to swap in before it stopped"""
+        live_root = os.path.join(self.output_dir, ANDROID_SUBDIR.partition('/')[0])
+        if recover_swap(live_root + STAGING_SUFFIX, live_root):
+            self.log(f"Moved the package the interrupted run built into {live_root}")
+
+    def write_package_tree(self, plan, progress=None):
+        """Build the final folder tree next to the live one and swap it in when complete.
+
+        Only new or changed files are copied; unchanged ones are linked
+        from the previous tree. If the build fails the previous tree
+        stays untouched.
+        """
+        root_name, _, below_root = ANDROID_SUBDIR.partition('/')
+        live_root = os.path.join(self.output_dir, root_name)
+        staged_root = live_root + STAGING_SUFFIX
+        # Left over from a build that failed before its swap
+        self.reaper.discard(staged_root)
+        if self.options["full_rebuild"]:
+            self.log("Full rebuild: copying every file into a new tree")
+        copier = self.package_copier()
+        try:
+            with self.profile.span("sync") as span:
+                copied, unchanged, deleted = sync_package(
+                    plan, os.path.join(staged_root, below_root), os.path.join(self.output_dir, MANIFEST_NAME),
+                    full_rebuild=self.options["full_rebuild"], copier=copier,
+                    log=self.log, check_cancelled=self.check_cancelled,
+                    on_file=progress.advance if progress else None, hash_store=self.hash_store,
+                    base_dir=self.android_dir)
+                span.add(bytes_read=copier.copied_bytes, bytes_written=copier.copied_bytes, files=copied)
+            swap_into_place(staged_root, live_root, self.reaper)
+        except BaseException:
+            self.reaper.discard(staged_root)
+            raise
+        self.log(f"Copied {copied} files, kept {unchanged} unchanged, removed {deleted} stale")
+        if copied:
+            self.log(f"Copy methods used: {copier.summary()}")
+
+    def check_module_conflicts(self, conflicts):
+        """Compare conflicting .mod/.erf/.rim files resource by resource.
+
+        Returns {path: comparison} with the origins of the compared
+        files in load order under "origins".
+        """
+        modules = {}
+        with self.profile.span("modules") as span:
+            for (dest_rel, src_path, origin), shadowed in conflicts:
+                if not is_module_archive(dest_rel):
+                    continue
+                self.check_cancelled()
+                entries = shadowed + [(dest_rel, src_path, origin)]
+                try:
+                    comparison = compare_archives([s for _, s, _ in entries])
+                except (OSError, ErfError) as e:
+                    self.log(f"Warning: could not compare {dest_rel}: {str(e)}")
+                    continue
+                comparison["origins"] = [o for _, _, o in entries]
+                comparison["sources"] = [s for _, s, _ in entries]
+                modules[dest_rel] = comparison
+                span.add(files=len(entries))
+        return modules
+
+    def merge_2da_tables(self, plan, conflicts, digests):
+        """Merge conflicting 2DA tables row by row against the game's own copies.
+
+        Without base_2da_dir the last table still wins and the log says
+        how much each earlier copy loses.
+        """
+        base_dir = self.options["base_2da_dir"]
+        base_names = {}
+        if base_dir and os.path.isdir(base_dir):
+            base_names = {name.lower(): os.path.join(base_dir, name) for name in os.listdir(base_dir)}
+        cache = TableCache(os.path.join(self.work_dir, TABLE_CACHE_DIR_NAME))
+        merged_dir = os.path.join(self.work_dir, "merged_2da")
+        unmerged = 0
+        with self.profile.span("2da_merge") as span:
+            for (dest_rel, src_path, origin), shadowed in conflicts:
+                name = dest_rel.rpartition('/')[2]
+                if not name.lower().endswith('.2da'):
+                    continue
+                self.check_cancelled()
+                entries = shadowed + [(dest_rel, src_path, origin)]
+                origins = [o for _, _, o in entries]
+                try:
+                    tables = [cache.load(s, digests[s]) for _, s, _ in entries]
+                    base_path = base_names.get(name.lower())
+                    if base_path is None:
+                        for earlier, earlier_origin in zip(tables[:-1], origins):
+                            changed, added, _ = diff_tables(earlier, tables[-1])
+                            removed = max(len(earlier) - len(tables[-1]), 0)
+                            self.log(f"    {dest_rel}: {origin} overrides {len(changed)} cells and drops {removed} rows "
+                                     f"of {earlier_origin}'s copy")
+                        unmerged += 1
+                        continue
+                    merged, changes, table_conflicts = merge_tables(
+                        cache.load(base_path, self.hash_store.digest(base_path)), tables)
+                    merged_path = os.path.join(merged_dir, *dest_rel.split('/'))
+                    os.makedirs(os.path.dirname(merged_path), exist_ok=True)
+                    write_binary(merged, merged_path)
+                except (OSError, TwoDAError) as e:
+                    self.log(f"Warning: could not merge {dest_rel}: {str(e)}")
+                    continue
+                plan.add(dest_rel, merged_path, MERGED_2DA_ORIGIN)
+                span.add(files=len(entries))
+                self.log(f"Merged {dest_rel} ({len(merged)} rows): " +
+                         ", ".join(f"{o} ({count} changes)" for o, count in zip(origins, changes)))
+                for row, column, indexes in table_conflicts:
+                    where = f"row {row}" if column is None else f"row {row}, column {column}"
+                    self.log(f"    {dest_rel} conflict at {where}: set by {', '.join(origins[i] for i in indexes)}; "
+                             f"{origins[indexes[-1]]} wins")
+        if unmerged and not base_dir:
+            self.log(f"{unmerged} 2DA tables come from more than one source; the last one of each is used "
+                     f"(set Base 2DA folder in the GUI or base_2da_dir in a build manifest to merge them)")
+        cache.prune()
+
+    def optimize_textures(self, plan, digests):
+        """Shrink the package's .tga textures for phones in a process pool.
+
+        Textures above max_texture_size are halved until they fit, and
+        with compress_textures they become DXT compressed .tpc files
+        unless the package already has a .tpc or .txi of the same name.
+        Results are cached by source hash, so unchanged textures are
+        never converted twice.
+        """
+        max_size = self.options["max_texture_size"]
+        compress = self.options["compress_textures"]
+        cache = TextureCache(os.path.join(self.work_dir, TEXTURE_CACHE_DIR_NAME), max_size)
+        os.makedirs(cache.cache_dir, exist_ok=True)
+        paths = {dest_rel.lower() for dest_rel, _, _ in plan.winners()}
+        textures = []
+        for dest_rel, src_path, origin in plan.winners():
+            if dest_rel.lower().startswith("override/") and dest_rel.lower().endswith(".tga"):
+                stem = dest_rel[:-len(".tga")].lower()
+                # The game would pick between the two .tpc files, and .txi instructions are tuned to the .tga
+                safe = f"{stem}.tpc" not in paths and f"{stem}.txi" not in paths
+                textures.append((dest_rel, src_path, compress and safe))
+
+        self.set_status(f"Optimizing {len(textures)} textures...")
+        results = {}
+        jobs = {}
+        with self.profile.span("textures") as span:
+            for dest_rel, src_path, compress_this in textures:
+                found, cached = cache.lookup(digests[src_path], compress_this)
+                if found:
+                    results[dest_rel] = cached
+                else:
+                    jobs[(src_path, cache.stem(digests[src_path], compress_this), max_size, compress_this)] = dest_rel
+            estimate = pure_python_estimate(sum(os.path.getsize(job[0]) for job in jobs), len(jobs))
+            if estimate is not None and estimate > SLOW_TEXTURES_SECONDS:
+                self.log(f"numpy is not installed, so {len(jobs)} textures are converted in pure Python; this "
+                         f"takes about {estimate / 60:.0f} min (pip install numpy makes it several times faster)")
+            pool = optimize_many(jobs)
+            try:
+                for job, cached, error in pool:
+                    self.check_cancelled()
+                    dest_rel = jobs[job]
+                    if error is not None:
+                        self.log(f"Warning: could not optimize {dest_rel}: {str(error)}")
+                        cached = None
+                    results[dest_rel] = cached
+                    span.add(bytes_read=os.path.getsize(job[0]),
+                             bytes_written=os.path.getsize(cached) if cached else 0, files=1)
+            finally:
+                pool.close()
+        cache.prune()
+
+        report = []
+        for dest_rel, src_path, _ in textures:
+            cached = results.get(dest_rel)
+            if cached is None:
+                continue
+            new_rel = dest_rel[:-len(".tga")] + os.path.splitext(cached)[1]
+            if new_rel != dest_rel:
+                plan.remove(dest_rel)
+            plan.add(new_rel, cached, OPTIMIZED_TEXTURE_ORIGIN)
+            report.append({"path": dest_rel, "output": new_rel, "source": src_path,
+                           "size": os.path.getsize(src_path), "optimized_size": os.path.getsize(cached)})
+        saved = sum(entry["size"] - entry["optimized_size"] for entry in report)
+        report_path = os.path.join(self.work_dir, TEXTURE_REPORT_NAME)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({"textures": len(textures), "optimized": report, "bytes_saved": saved}, f, indent=2)
+        self.log(f"Optimized {len(report)} of {len(textures)} textures, saving {saved / 1024 ** 2:.1f} MB "
+                 f"({len(jobs)} processed, {len(textures) - len(jobs)} from the cache; see {report_path})")
+
+    def merge_modules(self, plan, conflicts, modules):
+        """Replace each conflicting module archive with one holding every mod's resources"""
+        merged_dir = os.path.join(self.work_dir, "merged_modules")
+        with self.profile.span("module_merge") as span:
+            for (dest_rel, src_path, origin), shadowed in conflicts:
+                if dest_rel not in modules:
+                    continue
+                self.check_cancelled()
+                merged_path = os.path.join(merged_dir, *dest_rel.split('/'))
+                os.makedirs(os.path.dirname(merged_path), exist_ok=True)
+                count = merge_archives(modules[dest_rel]["sources"], merged_path)
+                plan.add(dest_rel, merged_path, MERGED_ORIGIN)
+                span.add(bytes_written=os.path.getsize(merged_path), files=1)
+                self.log(f"Merged {dest_rel}: {count} resources from {', '.join(modules[dest_rel]['origins'])}")
+
+    def write_delta_package(self, current):
+        """Write only the files that differ from the last shipped build, plus a deletion list"""
+        shipped_path = self.options["delta_base"]
+        if not os.path.exists(shipped_path):
+            self.log(f"No shipped build recorded at {shipped_path}; mark a build as shipped to get deltas")
+            return
+        delta_dir = os.path.join(self.output_dir, DELTA_DIR_NAME)
+        self.set_status("Writing delta package...")
+        with self.profile.span("delta") as span:
+            added, changed, deleted = write_delta(current, load_package_manifest(shipped_path), delta_dir,
+                                                  prefix=ANDROID_SUBDIR, copier=self.package_copier())
+            nbytes = sum(current[rel]["size"] for rel in added + changed)
+            span.add(bytes_read=nbytes, bytes_written=nbytes, files=len(added) + len(changed))
+        self.log(f"Delta package: {len(added)} added, {len(changed)} changed ({nbytes / 1024 ** 2:.1f} MB), "
+                 f"{len(deleted)} to delete (see {os.path.join(delta_dir, DELETE_LIST_NAME)})")
+
+        if self.options["export_path"]:
+            stem, ext = os.path.splitext(self.options["export_path"])
+            entries = sorted((f"{ANDROID_SUBDIR}/{rel}", current[rel]["source"]) for rel in added + changed)
+            export_entries(entries, f"{stem}-delta{ext}", check_cancelled=self.check_cancelled)
+            shutil.copy2(os.path.join(delta_dir, DELETE_LIST_NAME), f"{stem}-delta-{DELETE_LIST_NAME}")
+            self.log(f"Delta archive written to: {stem}-delta{ext}")
+
+    def export_archive(self, plan, progress=None):
+        """Stream the final package into a single .zip or .tar straight from the work files"""
+        export_path = self.options["export_path"]
+        self.set_status(f"Exporting {os.path.basename(export_path)}...")
+        self.log(f"Exporting {len(plan)} files to {export_path}")
+        read_bytes = []
+
+        def on_file(nbytes):
+            read_bytes.append(nbytes)
+            if progress:
+                progress.advance(nbytes)
+
+        with self.profile.span("export", os.path.basename(export_path)) as span:
+            # Paths inside the archive start at the device's storage root
+            archive_bytes = export_package(plan, export_path, prefix=ANDROID_SUBDIR, on_file=on_file,
+                                           check_cancelled=self.check_cancelled)
+            span.add(bytes_read=sum(read_bytes), bytes_written=archive_bytes, files=len(read_bytes))
+        self.log(f"Exported {sum(read_bytes) / 1024 ** 2:.1f} MB as a {archive_bytes / 1024 ** 2:.1f} MB archive")
+
+    def install(self):
+        """Run the whole pipeline. Returns True if every mod installed cleanly.
+
+        Raises InstallCancelled if the reporter asks to stop. Every run,
+        finished or not, writes a timing report next to the output.
+        """
+        result = "failed"
+        try:
+            if profiling_requested(self.options["profile"]):
+                with cprofile_session(os.path.join(self.output_dir, PROFILE_NAME), log=self.log):
+                    ok = self.run_pipeline()
+            else:
+                ok = self.run_pipeline()
+            result = "ok" if ok else "errors"
+            return ok
+        except InstallCancelled:
+            result = "cancelled"
+            raise
+        finally:
+            self.save_hashes()
+            self.write_run_report(result)
+
+    def save_hashes(self):
+        """Keep this run's file hashes for the next install"""
+        try:
+            self.hash_store.save()
+        except OSError as e:
+            self.log(f"Could not save file hashes: {str(e)}")
+
+    def write_run_report(self, result):
+        """Log the per-phase timing table and save the run report"""
+        self.log("\nTiming summary:")
+        for line in self.profile.summary_lines():
+            self.log(line)
+        report_path = os.path.join(self.output_dir, REPORT_NAME)
+        try:
+            self.profile.write_report(
+                report_path, result=result, errors=self.errors,
+                loose_mods=len(self.loose_files), tslpatcher_mods=len(self.tsl_files),
+                copy_mode=self.options["copy_mode"], full_rebuild=self.options["full_rebuild"])
+            self.log(f"Run report written to: {report_path}")
+        except OSError as e:
+            self.log(f"Could not write run report: {str(e)}")
+
+    def journal_inputs(self):
+        """What a resumed install has to match: the mod lists and the options that shape the work files"""
+        loose_filter = self.options["loose_filter"]
+        return {
+            "loose": self.loose_files,
+            "tslpatcher": self.tsl_files,
+            "loose_filter": loose_filter.signature() if loose_filter else None,
+            "patcher_command": self.options["patcher_command"],
+            "patcher_choices": self.options["patcher_choices"],
+            "base_tlk": self.options["base_tlk"],
+            "base_2da_dir": self.options["base_2da_dir"],
+        }
+
+    def open_journal(self):
+        """Load the interrupted install's journal when resuming, else start a new one.
+
+        Returns True when resuming. Raises ResumeRefused if the mod list,
+        the options or an archive used so far changed.
+        """
+        inputs = self.journal_inputs()
+        if self.options["resume"]:
+            if self.journal.load():
+                self.journal.check(inputs, self.hash_store.digest)
+                self.log(f"Resuming the interrupted install ({len(self.journal.steps)} steps already done)")
+                return True
+            self.log("No interrupted install to resume; starting from the beginning")
+        self.journal.start(inputs)
+        return False
+
+    def run_pipeline(self):
+        """Extract, patch and combine every mod"""
+        self.reporter.set_progress(0)
+        self.setup_directories()
+        self.recover_package_tree()
+        final_override = os.path.join(self.work_dir, "final_override")
+        staging_dir = os.path.join(self.work_dir, "staging")
+        patcher_mods = os.path.join(self.work_dir, "patcher_mods")
+        dummy_kotor = os.path.join(self.work_dir, "dummy_kotor")
+        merged_modules = os.path.join(self.work_dir, "merged_modules")
+        merged_2da = os.path.join(self.work_dir, "merged_2da")
+        patcher_runs = os.path.join(self.work_dir, "patcher_runs")
+        # Trees a previous run set aside but didn't get to delete. A resumed
+        # run also discards single extractions inside staging and patcher_mods
+        for parent in (self.work_dir, staging_dir, patcher_mods, self.output_dir):
+            self.reaper.sweep(parent)
+
+        # Use the preflight listings to warn early and to weight progress by bytes
+        self.set_status("Checking mod archives...")
+        weights = self.check_archives()
+
+        # Extraction, each TSLPatcher run and the final copy or export of loose files all move the bar
+        loose_bytes = sum(weights[f] for f in self.loose_files)
+        tsl_bytes = sum(weights[f] for f in self.tsl_files)
+        final_passes = int(self.options["write_tree"]) + int(bool(self.options["export_path"]))
+        progress = ByteProgress(loose_bytes + 2 * tsl_bytes + final_passes * loose_bytes,
+                                self.reporter.set_progress)
+
+        # A resumed install keeps the work of every journaled step
+        resuming = self.open_journal()
+        merged = resuming and self.journal.completed(MERGE_STEP) is not None
+        fresh = [merged_modules, merged_2da, patcher_runs]
+        if not merged:
+            fresh += [final_override, dummy_kotor]
+        if not resuming:
+            fresh += [staging_dir, patcher_mods]
+        for path in fresh:
+            self.reset_directory(path)
+        if not merged:
+            # TSLPatcher needs these to exist in the game directory
+            os.makedirs(os.path.join(dummy_kotor, "Override"))
+            os.makedirs(os.path.join(dummy_kotor, "Modules"))
+
+        # Extract every queued archive up front, each into its own directory.
+        # TSLPatcher mods are always extracted whole; the patcher needs its own files
+        self.set_status("Extracting mods...")
+        loose_jobs = [
+            (file_path, os.path.join(staging_dir, archive_utils.staging_name(i, file_path)),
+             self.options["loose_filter"])
+            for i, file_path in enumerate(self.loose_files)
+        ]
+        tsl_jobs = [
+            (file_path, os.path.join(patcher_mods, archive_utils.staging_name(i, file_path)), None)
+            for i, file_path in enumerate(self.tsl_files)
+        ]
+        extracted = set()
+        pending = []
+        for job in loose_jobs + tsl_jobs:
+            file_path, extract_path, _ = job
+            step = self.journal.completed(EXTRACT_STEP, file_path) if resuming else None
+            if step is not None and os.path.isdir(extract_path):
+                extracted.add(file_path)
+                self.archive_digests[file_path] = step["digest"]
+                progress.advance(weights[file_path])
+                continue
+            self.reaper.discard(extract_path)
+            pending.append(job)
+        if extracted:
+            self.log(f"Resuming: {len(extracted)} archives already extracted")
+        extracted |= self.extract_all(pending, lambda archive_path: progress.advance(weights[archive_path]))
+
+        # Merge loose-file mods in load order so later mods overwrite earlier ones
+        self.set_status("Installing loose-file mods...")
+        if merged:
+            self.log("Resuming: loose-file mods already merged")
+        else:
+            errors_before = len(self.errors)
+            self.merge_loose_mods(loose_jobs, extracted)
+            if len(self.errors) == errors_before and all(f in extracted for f in self.loose_files):
+                tree = TreeState(dummy_kotor).digests
+                self.journal.keep_files(dummy_kotor, tree)
+                self.journal.record(MERGE_STEP, changed=tree)
+
+        # Process TSLPatcher mods. dummy_kotor starts empty apart from dialog.tlk, so each
+        # run's result is fully determined by the mods before it and can be replayed
+        self.set_status("Installing TSLPatcher mods...")
+        patcher_cache = PatcherCache(os.path.join(self.cache_dir, PATCHER_CACHE_DIR_NAME))
+        state = TreeState(dummy_kotor)
+        if merged:
+            # Undo whatever the step that was interrupted left behind
+            fixed = self.journal.restore_tree(dummy_kotor, state)
+            if fixed:
+                self.log(f"Resuming: restored {fixed} files in dummy_kotor to the last finished step")
+        # Steps are journaled until the first one that fails; later ones build on its result
+        journaling = self.journal.completed(MERGE_STEP) is not None
+        try:
+            runs = []
+            for file_path, extract_path, _ in tsl_jobs:
+                step = self.journal.completed(PATCH_STEP, file_path) if merged else None
+                if step is not None:
+                    self.log(f"Resuming: {os.path.basename(file_path)} already patched")
+                    if step["key"] is not None:
+                        self.used_patcher_keys.add(step["key"])
+                    progress.advance(weights[file_path])
+                    self.reporter.patched(file_path)
+                else:
+                    runs.append((file_path, extract_path))
+            for wave in self.plan_patcher_waves(runs, extracted):
+                self.check_cancelled()
+                for file_path, key, changed, deleted, clean in self.patch_wave(wave, state, patcher_cache):
+                    if key is not None:
+                        self.used_patcher_keys.add(key)
+                    journaling = journaling and clean
+                    if journaling:
+                        self.journal.keep_files(dummy_kotor, changed)
+                        self.journal.record(PATCH_STEP, file_path, self.archive_digests[file_path], key=key,
+                                            changed=changed, deleted=deleted)
+                    progress.advance(weights[file_path])
+                    self.reporter.patched(file_path)
+        finally:
+            if self.options["evict_caches"]:
+                for key, info in patcher_cache.evict(keep=self.used_patcher_keys):
+                    self.log(f"Evicted cached TSLPatcher result of {info['name']}")
+            patcher_cache.save()
+
+        # Combine everything into final package
+        self.set_status("Creating final package...")
+        self.combine_mods(progress)
+        self.reporter.set_progress(100, "")
+        if not self.errors:
+            self.journal.finish()
+        return not self.errors
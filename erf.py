@@ -0,0 +1,247 @@
+import hashlib
+import mmap
+import os
+import struct
+
+# Archive types the game reads resources from; all share the ERF layout except RIM
+MODULE_EXTENSIONS = ('.erf', '.mod', '.rim', '.hak')
+FILE_TYPES = (b'ERF ', b'MOD ', b'HAK ', b'SAV ', b'RIM ')
+ERF_HEADER = struct.Struct('<4s4sIIIIIIIII')
+ERF_HEADER_SIZE = 160
+ERF_KEY = struct.Struct('<16sIHH')
+ERF_RESOURCE = struct.Struct('<II')
+RIM_HEADER = struct.Struct('<4s4sIIII')
+RIM_HEADER_SIZE = 120
+RIM_KEY = struct.Struct('<16sIIII')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+RESOURCE_TYPES = {
+    1: 'bmp', 3: 'tga', 4: 'wav', 6: 'plt', 7: 'ini', 10: 'txt', 2002: 'mdl', 2009: 'nss',
+    2010: 'ncs', 2012: 'are', 2013: 'set', 2014: 'ifo', 2015: 'bic', 2016: 'wok', 2017: '2da',
+    2022: 'txi', 2023: 'git', 2025: 'uti', 2027: 'utc', 2029: 'dlg', 2030: 'itp', 2032: 'utt',
+    2033: 'dds', 2035: 'uts', 2036: 'ltr', 2037: 'gff', 2038: 'fac', 2040: 'ute', 2042: 'utd',
+    2044: 'utp', 2045: 'dft', 2046: 'gic', 2047: 'gui', 2051: 'utm', 2052: 'dwk', 2053: 'pwk',
+    2056: 'jrl', 2058: 'utw', 2060: 'ssf', 2064: 'ndb', 2065: 'ptm', 2066: 'ptt', 3000: 'lyt',
+    3001: 'vis', 3002: 'rim', 3003: 'pth', 3004: 'lip', 3005: 'bwm', 3006: 'txb', 3007: 'tpc',
+    3008: 'mdx', 3009: 'rsv', 3010: 'sig', 3011: 'xbx', 9997: 'erf', 9998: 'bif', 9999: 'key',
+}
+
+
+class ErfError(ValueError):
+    """Raised for files that aren't valid ERF/MOD/RIM archives"""
+
+
+def is_module_archive(path):
+    return path.lower().endswith(MODULE_EXTENSIONS)
+
+
+def resource_name(resref, restype):
+    """File name of a resource as it would appear in Override"""
+    return f"{resref}.{RESOURCE_TYPES.get(restype, restype)}"
+
+
+class ResourceArchive:
+    """ERF, MOD, HAK or RIM archive read through a memory map.
+
+    Opening one reads only the header and key tables; resources maps
+    (lowercase resref, type) to (resref, offset, size) in archive order
+    and payloads are only touched when hashed or copied.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            if os.fstat(self.file.fileno()).st_size < 8:
+                raise ErfError(f"{os.path.basename(path)} is too small to be a resource archive")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.file_type = self.map[:4]
+            if self.file_type not in FILE_TYPES:
+                raise ErfError(f"{os.path.basename(path)} is not an ERF or RIM archive")
+            version = self.map[4:8]
+            if version != b'V1.0':
+                raise ErfError(f"{os.path.basename(path)} has unsupported version {version!r}")
+            self.resources = {}
+            if self.file_type == b'RIM ':
+                self.read_rim()
+            else:
+                self.read_erf()
+        except (ErfError, struct.error) as e:
+            self.close()
+            raise ErfError(str(e) if isinstance(e, ErfError) else f"{os.path.basename(path)} is truncated")
+
+    def read_erf(self):
+        (_, _, self.language_count, locstr_size, count, locstr_offset, keys_offset, resources_offset,
+         self.build_year, self.build_day, self.description) = ERF_HEADER.unpack_from(self.map, 0)
+        self.localized_strings = (locstr_offset, locstr_size)
+        for i in range(count):
+            resref, _, restype, _ = ERF_KEY.unpack_from(self.map, keys_offset + i * ERF_KEY.size)
+            offset, size = ERF_RESOURCE.unpack_from(self.map, resources_offset + i * ERF_RESOURCE.size)
+            self.add(resref, restype, offset, size)
+
+    def read_rim(self):
+        _, _, _, count, keys_offset, _ = RIM_HEADER.unpack_from(self.map, 0)
+        keys_offset = keys_offset or RIM_HEADER_SIZE
+        for i in range(count):
+            resref, restype, _, offset, size = RIM_KEY.unpack_from(self.map, keys_offset + i * RIM_KEY.size)
+            self.add(resref, restype, offset, size)
+
+    def add(self, resref, restype, offset, size):
+        resref = resref.split(b'\0', 1)[0].decode('ascii', errors='replace')
+        if offset + size > len(self.map):
+            raise ErfError(f"{os.path.basename(self.path)}: {resource_name(resref, restype)} runs past the end")
+        # Later duplicates win, as they do in the game
+        self.resources[(resref.lower(), restype)] = (resref, offset, size)
+
+    def size(self, key):
+        return self.resources[key][2]
+
+    def digest(self, key):
+        """Content hash of one resource, read straight from the map"""
+        _, offset, size = self.resources[key]
+        with memoryview(self.map) as view:
+            return hashlib.blake2b(view[offset:offset + size], digest_size=20).hexdigest()
+
+    def copy_to(self, key, f):
+        """Stream one resource's bytes into an open file"""
+        _, offset, size = self.resources[key]
+        end = offset + size
+        with memoryview(self.map) as view:
+            while offset < end:
+                f.write(view[offset:min(offset + COPY_CHUNK_SIZE, end)])
+                offset += COPY_CHUNK_SIZE
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_all(paths):
+    """Open archives, closing the ones already opened if any fails"""
+    archives = []
+    try:
+        for path in paths:
+            archives.append(ResourceArchive(path))
+    except Exception:
+        for archive in archives:
+            archive.close()
+        raise
+    return archives
+
+
+def compare_archives(paths):
+    """Resource-level comparison of same-named archives given in load order.
+
+    The last archive wins the file. Returns a dict with the resource
+    names that the archives disagree on ("changed", with the archive
+    index each one comes from) and the resources only the shadowed
+    archives provide, which the winner drops ("lost").
+    """
+    archives = open_all(paths)
+    try:
+        winner = archives[-1]
+        changed = []
+        lost = []
+        keys = {}
+        for index, archive in enumerate(archives):
+            for key in archive.resources:
+                keys.setdefault(key, []).append(index)
+        for key, indexes in keys.items():
+            name = resource_name(archives[indexes[-1]].resources[key][0], key[1])
+            if key not in winner.resources:
+                lost.append({"resource": name, "sources": indexes})
+            elif len(indexes) > 1:
+                sizes = {archives[i].size(key) for i in indexes}
+                if len(sizes) > 1 or len({archives[i].digest(key) for i in indexes}) > 1:
+                    changed.append({"resource": name, "sources": indexes})
+        return {"changed": changed, "lost": lost}
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+def comparison_lines(comparison, names):
+    """Readable summary of a compare_archives result; names label the archives"""
+    lines = []
+    for entry in comparison["changed"]:
+        *losers, winner = [names[i] for i in entry["sources"]]
+        lines.append(f"{entry['resource']}: {winner} replaces {', '.join(losers)}")
+    for entry in comparison["lost"]:
+        lines.append(f"{entry['resource']}: only in {', '.join(names[i] for i in entry['sources'])}, dropped")
+    return lines
+
+
+def merge_archives(paths, dest_path):
+    """Write one archive holding every resource of paths, later archives winning.
+
+    The output uses the last archive's format and header; resource data
+    is streamed from the memory maps so whole modules are never loaded.
+    Returns the number of resources written.
+    """
+    archives = open_all(paths)
+    try:
+        chosen = {}
+        for archive in archives:
+            for key in archive.resources:
+                chosen[key] = archive
+        temp_path = dest_path + ".partial"
+        with open(temp_path, 'wb') as f:
+            if archives[-1].file_type == b'RIM ':
+                write_rim(f, chosen)
+            else:
+                write_erf(f, archives[-1], chosen)
+        os.replace(temp_path, dest_path)
+        return len(chosen)
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+def encode_resref(resref):
+    return resref.encode('ascii', errors='replace')[:16]
+
+
+def write_erf(f, base, chosen):
+    """Write an ERF-family archive of chosen {key: archive}, keeping base's header fields"""
+    locstr_offset, locstr_size = base.localized_strings
+    count = len(chosen)
+    new_locstr_offset = ERF_HEADER_SIZE
+    keys_offset = new_locstr_offset + locstr_size
+    resources_offset = keys_offset + count * ERF_KEY.size
+    data_offset = resources_offset + count * ERF_RESOURCE.size
+    f.write(ERF_HEADER.pack(base.file_type, b'V1.0', base.language_count, locstr_size, count,
+                            new_locstr_offset, keys_offset, resources_offset,
+                            base.build_year, base.build_day, base.description))
+    f.write(b'\0' * (ERF_HEADER_SIZE - ERF_HEADER.size))
+    f.write(base.map[locstr_offset:locstr_offset + locstr_size])
+    for index, (key, archive) in enumerate(chosen.items()):
+        f.write(ERF_KEY.pack(encode_resref(archive.resources[key][0]), index, key[1], 0))
+    offset = data_offset
+    for key, archive in chosen.items():
+        size = archive.size(key)
+        f.write(ERF_RESOURCE.pack(offset, size))
+        offset += size
+    for key, archive in chosen.items():
+        archive.copy_to(key, f)
+
+
+def write_rim(f, chosen):
+    """Write a RIM archive of chosen {key: archive}"""
+    count = len(chosen)
+    f.write(RIM_HEADER.pack(b'RIM ', b'V1.0', 0, count, RIM_HEADER_SIZE, 0))
+    f.write(b'\0' * (RIM_HEADER_SIZE - RIM_HEADER.size))
+    offset = RIM_HEADER_SIZE + count * RIM_KEY.size
+    for index, (key, archive) in enumerate(chosen.items()):
+        size = archive.size(key)
+        f.write(RIM_KEY.pack(encode_resref(archive.resources[key][0]), key[1], index, offset, size))
+        offset += size
+    for key, archive in chosen.items():
+        archive.copy_to(key, f)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tarfile
+import zipfile
+
+# Formats that are already compressed; deflating them again only costs time
+STORED_EXTENSIONS = ('.tpc', '.mod', '.wav', '.mp3', '.bik', '.ogg')
+DEFLATE_LEVEL = 6
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def package_entries(plan, prefix=""):
+    """(archive name, source path) for every file in an OverlayPlan, in a stable order"""
+    entries = [(f"{prefix}/{dest_rel}" if prefix else dest_rel, src_path)
+               for dest_rel, src_path, origin in plan.winners()]
+    entries.sort()
+    return entries
+
+
+def export_zip(entries, dest_path, on_file=None, check_cancelled=None):
+    """Write (archive name, source path) entries to a zip, streaming each file from disk.
+
+    Already-compressed formats are stored and everything else is
+    deflated, one file at a time. zipfile switches an entry to zip64
+    when its size calls for it. Returns the size of the written archive;
+    a cancelled or failed export leaves nothing behind.
+    """
+    temp_path = dest_path + ".partial"
+    try:
+        with zipfile.ZipFile(temp_path, 'w', compresslevel=DEFLATE_LEVEL) as zf:
+            for arcname, src_path in entries:
+                if check_cancelled:
+                    check_cancelled()
+                # Knowing the size up front lets zipfile pick zip64 before it writes the header
+                info = zipfile.ZipInfo.from_file(src_path, arcname, strict_timestamps=False)
+                stored = arcname.lower().endswith(STORED_EXTENSIONS)
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                with open(src_path, 'rb') as src, zf.open(info, 'w') as dest:
+                    shutil.copyfileobj(src, dest, STREAM_CHUNK_SIZE)
+                if on_file:
+                    on_file(info.file_size)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return os.path.getsize(dest_path)
+
+
+def export_tar(entries, dest_path, on_file=None, check_cancelled=None):
+    """Write (archive name, source path) entries to an uncompressed tar, streaming each file"""
+    temp_path = dest_path + ".partial"
+    try:
+        with tarfile.open(temp_path, 'w', format=tarfile.PAX_FORMAT) as tar:
+            for arcname, src_path in entries:
+                if check_cancelled:
+                    check_cancelled()
+                info = tar.gettarinfo(src_path, arcname)
+                # Whole seconds and no owner keep PAX from adding an extended header per file
+                info.mtime = int(info.mtime)
+                info.uid = info.gid = 0
+                info.uname = info.gname = ""
+                with open(src_path, 'rb') as f:
+                    tar.addfile(info, f)
+                if on_file:
+                    on_file(info.size)
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return os.path.getsize(dest_path)
+
+
+def export_entries(entries, dest_path, on_file=None, check_cancelled=None):
+    """Write (archive name, source path) entries to a .zip or .tar chosen by dest_path's extension"""
+    if dest_path.lower().endswith('.zip'):
+        return export_zip(entries, dest_path, on_file=on_file, check_cancelled=check_cancelled)
+    if dest_path.lower().endswith('.tar'):
+        return export_tar(entries, dest_path, on_file=on_file, check_cancelled=check_cancelled)
+    raise ValueError(f"Unsupported export format: {os.path.basename(dest_path)} (use .zip or .tar)")
+
+
+def export_package(plan, dest_path, prefix="", on_file=None, check_cancelled=None):
+    """Export an OverlayPlan as a .zip or .tar straight from its source files"""
+    return export_entries(package_entries(plan, prefix), dest_path, on_file, check_cancelled)
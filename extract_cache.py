@@ -0,0 +1,225 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+from archive_utils import extract_archive
+from fastcopy import AUTO, HARDLINK, Copier
+from hashing import hash_file
+
+CACHE_DIR_NAME = "extract_cache"
+INDEX_NAME = "index.json"
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+# The builds of a build matrix share caches from several threads
+INDEX_LOCK = threading.Lock()
+
+
+def tree_stats(path):
+    """Number of files and their total size in bytes below path"""
+    count = 0
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            count += 1
+            total += os.path.getsize(os.path.join(root, file))
+    return count, total
+
+
+def entry_key(digest, member_filter=None):
+    """Name of the cached tree for an archive hash and extraction filter"""
+    if member_filter is None:
+        return digest
+    return f"{digest}-{member_filter.signature()}"
+
+
+def extract_cached(archive_path, extract_path, cache_dir, digest=None, copy_mode=AUTO, member_filter=None):
+    """Extract an archive through the cache.
+
+    Runs inside extraction worker processes, so it never touches the
+    index; the caller records the returned (digest, key, tree_bytes, hit,
+    stats), where stats holds the worker-side seconds, bytes read and
+    written and file count. Cached trees are never hard-linked out, so
+    later steps can't modify them through the staged copy. With
+    extract_path None the archive is only cached.
+    """
+    started = time.perf_counter()
+    bytes_read = 0
+    if digest is None:
+        bytes_read += os.path.getsize(archive_path)
+        digest = hash_file(archive_path)
+    key = entry_key(digest, member_filter)
+    entry = os.path.join(cache_dir, key)
+    hit = os.path.isdir(entry)
+    if not hit:
+        # Extract beside the entry and rename, so a half-written tree is never reused
+        temp_entry = f"{entry}.tmp-{os.getpid()}-{threading.get_ident()}"
+        if os.path.exists(temp_entry):
+            shutil.rmtree(temp_entry)
+        extract_archive(archive_path, temp_entry, member_filter)
+        bytes_read += os.path.getsize(archive_path)
+        try:
+            os.rename(temp_entry, entry)
+        except OSError:
+            shutil.rmtree(temp_entry)
+    if extract_path is not None:
+        copier = Copier(AUTO if copy_mode == HARDLINK else copy_mode, allow_hardlink=False)
+        shutil.copytree(entry, extract_path, copy_function=copier.copy2, dirs_exist_ok=True)
+    files, tree_bytes = tree_stats(entry)
+    copies = int(extract_path is not None) + int(not hit)
+    stats = {
+        "seconds": time.perf_counter() - started,
+        "bytes_read": bytes_read + (tree_bytes if extract_path is not None else 0),
+        # A miss writes the tree into the cache; extract_path gets a copy of it
+        "bytes_written": copies * tree_bytes,
+        "files": files,
+    }
+    return digest, key, tree_bytes, hit, stats
+
+
+class CacheStore:
+    """Directory of cached entries with a JSON index and a least-recently-used size cap.
+
+    Each entry is a subdirectory named by its key; the index records its
+    name, size and last use.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, INDEX_NAME)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self.read_index()
+        self.entries_by_key = self.index.get("entries", {})
+
+    def read_index(self):
+        """The index as saved on disk, or an empty one"""
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                # A damaged index only costs us the size/mtime shortcut
+                pass
+        return {}
+
+    def touch(self, key, name, nbytes):
+        """Mark an entry as just used"""
+        self.entries_by_key[key] = {
+            "name": name,
+            "bytes": nbytes,
+            "last_used": time.time(),
+        }
+
+    def entries(self):
+        """List cached entries as (key, info) pairs, most recently used first"""
+        return sorted(self.entries_by_key.items(),
+                      key=lambda item: item[1]["last_used"], reverse=True)
+
+    def total_bytes(self):
+        """Total size of all cached entries"""
+        return sum(info["bytes"] for info in self.entries_by_key.values())
+
+    def remove(self, key):
+        """Delete one cached entry"""
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        self.entries_by_key.pop(key, None)
+
+    def evict(self, keep=()):
+        """Drop least recently used entries until the cache fits max_bytes.
+
+        Returns the evicted (key, info) pairs.
+        """
+        evicted = []
+        total = self.total_bytes()
+        for key, info in reversed(self.entries()):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            self.remove(key)
+            total -= info["bytes"]
+            evicted.append((key, info))
+        return evicted
+
+    def purge(self):
+        """Delete every cached entry, returning the number of bytes freed"""
+        freed = self.total_bytes()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        self.entries_by_key = {}
+        self.save()
+        return freed
+
+    def index_data(self):
+        """Contents of the index file"""
+        return {"entries": self.entries_by_key}
+
+    def merge_index(self, index):
+        """Take in entries another user of the cache saved since we loaded it"""
+        for key, info in index.get("entries", {}).items():
+            mine = self.entries_by_key.get(key)
+            if mine is None or mine["last_used"] < info["last_used"]:
+                self.entries_by_key[key] = info
+        # Whoever evicted an entry deleted its directory
+        self.entries_by_key = {key: info for key, info in self.entries_by_key.items()
+                               if os.path.isdir(os.path.join(self.cache_dir, key))}
+
+    def save(self):
+        """Write the index atomically, keeping what other builds sharing the cache saved"""
+        with INDEX_LOCK:
+            self.merge_index(self.read_index())
+            temp_path = self.index_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.index_data(), f, indent=1)
+            os.replace(temp_path, self.index_path)
+
+
+class ExtractCache(CacheStore):
+    """Persistent store of extracted archive trees keyed by archive content hash.
+
+    Trees extracted with a member filter are stored separately per filter.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+        self.archives = self.index.get("archives", {})
+
+    def known_digest(self, archive_path):
+        """Return the archive's hash if its size and mtime match what we last saw"""
+        memo = self.archives.get(os.path.abspath(archive_path))
+        if memo is None:
+            return None
+        try:
+            stat = os.stat(archive_path)
+        except OSError:
+            return None
+        if memo["size"] == stat.st_size and memo["mtime"] == stat.st_mtime_ns:
+            return memo["digest"]
+        return None
+
+    def record(self, archive_path, digest, key, tree_bytes):
+        """Remember an archive's hash and mark its cached tree as just used"""
+        stat = os.stat(archive_path)
+        self.archives[os.path.abspath(archive_path)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "digest": digest,
+        }
+        self.touch(key, os.path.basename(archive_path), tree_bytes)
+
+    def purge(self):
+        """Delete every cached tree, returning the number of bytes freed"""
+        self.archives = {}
+        return super().purge()
+
+    def merge_index(self, index):
+        super().merge_index(index)
+        self.archives = dict(index.get("archives", {}), **self.archives)
+
+    def index_data(self):
+        return {"archives": self.archives, "entries": self.entries_by_key}
@@ -0,0 +1,218 @@
+import contextlib
+import os
+import shutil
+import stat
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+AUTO = "auto"
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+BUFFERED = "copy"
+
+# Preference order used by "auto"; the buffered copy always works
+STRATEGIES = (HARDLINK, REFLINK, COPY_FILE_RANGE, BUFFERED)
+COPY_MODES = (AUTO,) + STRATEGIES
+
+# ioctl number of FICLONE on Linux (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+BUFFER_SIZE = 1024 * 1024
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def copy_hardlink(src_path, dest_path):
+    """Make dest_path another name for src_path (same volume only)"""
+    os.link(src_path, dest_path)
+
+
+def copy_reflink(src_path, dest_path):
+    """Clone src_path's extents into dest_path without copying data"""
+    if fcntl is None:
+        raise OSError("reflink is not supported on this platform")
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dest_path)
+
+
+def copy_range(src_path, dest_path):
+    """Copy inside the kernel with os.copy_file_range"""
+    if not hasattr(os, "copy_file_range"):
+        raise OSError("copy_file_range is not supported on this platform")
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dest.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+    shutil.copystat(src_path, dest_path)
+
+
+def copy_buffered(src_path, dest_path):
+    """Plain byte copy with large buffers"""
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        shutil.copyfileobj(src, dest, BUFFER_SIZE)
+    shutil.copystat(src_path, dest_path)
+
+
+COPY_FUNCTIONS = {
+    HARDLINK: copy_hardlink,
+    REFLINK: copy_reflink,
+    COPY_FILE_RANGE: copy_range,
+    BUFFERED: copy_buffered,
+}
+
+
+def probe(src_dir, dest_dir, strategies=STRATEGIES):
+    """Return the strategies that work from src_dir to dest_dir, in preference order"""
+    os.makedirs(dest_dir, exist_ok=True)
+    available = []
+    fd, probe_src = tempfile.mkstemp(prefix=".copyprobe-", dir=src_dir)
+    try:
+        os.write(fd, b"KOTOR")
+        os.close(fd)
+        for name in strategies:
+            probe_dest = os.path.join(dest_dir, f".copyprobe-{name}-{os.getpid()}")
+            try:
+                COPY_FUNCTIONS[name](probe_src, probe_dest)
+                available.append(name)
+            except OSError:
+                pass
+            finally:
+                if os.path.lexists(probe_dest):
+                    os.remove(probe_dest)
+    finally:
+        os.remove(probe_src)
+    return available
+
+
+class Copier:
+    """Copies files with the fastest strategy each pair of volumes supports.
+
+    mode is "auto" to probe every strategy, or the name of a preferred
+    strategy; anything that fails falls back down STRATEGIES to the
+    buffered copy. Copies land under a temporary name and are renamed
+    over the destination, so existing files are replaced, not rewritten.
+    Files under the protect directories are never hard-linked, because
+    later steps modify them in place.
+    """
+
+    def __init__(self, mode=AUTO, allow_hardlink=True, protect=()):
+        if mode not in COPY_MODES:
+            raise ValueError(f"Unknown copy mode: {mode}")
+        self.mode = mode
+        self.allow_hardlink = allow_hardlink
+        self.protect = tuple(os.path.join(os.path.abspath(d), "") for d in protect)
+        self.volumes = {}
+        self.counts = {name: 0 for name in STRATEGIES}
+        self.copied_bytes = 0
+
+    def candidates(self):
+        """Strategies to try, before probing"""
+        if self.mode == AUTO:
+            names = STRATEGIES
+        else:
+            names = STRATEGIES[STRATEGIES.index(self.mode):]
+        return tuple(n for n in names if self.allow_hardlink or n != HARDLINK)
+
+    def strategies_for(self, src_path, dest_dir):
+        """Probe (once per pair of volumes) which strategies work for this copy"""
+        key = (os.stat(src_path).st_dev, os.stat(dest_dir).st_dev)
+        if key not in self.volumes:
+            try:
+                self.volumes[key] = probe(os.path.dirname(src_path), dest_dir, self.candidates())
+            except OSError:
+                # Source directory may be read-only; just try everything in order
+                self.volumes[key] = list(self.candidates())
+            if BUFFERED not in self.volumes[key]:
+                self.volumes[key].append(BUFFERED)
+        return self.volumes[key]
+
+    def copy(self, src_path, dest_path):
+        """Copy src_path to dest_path, returning the strategy that was used"""
+        dest_dir = os.path.dirname(dest_path) or "."
+        temp_path = dest_path + ".partial"
+        strategies = self.strategies_for(src_path, dest_dir)
+        if self.protect and os.path.abspath(src_path).startswith(self.protect):
+            strategies = [name for name in strategies if name != HARDLINK]
+        for name in strategies:
+            try:
+                if os.path.lexists(temp_path):
+                    os.remove(temp_path)
+                COPY_FUNCTIONS[name](src_path, temp_path)
+            except OSError:
+                if name == BUFFERED:
+                    raise
+                continue
+            # rename() does nothing when both names are links to the same file
+            if os.path.exists(dest_path) and os.path.samefile(temp_path, dest_path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, dest_path)
+            self.counts[name] += 1
+            self.copied_bytes += os.path.getsize(dest_path)
+            return name
+
+    def copy2(self, src_path, dest_path):
+        """shutil.copytree-compatible copy function"""
+        self.copy(src_path, dest_path)
+        return dest_path
+
+    def summary(self):
+        """Human readable per-strategy file counts"""
+        return ", ".join(f"{count} {name}" for name, count in self.counts.items() if count)
+
+
+def link_tree(src_root, dest_root, private=(), share=None, own=None):
+    """Give dest_root a copy of every file in src_root that costs next to nothing.
+
+    Files are hard-linked, falling back to a copy where links don't
+    work. The ones whose lowercased '/' separated path is in private
+    are really copied (reflinked where possible) and made writable,
+    since they are the only ones meant to change. share and own are the
+    Copiers used for the two kinds of file. Returns the number of files
+    copied rather than linked.
+    """
+    share = share or Copier()
+    own = own or Copier(allow_hardlink=False)
+    copied = 0
+    for root, dirs, files in os.walk(src_root):
+        dest_dir = os.path.join(dest_root, os.path.relpath(root, src_root))
+        os.makedirs(dest_dir, exist_ok=True)
+        for name in files:
+            src_path = os.path.join(root, name)
+            dest_path = os.path.join(dest_dir, name)
+            if os.path.relpath(src_path, src_root).replace(os.sep, '/').lower() in private:
+                own.copy(src_path, dest_path)
+                os.chmod(dest_path, os.stat(dest_path).st_mode | stat.S_IWUSR)
+                copied += 1
+            else:
+                share.copy(src_path, dest_path)
+    return copied
+
+
+@contextlib.contextmanager
+def read_only_tree(root_dir):
+    """Make every file below root_dir read-only until the block ends, then restore their modes.
+
+    Hard links to those files share the mode, so a link_tree copy can't
+    be used to change them in place.
+    """
+    modes = {}
+    try:
+        for root, dirs, files in os.walk(root_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                mode = stat.S_IMODE(os.stat(path).st_mode)
+                os.chmod(path, mode & ~WRITE_BITS)
+                modes[path] = mode
+        yield
+    finally:
+        for path, mode in modes.items():
+            if os.path.exists(path):
+                os.chmod(path, mode)
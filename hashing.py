@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_STORE_NAME = "hashes.json"
+HASH_BUFFER_SIZE = 1024 * 1024
+# hashlib releases the GIL on large buffers, so threads hash files in parallel
+HASH_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+
+def hash_file(path):
+    """Content hash of a file (blake2b, 20 bytes) used everywhere files are compared"""
+    digest = hashlib.blake2b(digest_size=20)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        for size in iter(lambda: f.readinto(buffer), 0):
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+class HashStore:
+    """Saved content hashes of files, reused while a file's size and mtime don't change.
+
+    Shared by the extraction cache, the final sync and the package
+    manifest so each file is read for hashing at most once per change.
+    Only entries used since loading are kept when saving.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.used = set()
+        self.hashed_bytes = 0
+        if os.path.exists(store_path):
+            try:
+                with open(store_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def cached(self, path, stat=None):
+        """Return the stored hash of path if the file hasn't changed since, else None"""
+        key = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return None
+        if entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            with self.lock:
+                self.used.add(key)
+            return entry[2]
+        return None
+
+    def record(self, path, digest, stat=None):
+        """Remember a hash computed elsewhere (for example in an extraction worker)"""
+        stat = stat or os.stat(path)
+        key = os.path.abspath(path)
+        with self.lock:
+            self.entries[key] = [stat.st_size, stat.st_mtime_ns, digest]
+            self.used.add(key)
+
+    def digest(self, path):
+        """Hash of path, from the store when possible"""
+        stat = os.stat(path)
+        digest = self.cached(path, stat)
+        if digest is None:
+            digest = hash_file(path)
+            self.record(path, digest, stat)
+            with self.lock:
+                self.hashed_bytes += stat.st_size
+        return digest
+
+    def hash_many(self, paths, max_workers=HASH_WORKERS):
+        """Hash many files in a thread pool. Returns {path: digest}"""
+        digests = {}
+        missing = []
+        for path in paths:
+            if path in digests:
+                continue
+            digest = self.cached(path)
+            if digest is None:
+                missing.append(path)
+                digests[path] = None
+            else:
+                digests[path] = digest
+        if len(missing) == 1:
+            digests[missing[0]] = self.digest(missing[0])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hash") as pool:
+                for path, digest in zip(missing, pool.map(self.digest, missing)):
+                    digests[path] = digest
+        return digests
+
+    def save(self):
+        """Write the entries used since loading"""
+        with self.lock:
+            data = {key: self.entries[key] for key in self.used if key in self.entries}
+        os.makedirs(os.path.dirname(self.store_path), exist_ok=True)
+        temp_path = self.store_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.store_path)
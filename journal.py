@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+
+from fastcopy import Copier
+from hashing import hash_file
+
+JOURNAL_NAME = "install_journal.json"
+CHECKPOINT_DIR_NAME = "checkpoint"
+EXTRACT_STEP = "extract"
+MERGE_STEP = "merge"
+PATCH_STEP = "patch"
+
+
+class ResumeRefused(Exception):
+    """Raised when a failed install can't be resumed safely"""
+
+
+class InstallJournal:
+    """Steps of the current install that finished cleanly, saved after each one.
+
+    Every step records the archive it used (with its content hash) and
+    what it did to the work directory. Patch steps record the files they
+    changed in dummy_kotor, and copies of those files are kept in
+    checkpoint/ by content hash, so a resumed install can put
+    dummy_kotor back exactly as it was after the last good step.
+    """
+
+    def __init__(self, work_dir):
+        self.path = os.path.join(work_dir, JOURNAL_NAME)
+        self.files_dir = os.path.join(work_dir, CHECKPOINT_DIR_NAME)
+        self.inputs = None
+        self.steps = []
+        self.copier = Copier(allow_hardlink=False)
+
+    def load(self):
+        """Read the journal of an earlier install. Returns False if there is none"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.inputs = data["inputs"]
+        self.steps = data["steps"]
+        return True
+
+    def start(self, inputs):
+        """Begin a new journal for an install of inputs, dropping any earlier one"""
+        self.inputs = inputs
+        self.steps = []
+        if os.path.exists(self.files_dir):
+            shutil.rmtree(self.files_dir)
+        self.save()
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"inputs": self.inputs, "steps": self.steps}, f)
+        os.replace(temp_path, self.path)
+
+    def record(self, step_type, archive_path=None, digest=None, **state):
+        """Add a finished step and save the journal"""
+        self.steps.append(dict(state, type=step_type, archive=archive_path, digest=digest))
+        self.save()
+
+    def completed(self, step_type, archive_path=None):
+        """The journaled step of this type for archive_path, or None"""
+        for step in self.steps:
+            if step["type"] == step_type and step["archive"] == archive_path:
+                return step
+        return None
+
+    def check(self, inputs, digest_of):
+        """Raise ResumeRefused unless the journal was written for these inputs.
+
+        digest_of(path) returns an archive's current content hash; every
+        archive a journaled step used must still have the hash it had.
+        """
+        if self.inputs != inputs:
+            raise ResumeRefused("The mod list or install options changed since the interrupted install")
+        for step in self.steps:
+            if step["archive"] is None:
+                continue
+            name = os.path.basename(step["archive"])
+            if not os.path.exists(step["archive"]):
+                raise ResumeRefused(f"{name} is missing")
+            if digest_of(step["archive"]) != step["digest"]:
+                raise ResumeRefused(f"{name} changed since the interrupted install")
+
+    def keep_files(self, root_dir, changed):
+        """Save copies of changed {relative path: digest} files below root_dir"""
+        for rel, digest in changed.items():
+            dest_path = os.path.join(self.files_dir, digest)
+            if not os.path.exists(dest_path):
+                os.makedirs(self.files_dir, exist_ok=True)
+                self.copier.copy(os.path.join(root_dir, rel), dest_path)
+
+    def tree(self):
+        """{relative path: digest} of dummy_kotor after the last journaled step, or None"""
+        merge = self.completed(MERGE_STEP)
+        if merge is None:
+            return None
+        tree = dict(merge["changed"])
+        for step in self.steps:
+            if step["type"] == PATCH_STEP:
+                tree.update(step["changed"])
+                for rel in step["deleted"]:
+                    tree.pop(rel, None)
+        return tree
+
+    def restore_tree(self, root_dir, state):
+        """Put root_dir back to the journaled tree, undoing a step that didn't finish.
+
+        state is the directory's TreeState. Returns the number of files
+        restored or removed.
+        """
+        tree = self.tree()
+        state.refresh()
+        fixed = 0
+        for rel in [rel for rel in state.digests if rel not in tree]:
+            os.remove(os.path.join(root_dir, rel))
+            fixed += 1
+        for rel, digest in tree.items():
+            if state.digests.get(rel) == digest:
+                continue
+            source = os.path.join(self.files_dir, digest)
+            if not os.path.exists(source) or hash_file(source) != digest:
+                raise ResumeRefused(f"The checkpoint copy of {rel} is missing or damaged")
+            dest_path = os.path.join(root_dir, rel)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            self.copier.copy(source, dest_path)
+            fixed += 1
+        state.refresh()
+        return fixed
+
+    def finish(self):
+        """Forget the journal once an install completes"""
+        if os.path.exists(self.files_dir):
+            shutil.rmtree(self.files_dir)
+        if os.path.exists(self.path):
+            os.remove(self.path)
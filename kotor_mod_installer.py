@@ -2,13 +2,49 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from tkinterdnd2 import DND_FILES, TkinterDnD
 import os
-import shutil
-import subprocess
-import py7zr
-import rarfile
-import zipfile
 from pathlib import Path
 import datetime
+import queue
+import threading
+import archive_utils
+from delta import SHIPPED_MANIFEST_NAME, mark_shipped
+from engine import ANDROID_SUBDIR, WORK_SUBDIRS, InstallCancelled, InstallEngine, Reporter
+from fastcopy import AUTO, COPY_MODES
+from mod_queue import (LOAD_ORDER_EXTENSION, LOOSE, MISSING, MOD_TYPE_NAMES, PROBLEMS, TSLPATCHER, ModQueue,
+                       archive_paths)
+from preflight import INDEX_NAME, PreflightIndex
+from reaper import Reaper
+from textures import DEFAULT_MAX_TEXTURE_SIZE
+
+# How often the Tk side drains events queued by the install worker
+EVENT_POLL_MS = 100
+# Upper bound on log lines written to the Text widget per refresh
+MAX_LOG_LINES_PER_TICK = 2000
+# Transfer archive written next to the Android folder when "Export .zip" is ticked
+EXPORT_NAME = "kotor_mods.zip"
+# Install errors listed in the status line; the rest are only in the log
+MAX_STATUS_ERRORS = 5
+# How long closing the window waits for a cancelled install to stop
+CLOSE_WAIT_SECONDS = 10
+# Colour of queued mods that are missing or failed their archive check
+PROBLEM_COLOR = "#b00020"
+
+class QueueReporter(Reporter):
+    """Forwards engine events to the Tk thread through the GUI's event queue"""
+    def __init__(self, gui):
+        self.gui = gui
+
+    def log(self, message):
+        self.gui.log(message)
+
+    def set_status(self, message):
+        self.gui.set_status(message)
+
+    def set_progress(self, value, detail=""):
+        self.gui.set_progress(value, detail)
+
+    def is_cancelled(self):
+        return self.gui.cancel_event.is_set()
 
 class ModInstallerGUI:
     def __init__(self, root):
@@ -21,6 +57,24 @@ class ModInstallerGUI:
         self.progress_var = tk.DoubleVar()
         self.status_var = tk.StringVar(value="Drag and drop mod files or use the Add buttons...")
         self.log_expanded = tk.BooleanVar(value=False)
+        self.full_rebuild = tk.BooleanVar(value=False)
+        self.copy_mode = tk.StringVar(value=AUTO)
+        self.skip_extras = tk.BooleanVar(value=True)
+        self.export_zip = tk.BooleanVar(value=False)
+        self.make_delta = tk.BooleanVar(value=False)
+        self.merge_modules = tk.BooleanVar(value=False)
+        self.optimize_textures = tk.BooleanVar(value=False)
+        self.base_tlk = tk.StringVar()
+        self.base_2da_dir = tk.StringVar()
+        # Install option chosen for TSLPatcher mods that ship several (archive path -> option name)
+        self.patcher_choices = {}
+        # Both load orders; the listboxes only display them
+        self.mods = ModQueue()
+        
+        # Worker thread state; the worker only talks to Tk through this queue
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
         
         # Show initial warning
         self.show_directory_info()
@@ -44,7 +98,8 @@ class ModInstallerGUI:
         output_frame.columnconfigure(1, weight=1)
         
         ttk.Label(output_frame, text="Output:").grid(row=0, column=0, padx=5)
-        ttk.Entry(output_frame, textvariable=self.output_path).grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5)
+        output_entry = ttk.Entry(output_frame, textvariable=self.output_path)
+        output_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5)
         
         path_buttons = ttk.Frame(output_frame)
         path_buttons.grid(row=0, column=2, padx=5)
@@ -61,11 +116,88 @@ class ModInstallerGUI:
         open_final_btn.pack(side=tk.LEFT, padx=2)
         self.create_tooltip(open_final_btn, "Open final package directory in File Explorer")
         
+        mark_shipped_btn = ttk.Button(path_buttons, text="Mark Shipped", command=self.mark_shipped)
+        mark_shipped_btn.pack(side=tk.LEFT, padx=2)
+        self.create_tooltip(mark_shipped_btn, "Record the last build as the one copied to your phone")
+        
         # Directory structure info (with label stored as instance variable)
         self.dir_info_label = ttk.Label(output_frame, justify=tk.LEFT)
         self.dir_info_label.grid(row=1, column=0, columnspan=3, sticky=tk.W, padx=5, pady=5)
         self.update_directory_info()  # Initial update of directory info
         
+        options_frame = ttk.Frame(output_frame)
+        options_frame.grid(row=2, column=0, columnspan=3, sticky=tk.W, padx=5)
+        
+        full_rebuild_check = ttk.Checkbutton(options_frame, text="Full rebuild", variable=self.full_rebuild)
+        full_rebuild_check.pack(side=tk.LEFT, padx=(0, 10))
+        self.create_tooltip(full_rebuild_check, "Delete and recopy the whole final package instead of only changed files")
+        
+        skip_extras_check = ttk.Checkbutton(options_frame, text="Skip non-game files", variable=self.skip_extras)
+        skip_extras_check.pack(side=tk.LEFT, padx=(0, 10))
+        self.create_tooltip(skip_extras_check,
+            "Don't extract readmes, screenshots, source art and tools from loose-file mods")
+        
+        export_zip_check = ttk.Checkbutton(options_frame, text="Export .zip", variable=self.export_zip)
+        export_zip_check.pack(side=tk.LEFT, padx=(0, 10))
+        self.create_tooltip(export_zip_check,
+            f"Also write the final package as {EXPORT_NAME} in the output directory.\n"
+            "One big file copies to the phone much faster than thousands of small ones.")
+        
+        make_delta_check = ttk.Checkbutton(options_frame, text="Delta package", variable=self.make_delta)
+        make_delta_check.pack(side=tk.LEFT, padx=(0, 10))
+        self.create_tooltip(make_delta_check,
+            "Also write only the files that changed since the build you marked as shipped,\n"
+            "plus a list of files to delete, in the 'delta' folder")
+        
+        merge_modules_check = ttk.Checkbutton(options_frame, text="Merge modules", variable=self.merge_modules)
+        merge_modules_check.pack(side=tk.LEFT, padx=(0, 10))
+        self.create_tooltip(merge_modules_check,
+            "When several mods ship the same .mod/.erf/.rim, combine their resources\n"
+            "(later mods win per resource) instead of keeping only the last file")
+        
+        optimize_textures_check = ttk.Checkbutton(options_frame, text="Optimize textures",
+                                                  variable=self.optimize_textures)
+        optimize_textures_check.pack(side=tk.LEFT, padx=(0, 10))
+        self.create_tooltip(optimize_textures_check,
+            f"Shrink Override .tga textures larger than {DEFAULT_MAX_TEXTURE_SIZE}px and convert them\n"
+            "to compressed .tpc, for a smaller package that uses less memory on the phone")
+        
+        ttk.Label(options_frame, text="Copy method:").pack(side=tk.LEFT)
+        copy_mode_box = ttk.Combobox(options_frame, textvariable=self.copy_mode, values=COPY_MODES,
+                                     state="readonly", width=16)
+        copy_mode_box.pack(side=tk.LEFT, padx=5)
+        self.create_tooltip(copy_mode_box,
+            "auto: fastest method the drive supports\n"
+            "hardlink: no copy at all; output files share storage with work files\n"
+            "reflink: copy-on-write clone (btrfs, XFS)\n"
+            "copy_file_range: copy inside the kernel\n"
+            "copy: plain byte copy")
+        
+        # The game's own files that conflicting mod files are merged against
+        base_files_frame = ttk.Frame(output_frame)
+        base_files_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), padx=5, pady=(5, 0))
+        base_files_frame.columnconfigure(1, weight=1)
+        
+        ttk.Label(base_files_frame, text="Base dialog.tlk:").grid(row=0, column=0, sticky=tk.W)
+        base_tlk_entry = ttk.Entry(base_files_frame, textvariable=self.base_tlk)
+        base_tlk_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5)
+        self.create_tooltip(base_tlk_entry,
+            "The game's unmodified dialog.tlk. When several loose-file mods ship a dialog.tlk,\n"
+            "their strings are merged against it instead of the last one replacing the others.\n"
+            "Leave empty to keep the last mod's table.")
+        base_tlk_btn = ttk.Button(base_files_frame, text="Browse", command=self.browse_base_tlk)
+        base_tlk_btn.grid(row=0, column=2)
+        
+        ttk.Label(base_files_frame, text="Base 2DA folder:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        base_2da_entry = ttk.Entry(base_files_frame, textvariable=self.base_2da_dir)
+        base_2da_entry.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5, pady=(5, 0))
+        self.create_tooltip(base_2da_entry,
+            "A folder with the game's unmodified .2da files. When several mods ship the same\n"
+            "table, their rows and cells are merged against the game's copy instead of the\n"
+            "last one replacing the others. Leave empty to keep the last mod's table.")
+        base_2da_btn = ttk.Button(base_files_frame, text="Browse", command=self.browse_base_2da_dir)
+        base_2da_btn.grid(row=1, column=2, pady=(5, 0))
+        
         # Loose-file mods frame
         loose_frame = ttk.LabelFrame(main_frame, text="Loose-File Mods", padding="5")
         loose_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
@@ -81,11 +213,11 @@ class ModInstallerGUI:
         # Loose-file mod buttons
         loose_buttons = ttk.Frame(loose_frame)
         loose_buttons.grid(row=1, column=0, columnspan=2, pady=5)
-        up_btn = ttk.Button(loose_buttons, text="↑", width=3, command=lambda: self.move_item(self.loose_files_listbox, -1))
+        up_btn = ttk.Button(loose_buttons, text="↑", width=3, command=lambda: self.move_item(LOOSE, -1))
         up_btn.grid(row=0, column=0, padx=2)
         self.create_tooltip(up_btn, "Move selected mod up in load order")
         
-        down_btn = ttk.Button(loose_buttons, text="↓", width=3, command=lambda: self.move_item(self.loose_files_listbox, 1))
+        down_btn = ttk.Button(loose_buttons, text="↓", width=3, command=lambda: self.move_item(LOOSE, 1))
         down_btn.grid(row=0, column=1, padx=2)
         self.create_tooltip(down_btn, "Move selected mod down in load order")
         
@@ -100,18 +232,23 @@ class ModInstallerGUI:
         tsl_scroll = ttk.Scrollbar(tsl_frame, orient=tk.VERTICAL, command=self.tsl_files_listbox.yview)
         tsl_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
         self.tsl_files_listbox.configure(yscrollcommand=tsl_scroll.set)
+        self.listboxes = {LOOSE: self.loose_files_listbox, TSLPATCHER: self.tsl_files_listbox}
         
         # TSLPatcher mod buttons
         tsl_buttons = ttk.Frame(tsl_frame)
         tsl_buttons.grid(row=1, column=0, columnspan=2, pady=5)
-        tsl_up_btn = ttk.Button(tsl_buttons, text="↑", width=3, command=lambda: self.move_item(self.tsl_files_listbox, -1))
+        tsl_up_btn = ttk.Button(tsl_buttons, text="↑", width=3, command=lambda: self.move_item(TSLPATCHER, -1))
         tsl_up_btn.grid(row=0, column=0, padx=2)
         self.create_tooltip(tsl_up_btn, "Move selected mod up in load order")
         
-        tsl_down_btn = ttk.Button(tsl_buttons, text="↓", width=3, command=lambda: self.move_item(self.tsl_files_listbox, 1))
+        tsl_down_btn = ttk.Button(tsl_buttons, text="↓", width=3, command=lambda: self.move_item(TSLPATCHER, 1))
         tsl_down_btn.grid(row=0, column=1, padx=2)
         self.create_tooltip(tsl_down_btn, "Move selected mod down in load order")
         
+        tsl_option_btn = ttk.Button(tsl_buttons, text="Install Option...", command=self.choose_patcher_option)
+        tsl_option_btn.grid(row=0, column=2, padx=2)
+        self.create_tooltip(tsl_option_btn, "Choose which option to install for mods that offer several")
+        
         # Main buttons frame
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=3, column=0, pady=10)
@@ -132,18 +269,39 @@ class ModInstallerGUI:
         clear_btn.grid(row=0, column=3, padx=5)
         self.create_tooltip(clear_btn, "Clear all mod lists")
         
-        install_btn = ttk.Button(button_frame, text="Install Mods", command=self.install_mods)
-        install_btn.grid(row=0, column=4, padx=5)
-        self.create_tooltip(install_btn, "Install all mods in the lists")
+        self.install_btn = ttk.Button(button_frame, text="Install Mods", command=self.start_install)
+        self.install_btn.grid(row=0, column=4, padx=5)
+        self.create_tooltip(self.install_btn, "Install all mods in the lists")
+        
+        self.resume_btn = ttk.Button(button_frame, text="Resume", command=lambda: self.start_install(resume=True))
+        self.resume_btn.grid(row=0, column=5, padx=5)
+        self.create_tooltip(self.resume_btn,
+            "Continue an interrupted or failed installation from the last mod that finished.\n"
+            "Refuses if the mod lists, options or an already installed archive changed.")
+        
+        self.cancel_btn = ttk.Button(button_frame, text="Cancel", command=self.cancel_install, state=tk.DISABLED)
+        self.cancel_btn.grid(row=0, column=6, padx=5)
+        self.create_tooltip(self.cancel_btn, "Stop the running installation after the current file")
         
         clean_btn = ttk.Button(button_frame, text="Clean Work Files", command=self.clean_work_files)
-        clean_btn.grid(row=0, column=5, padx=5)
+        clean_btn.grid(row=0, column=7, padx=5)
         self.create_tooltip(clean_btn, "Delete temporary work files (not your mod files)")
         
+        # Controls that change or delete the output directory while an install writes to it
+        self.output_controls = [output_entry, browse_btn, mark_shipped_btn, clean_btn]
+        
         help_btn = ttk.Button(button_frame, text="Help", command=self.show_directory_info)
-        help_btn.grid(row=0, column=6, padx=5)
+        help_btn.grid(row=0, column=8, padx=5)
         self.create_tooltip(help_btn, "Show directory structure information")
         
+        save_order_btn = ttk.Button(button_frame, text="Save Load Order...", command=self.save_load_order)
+        save_order_btn.grid(row=1, column=0, padx=5, pady=(5, 0))
+        self.create_tooltip(save_order_btn, "Save both mod lists and the chosen install options to a file")
+        
+        load_order_btn = ttk.Button(button_frame, text="Load Load Order...", command=self.load_load_order)
+        load_order_btn.grid(row=1, column=1, padx=5, pady=(5, 0))
+        self.create_tooltip(load_order_btn, "Replace both mod lists with a saved load order")
+        
         # Progress frame
         progress_frame = ttk.Frame(main_frame)
         progress_frame.grid(row=4, column=0, sticky=(tk.W, tk.E), pady=5)
@@ -153,6 +311,10 @@ class ModInstallerGUI:
         self.progress = ttk.Progressbar(progress_frame, length=400, mode='determinate', variable=self.progress_var)
         self.progress.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=5)
         
+        # Throughput and ETA next to the progress bar
+        self.progress_detail = tk.StringVar()
+        ttk.Label(progress_frame, textvariable=self.progress_detail, width=28).grid(row=0, column=1, padx=5)
+        
         # Status label
         self.status_var = tk.StringVar(value="Drag and drop mod files or use the Add buttons...")
         self.status_label = ttk.Label(main_frame, textvariable=self.status_var, wraplength=700)
@@ -179,8 +341,19 @@ class ModInstallerGUI:
         # Setup directories
         self.setup_directories()
         
+        # Archives are listed and checked in the background as soon as they are added
+        self.preflight = PreflightIndex(self.preflight_index_path(), on_result=self.report_preflight)
+        self.output_path.trace_add("write", self.update_preflight_path)
+        
+        # Old trees and work files are renamed aside and deleted off the Tk thread
+        self.reaper = Reaper(log=self.log)
+        
         # Setup drag and drop
         self.setup_drag_drop()
+        
+        # Start draining worker events and stop the worker when the window closes
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(EVENT_POLL_MS, self.process_events)
 
     def create_tooltip(self, widget, text):
         """Create a tooltip for a widget"""
@@ -220,12 +393,27 @@ class ModInstallerGUI:
             self.output_path.set(directory)
             # Directory info will update automatically due to trace
 
+    def browse_base_tlk(self):
+        """Browse for the game's dialog.tlk to merge mods' talk tables against"""
+        path = filedialog.askopenfilename(
+            title="Select the Game's dialog.tlk",
+            filetypes=[("Talk tables", "*.tlk"), ("All files", "*.*")]
+        )
+        if path:
+            self.base_tlk.set(path)
+
+    def browse_base_2da_dir(self):
+        """Browse for a folder of the game's .2da files to merge mods' tables against"""
+        directory = filedialog.askdirectory(title="Select the Folder with the Game's .2da Files")
+        if directory:
+            self.base_2da_dir.set(directory)
+
     def open_directory(self, dir_type):
         """Open directory in File Explorer"""
         if dir_type == "work":
             path = os.path.join(self.output_path.get(), "work")
         else:  # final
-            path = os.path.join(self.output_path.get(), "Android/data/com.aspyr.swkotor/files")
+            path = os.path.join(self.output_path.get(), ANDROID_SUBDIR)
         
         if os.path.exists(path):
             os.startfile(path)
@@ -234,6 +422,18 @@ class ModInstallerGUI:
                 f"The {dir_type} directory hasn't been created yet.\n"
                 "It will be created when you install mods.")
 
+    def mark_shipped(self):
+        """Record the last build as the one now on the phone, for delta packages"""
+        try:
+            count = mark_shipped(self.output_path.get())
+        except FileNotFoundError as e:
+            messagebox.showinfo("Mark Shipped", str(e))
+            return
+        self.log(f"Marked the last build ({count} files) as shipped")
+        messagebox.showinfo("Mark Shipped",
+            "The last build is now recorded as the one on your phone.\n"
+            "Tick 'Delta package' to get only the files that change from here on.")
+
     def show_directory_info(self):
         """Show information about directory structure"""
         info_text = (
@@ -266,24 +466,149 @@ class ModInstallerGUI:
         self.log_expanded.set(not self.log_expanded.get())
 
     def log(self, message):
-        """Add a message to the log with timestamp"""
+        """Queue a message for the log with timestamp (safe to call from the worker)"""
         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.root.update()
+        self.events.put(("log", f"[{timestamp}] {message}\n"))
+
+    def set_status(self, message):
+        """Queue a status line update (safe to call from the worker)"""
+        self.events.put(("status", message))
+
+    def set_progress(self, value, detail=""):
+        """Queue a progress bar update (safe to call from the worker)"""
+        self.events.put(("progress", (value, detail)))
+
+    def process_events(self):
+        """Drain queued worker events and apply them to the widgets in one batch"""
+        lines = []
+        status = None
+        progress = None
+        finished = False
+        checked = []
+        try:
+            while len(lines) < MAX_LOG_LINES_PER_TICK:
+                kind, payload = self.events.get_nowait()
+                if kind == "log":
+                    lines.append(payload)
+                elif kind == "status":
+                    status = payload
+                elif kind == "progress":
+                    progress = payload
+                elif kind == "preflight":
+                    checked.append(payload)
+                elif kind == "digests":
+                    self.mods.update_digests(payload)
+                elif kind == "done":
+                    finished = True
+        except queue.Empty:
+            pass
+        
+        # Only the latest status/progress of this tick is shown
+        if lines:
+            self.log_text.insert(tk.END, "".join(lines))
+            self.log_text.see(tk.END)
+        if status is not None:
+            self.status_var.set(status)
+        if progress is not None:
+            self.progress_var.set(progress[0])
+            self.progress_detail.set(progress[1])
+        updated = [entry for entry in (self.mods.update_preflight(path, info) for path, info in checked) if entry]
+        if updated:
+            self.refresh_lists(keep_selection=True)
+        if finished:
+            self.install_finished()
+        
+        self.root.after(EVENT_POLL_MS, self.process_events)
+
+    def start_install(self, resume=False):
+        """Snapshot the mod lists and run the installation on a worker thread"""
+        if self.worker is not None and self.worker.is_alive():
+            return
+        
+        output_dir = self.output_path.get()
+        loose_files = self.mods.paths(LOOSE)
+        tsl_files = self.mods.paths(TSLPATCHER)
+        options = self.snapshot_options()
+        options["resume"] = resume
+        
+        self.cancel_event.clear()
+        self.install_btn.configure(state=tk.DISABLED)
+        self.resume_btn.configure(state=tk.DISABLED)
+        self.cancel_btn.configure(state=tk.NORMAL)
+        for control in self.output_controls:
+            control.configure(state=tk.DISABLED)
+        self.worker = threading.Thread(
+            target=self.install_mods, args=(output_dir, loose_files, tsl_files, options), daemon=True)
+        self.worker.start()
+
+    def snapshot_options(self):
+        """Copy the build options out of the Tk variables for the worker"""
+        return {
+            "full_rebuild": self.full_rebuild.get(),
+            "copy_mode": self.copy_mode.get(),
+            "loose_filter": archive_utils.GAME_FILES_FILTER if self.skip_extras.get() else None,
+            "patcher_choices": dict(self.patcher_choices),
+            "export_path": os.path.join(self.output_path.get(), EXPORT_NAME) if self.export_zip.get() else None,
+            "delta_base": os.path.join(self.output_path.get(), SHIPPED_MANIFEST_NAME) if self.make_delta.get() else None,
+            "merge_modules": self.merge_modules.get(),
+            "max_texture_size": DEFAULT_MAX_TEXTURE_SIZE if self.optimize_textures.get() else None,
+            "compress_textures": self.optimize_textures.get(),
+            "base_tlk": self.base_tlk.get().strip() or None,
+            "base_2da_dir": self.base_2da_dir.get().strip() or None,
+        }
+
+    def cancel_install(self):
+        """Ask the running installation to stop after the current file"""
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.cancel_btn.configure(state=tk.DISABLED)
+            self.status_var.set("Cancelling installation...")
+
+    def install_finished(self):
+        """Re-enable the controls once the worker has finished"""
+        self.install_btn.configure(state=tk.NORMAL)
+        self.resume_btn.configure(state=tk.NORMAL)
+        self.cancel_btn.configure(state=tk.DISABLED)
+        for control in self.output_controls:
+            control.configure(state=tk.NORMAL)
+
+    def on_close(self):
+        """Cancel any running installation and let it stop before closing the window"""
+        self.cancel_event.set()
+        if self.worker is not None and self.worker.is_alive():
+            self.status_var.set("Cancelling installation...")
+            self.root.update_idletasks()
+            # The worker checks for cancellation between files, so this only waits for the current one
+            self.worker.join(timeout=CLOSE_WAIT_SECONDS)
+        self.preflight.shutdown()
+        # Finish deleting replaced trees so none are left half-deleted next to the package
+        self.reaper.wait()
+        self.reaper.shutdown()
+        self.root.destroy()
+
+    def preflight_index_path(self):
+        """Location of the preflight index for the current output directory"""
+        return os.path.join(self.output_path.get(), "work", INDEX_NAME)
+
+    def update_preflight_path(self, *args):
+        """Keep the preflight index next to the current work directory"""
+        self.preflight.index_path = self.preflight_index_path()
+
+    def report_preflight(self, archive_path, info):
+        """Log the result of a background archive check (called from the preflight pool)"""
+        name = os.path.basename(archive_path)
+        kind = ", TSLPatcher data" if info["tslpatchdata"] else ""
+        if len(info["patchers"]) > 1:
+            kind += f" ({len(info['patchers'])} install options)"
+        self.log(f"Checked {name}: {info['files']} files, {info['bytes'] / 1024 ** 2:.1f} MB{kind}")
+        for problem in info["problems"]:
+            self.log(f"Warning: {name}: {problem}")
+        self.events.put(("preflight", (archive_path, info)))
 
     def setup_directories(self):
         """Create necessary directories if they don't exist"""
         work_dir = os.path.join(self.output_path.get(), "work")
-        directories = [
-            os.path.join(work_dir, d) for d in [
-                'dummy_kotor/Override',
-                'dummy_kotor/Modules',
-                'final_override',
-                'TSLPatcher',
-                'patcher_mods'
-            ]
-        ]
+        directories = [os.path.join(work_dir, d) for d in WORK_SUBDIRS]
         for directory in directories:
             os.makedirs(directory, exist_ok=True)
         self.log(f"Created working directories in: {work_dir}")
@@ -300,60 +625,168 @@ class ModInstallerGUI:
         """Add loose-file mods through file dialog"""
         files = filedialog.askopenfilenames(
             filetypes=[("Archive files", "*.zip;*.7z;*.rar"), ("All files", "*.*")])
-        for file in files:
-            self.loose_files_listbox.insert(tk.END, file)
-            self.log(f"Added loose-file mod: {os.path.basename(file)}")
+        self.queue_mods(files, LOOSE, "Added")
 
     def add_tsl_files(self):
         """Add TSLPatcher mods through file dialog"""
         files = filedialog.askopenfilenames(
             filetypes=[("Archive files", "*.zip;*.7z;*.rar"), ("All files", "*.*")])
-        for file in files:
-            self.tsl_files_listbox.insert(tk.END, file)
-            self.log(f"Added TSLPatcher mod: {os.path.basename(file)}")
+        self.queue_mods(files, TSLPATCHER, "Added")
+
+    def queue_mods(self, files, mod_type, verb):
+        """Append archives to a load order, skipping ones already queued, and redraw once"""
+        added, skipped = self.mods.add(files, mod_type)
+        for entry in added:
+            self.log(f"{verb} {MOD_TYPE_NAMES[mod_type]} mod: {os.path.basename(entry.path)}")
+        for path in skipped:
+            entry = self.mods.get(path)
+            self.log(f"Skipped {os.path.basename(path)}: already queued as a {MOD_TYPE_NAMES[entry.mod_type]} mod")
+        self.check_queued(added)
+        if added:
+            self.refresh_lists(keep_selection=True)
+
+    def check_queued(self, entries):
+        """Fill in known archive check results and start checking the other archives"""
+        unchecked = []
+        for entry in entries:
+            if entry.preflight == MISSING:
+                continue
+            info = self.preflight.cached(entry.path)
+            if info is None:
+                unchecked.append(entry.path)
+            else:
+                self.mods.update_preflight(entry.path, info)
+        self.preflight.submit(unchecked)
+
+    def refresh_lists(self, keep_selection=False, selections=None):
+        """Redraw both listboxes from the mod queue.
+
+        selections maps a mod type to the positions to select afterwards;
+        with keep_selection the current selection and scroll position stay.
+        """
+        selections = selections or {}
+        for mod_type, listbox in self.listboxes.items():
+            entries = self.mods.entries(mod_type)
+            selected = selections.get(mod_type, listbox.curselection() if keep_selection else ())
+            top = listbox.yview()[0]
+            listbox.delete(0, tk.END)
+            if entries:
+                listbox.insert(tk.END, *[entry.label() for entry in entries])
+            for i, entry in enumerate(entries):
+                if entry.preflight in (MISSING, PROBLEMS):
+                    listbox.itemconfigure(i, foreground=PROBLEM_COLOR)
+            for i in selected:
+                listbox.selection_set(i)
+            listbox.yview_moveto(top)
+            if mod_type in selections and selected:
+                listbox.see(selected[0])
+
+    def choose_patcher_option(self):
+        """Let the user pick which install option of the selected TSLPatcher mod to use"""
+        selected = self.tsl_files_listbox.curselection()
+        if len(selected) != 1:
+            messagebox.showinfo("Install Option", "Select one TSLPatcher mod first.")
+            return
+        file_path = self.mods.entries(TSLPATCHER)[selected[0]].path
+        name = os.path.basename(file_path)
+        
+        # Options come from the background archive check, so nothing is extracted here
+        info = self.preflight.cached(file_path)
+        if info is None:
+            self.preflight.submit([file_path])
+            messagebox.showinfo("Install Option", f"{name} is still being checked. Try again in a moment.")
+            return
+        option_sets = info["patchers"]
+        if len(option_sets) < 2:
+            text = f"{name} has only one install option." if option_sets else f"{name} has no tslpatchdata folder."
+            messagebox.showinfo("Install Option", text)
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Install Option")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        ttk.Label(dialog, text=f"Install option for {name}:").pack(anchor=tk.W, padx=10, pady=(10, 5))
+        choice = tk.StringVar(value=self.patcher_choices.get(file_path, option_sets[0]["name"]))
+        for option in option_sets:
+            ttk.Radiobutton(dialog, text=option["name"], variable=choice, value=option["name"]).pack(
+                anchor=tk.W, padx=20)
+        
+        def apply_choice():
+            self.patcher_choices[file_path] = choice.get()
+            self.log(f"{name}: will install '{choice.get()}'")
+            dialog.destroy()
+        
+        ttk.Button(dialog, text="OK", command=apply_choice).pack(pady=10)
 
     def remove_selected(self):
         """Remove selected items from both listboxes"""
-        for i in reversed(self.loose_files_listbox.curselection()):
-            self.log(f"Removed loose-file mod: {self.loose_files_listbox.get(i)}")
-            self.loose_files_listbox.delete(i)
-        for i in reversed(self.tsl_files_listbox.curselection()):
-            self.log(f"Removed TSLPatcher mod: {self.tsl_files_listbox.get(i)}")
-            self.tsl_files_listbox.delete(i)
+        for mod_type, listbox in self.listboxes.items():
+            for entry in self.mods.remove(mod_type, listbox.curselection()):
+                self.patcher_choices.pop(entry.path, None)
+                self.log(f"Removed {MOD_TYPE_NAMES[mod_type]} mod: {entry.path}")
+        self.refresh_lists()
 
     def drop_loose_files(self, event):
-        """Handle files dropped onto loose-file listbox"""
-        files = self.root.tk.splitlist(event.data)
-        for file in files:
-            if file.lower().endswith(('.zip', '.7z', '.rar')):
-                self.loose_files_listbox.insert(tk.END, file)
-                self.log(f"Dropped loose-file mod: {os.path.basename(file)}")
+        """Handle files or folders of archives dropped onto loose-file listbox"""
+        self.queue_mods(archive_paths(self.root.tk.splitlist(event.data)), LOOSE, "Dropped")
 
     def drop_tsl_files(self, event):
-        """Handle files dropped onto TSLPatcher listbox"""
-        files = self.root.tk.splitlist(event.data)
-        for file in files:
-            if file.lower().endswith(('.zip', '.7z', '.rar')):
-                self.tsl_files_listbox.insert(tk.END, file)
-                self.log(f"Dropped TSLPatcher mod: {os.path.basename(file)}")
+        """Handle files or folders of archives dropped onto TSLPatcher listbox"""
+        self.queue_mods(archive_paths(self.root.tk.splitlist(event.data)), TSLPATCHER, "Dropped")
 
     def clear_all(self):
         """Clear both listboxes"""
-        self.loose_files_listbox.delete(0, tk.END)
-        self.tsl_files_listbox.delete(0, tk.END)
+        self.mods.clear()
+        self.refresh_lists()
         self.status_var.set("All files cleared. Ready for new mods...")
         self.log("Cleared all mod lists")
 
+    def save_load_order(self):
+        """Save both load orders and the chosen install options to a file"""
+        order_path = filedialog.asksaveasfilename(
+            defaultextension=LOAD_ORDER_EXTENSION, filetypes=[("Load order", f"*{LOAD_ORDER_EXTENSION}")])
+        if not order_path:
+            return
+        try:
+            self.mods.save(order_path, self.patcher_choices)
+        except OSError as e:
+            messagebox.showerror("Save Load Order", f"Could not save the load order: {str(e)}")
+            return
+        self.log(f"Saved load order of {len(self.mods)} mods to {order_path}")
+
+    def load_load_order(self):
+        """Replace both load orders with a saved one"""
+        order_path = filedialog.askopenfilename(filetypes=[("Load order", f"*{LOAD_ORDER_EXTENSION}")])
+        if not order_path:
+            return
+        try:
+            self.patcher_choices, changed = self.mods.load(order_path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            messagebox.showerror("Load Load Order", f"Could not read the load order: {str(e)}")
+            return
+        entries = self.mods.entries(LOOSE) + self.mods.entries(TSLPATCHER)
+        for entry in entries:
+            if entry.preflight == MISSING:
+                self.log(f"Warning: {entry.path} no longer exists")
+        for path in changed:
+            self.log(f"Note: {os.path.basename(path)} changed since the load order was saved")
+        self.check_queued(entries)
+        self.refresh_lists()
+        self.log(f"Loaded load order of {len(self.mods)} mods from {order_path}")
+
     def clean_work_files(self):
         """Clean up temporary work files with user confirmation"""
+        if self.worker is not None and self.worker.is_alive():
+            return
         work_dir = os.path.join(self.output_path.get(), "work")
         if os.path.exists(work_dir):
             if messagebox.askyesno("Clean Work Files", 
                 "This will delete all temporary work files, but NOT your mod files or the final package.\n\n"
                 "Do you want to continue?"):
                 try:
-                    shutil.rmtree(work_dir)
-                    self.log("Cleaned up work directory")
+                    self.reaper.discard(work_dir)
+                    self.log("Cleaned up work directory (old files are deleted in the background)")
                     messagebox.showinfo("Success", "Work files have been cleaned up")
                 except Exception as e:
                     error_msg = f"Error cleaning work files: {str(e)}"
@@ -362,188 +795,46 @@ class ModInstallerGUI:
         else:
             messagebox.showinfo("Info", "No work files to clean")
 
-    def move_item(self, listbox, direction):
-        """Move selected item up or down in the listbox"""
-        selected = listbox.curselection()
+    def move_item(self, mod_type, direction):
+        """Move the selected mods up or down in the load order together"""
+        selected = self.listboxes[mod_type].curselection()
         if not selected:
             return
-        
-        for pos in selected:
-            if direction == -1 and pos == 0:  # Can't move up
-                continue
-            if direction == 1 and pos == listbox.size() - 1:  # Can't move down
-                continue
-            
-            text = listbox.get(pos)
-            listbox.delete(pos)
-            new_pos = pos + direction
-            listbox.insert(new_pos, text)
-            listbox.selection_set(new_pos)
-
-    def extract_archive(self, archive_path, extract_path):
-        """Extract various archive formats"""
-        try:
-            if archive_path.lower().endswith('.zip'):
-                with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_path)
-            elif archive_path.lower().endswith('.7z'):
-                with py7zr.SevenZipFile(archive_path, 'r') as sz:
-                    sz.extractall(extract_path)
-            elif archive_path.lower().endswith('.rar'):
-                with rarfile.RarFile(archive_path, 'r') as rf:
-                    rf.extractall(extract_path)
-            self.log(f"Extracted: {os.path.basename(archive_path)} to {extract_path}")
-            return True
-        except Exception as e:
-            error_msg = f"Error extracting {os.path.basename(archive_path)}: {str(e)}"
-            self.status_var.set(error_msg)
-            self.log(error_msg)
-            return False
-
-    def flatten_directory(self, source_dir, dest_dir):
-        """Recursively copy all files from source_dir to dest_dir, flattening the directory structure"""
-        self.log(f"Flattening directory: {source_dir}")
-        for root, dirs, files in os.walk(source_dir):
-            for file in files:
-                src_path = os.path.join(root, file)
-                # Skip dialog.tlk as it doesn't go in Override
-                if file.lower() == 'dialog.tlk':
-                    continue
-                # Get relative path from source_dir to handle nested files
-                rel_path = os.path.relpath(src_path, source_dir)
-                # If file is in a subdirectory, just take the filename
-                dest_file = os.path.basename(rel_path)
-                dest_path = os.path.join(dest_dir, dest_file)
-                self.log(f"Copying: {rel_path} -> {dest_file}")
-                # Copy file to destination, overwriting if exists
-                shutil.copy2(src_path, dest_path)
-
-    def combine_mods(self):
-        """Combine all mods into final Android directory structure"""
-        # Create Android directory structure
-        android_dir = os.path.join(self.output_path.get(), "Android/data/com.aspyr.swkotor/files")
-        override_dir = os.path.join(android_dir, "Override")
-        modules_dir = os.path.join(android_dir, "Modules")
-        
-        self.log(f"\nCreating final package in: {android_dir}")
-        
-        # Clean up existing final_package directory
-        if os.path.exists(android_dir):
-            self.log("Cleaning up existing output directory")
-            shutil.rmtree(android_dir)
-        
-        # Create directories
-        os.makedirs(override_dir, exist_ok=True)
-        os.makedirs(modules_dir, exist_ok=True)
-        
-        work_dir = os.path.join(self.output_path.get(), "work")
-        
-        # Copy TSLPatcher results first
-        dummy_override = os.path.join(work_dir, "dummy_kotor/Override")
-        dummy_modules = os.path.join(work_dir, "dummy_kotor/Modules")
-        
-        if os.path.exists(dummy_override):
-            self.log("Processing TSLPatcher results...")
-            self.flatten_directory(dummy_override, override_dir)
-        if os.path.exists(dummy_modules):
-            self.log("Processing TSLPatcher modules...")
-            self.flatten_directory(dummy_modules, modules_dir)
-        
-        # Copy loose-file mods last to ensure patches override their base mods
-        final_override = os.path.join(work_dir, "final_override")
-        if os.path.exists(final_override):
-            self.log("Processing loose-file mods...")
-            for item in os.listdir(final_override):
-                src_path = os.path.join(final_override, item)
-                if os.path.isfile(src_path):
-                    if item.lower() == 'dialog.tlk':
-                        self.log("Copying dialog.tlk...")
-                        shutil.copy2(src_path, os.path.join(android_dir, item))
-                    else:
-                        self.log(f"Copying file: {item}")
-                        shutil.copy2(src_path, os.path.join(override_dir, item))
-                elif os.path.isdir(src_path):
-                    # Look for files in Override subdirectory
-                    override_subdir = os.path.join(src_path, "Override")
-                    if os.path.exists(override_subdir):
-                        self.flatten_directory(override_subdir, override_dir)
-                    else:
-                        # If no Override subdirectory, process the directory itself
-                        self.flatten_directory(src_path, override_dir)
-        
-        self.log("\nMod installation complete!")
-        self.log(f"Files are ready in: {android_dir}")
-
-    def install_mods(self):
-        """Main installation process"""
-        self.progress_var.set(0)
-        total_steps = self.loose_files_listbox.size() + self.tsl_files_listbox.size() + 3
-        current_step = 0
-        
+        positions = self.mods.move(mod_type, selected, direction)
+        self.refresh_lists(selections={mod_type: positions})
+
+    def install_mods(self, output_dir, loose_files, tsl_files, options):
+        """Main installation process (runs on the worker thread)"""
         try:
-            work_dir = os.path.join(self.output_path.get(), "work")
-            
-            # Process loose-file mods
-            self.status_var.set("Installing loose-file mods...")
-            final_override = os.path.join(work_dir, "final_override")
-            for i in range(self.loose_files_listbox.size()):
-                file_path = self.loose_files_listbox.get(i)
-                if self.extract_archive(file_path, final_override):
-                    self.status_var.set(f"Extracted {os.path.basename(file_path)}")
-                current_step += 1
-                self.progress_var.set((current_step / total_steps) * 100)
-            
-            # Copy dialog.tlk to dummy_kotor
-            dialog_tlk = os.path.join(final_override, "dialog.tlk")
-            dummy_kotor = os.path.join(work_dir, "dummy_kotor")
-            if os.path.exists(dialog_tlk):
-                shutil.copy2(dialog_tlk, os.path.join(dummy_kotor, "dialog.tlk"))
-            
-            # Process TSLPatcher mods
-            self.status_var.set("Installing TSLPatcher mods...")
-            for i in range(self.tsl_files_listbox.size()):
-                file_path = self.tsl_files_listbox.get(i)
-                mod_name = os.path.splitext(os.path.basename(file_path))[0]
-                extract_path = os.path.join(work_dir, "patcher_mods", mod_name)
-                
-                if self.extract_archive(file_path, extract_path):
-                    self.status_var.set(f"Running TSLPatcher for {mod_name}")
-                    
-                    # Find and run TSLPatcher
-                    for root, dirs, files in os.walk(extract_path):
-                        if 'tslpatchdata' in dirs:
-                            tsl_dir = os.path.dirname(root)
-                            if os.path.exists(os.path.join(tsl_dir, 'TSLPatcher.exe')):
-                                try:
-                                    subprocess.run([os.path.join(tsl_dir, 'TSLPatcher.exe'), 
-                                                 os.path.abspath(dummy_kotor)],
-                                                 check=True)
-                                except subprocess.CalledProcessError as e:
-                                    error_msg = f"Error running TSLPatcher for {mod_name}: {str(e)}"
-                                    self.status_var.set(error_msg)
-                                    self.log(error_msg)
-                
-                current_step += 1
-                self.progress_var.set((current_step / total_steps) * 100)
-            
-            # Combine everything into final package
-            self.status_var.set("Creating final package...")
-            self.combine_mods()
-            current_step += 1
-            self.progress_var.set(100)
-            
-            final_path = os.path.join(self.output_path.get(), "Android/data/com.aspyr.swkotor/files")
-            self.status_var.set(
+            engine = InstallEngine(output_dir, loose_files, tsl_files, options,
+                                   reporter=QueueReporter(self), preflight=self.preflight, reaper=self.reaper)
+            succeeded = engine.install()
+            self.events.put(("digests", dict(engine.archive_digests)))
+            if not succeeded:
+                errors = "\n".join(engine.errors[:MAX_STATUS_ERRORS])
+                more = len(engine.errors) - MAX_STATUS_ERRORS
+                if more > 0:
+                    errors += f"\n...and {more} more (see the log)"
+                self.set_status(f"Installation finished with {len(engine.errors)} errors:\n\n{errors}\n\n"
+                                "The package was built without the failed mods. Fix the problems and click Resume.")
+                self.log(f"Installation finished with {len(engine.errors)} errors")
+                return
+            self.set_status(
                 f"Installation complete!\n\n"
-                f"Files are in:\n{final_path}\n\n"
-                f"Work files are in:\n{work_dir}\n\n"
+                f"Files are in:\n{engine.android_dir}\n\n"
+                f"Work files are in:\n{engine.work_dir}\n\n"
                 "You can use 'Clean Work Files' to remove temporary files after confirming everything works."
             )
-            
+        
+        except InstallCancelled:
+            self.set_status("Installation cancelled.")
+            self.log("Installation cancelled by user")
         except Exception as e:
             error_msg = f"Error during installation: {str(e)}"
-            self.status_var.set(error_msg)
+            self.set_status(error_msg)
             self.log(error_msg)
+        finally:
+            self.events.put(("done", None))
 
 def main():
     root = TkinterDnD.Tk()
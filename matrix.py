@@ -0,0 +1,254 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import archive_utils
+from engine import InstallCancelled, InstallEngine, Reporter, parse_build_manifest, read_toml
+from extract_cache import CACHE_DIR_NAME, ExtractCache, extract_cached
+from fastcopy import AUTO
+from patcher_cache import PATCHER_CACHE_DIR_NAME, PatcherCache
+from reaper import Reaper
+
+# Holds the extraction and TSLPatcher caches every profile shares
+SHARED_DIR_NAME = "shared"
+# Keeps log lines from builds running side by side from interleaving
+LOG_LOCK = threading.Lock()
+
+
+class Profile:
+    """One named build of a build matrix"""
+
+    def __init__(self, name, output_dir, loose_files, tsl_files, options):
+        self.name = name
+        self.output_dir = output_dir
+        self.loose_files = loose_files
+        self.tsl_files = tsl_files
+        self.options = options
+
+
+def load_matrix_manifest(manifest_path, reporter=None):
+    """Read a build matrix manifest into a BuildMatrix.
+
+    Top-level keys apply to every profile; each [profiles.<name>] table
+    adds or replaces keys for one profile, like a build manifest of its
+    own. Every profile builds into <output>/<name>. Example:
+
+        output = "builds"
+        patcher_command = ["python", "stand_in_patcher.py"]
+        parallel_builds = 2          # optional, profiles built at once (default: all)
+
+        [profiles.vanilla-plus]
+        loose = ["mods/ui_fix.zip"]
+        tslpatcher = ["mods/k1cp.7z"]
+
+        [profiles.full]
+        loose = ["mods/ui_fix.zip", "mods/hd_textures.7z"]
+        tslpatcher = ["mods/k1cp.7z", "mods/restoration.7z"]
+        max_texture_size = 1024
+    """
+    manifest = read_toml(manifest_path)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    if "output" not in manifest:
+        raise ValueError(f"{manifest_path} does not set an output directory")
+    tables = manifest.pop("profiles", {})
+    if not tables:
+        raise ValueError(f"{manifest_path} has no [profiles.<name>] tables")
+    output_dir = os.path.normpath(os.path.join(base_dir, os.path.expanduser(manifest["output"])))
+    profiles = []
+    for name, table in tables.items():
+        settings = dict(manifest, **table)
+        settings["output"] = os.path.join(output_dir, name)
+        profiles.append(Profile(name, *parse_build_manifest(settings, base_dir, f"{manifest_path} [profiles.{name}]")))
+    return BuildMatrix(output_dir, profiles, reporter, manifest.get("parallel_builds"))
+
+
+class PrefixNode:
+    """A TSLPatcher step in the load order of one or more profiles"""
+
+    def __init__(self):
+        self.children = {}
+        self.profiles = []
+
+
+def start_state(profile):
+    """What decides a profile's game directory before its first TSLPatcher mod.
+
+    Profiles can only share TSLPatcher steps when this matches.
+    """
+    loose_filter = profile.options["loose_filter"]
+    return (tuple(profile.loose_files), loose_filter.signature() if loose_filter else None,
+            profile.options["base_tlk"], tuple(profile.options["patcher_command"] or ()),
+            profile.options["patcher_workers"] > 1)
+
+
+def plan_waits(profiles):
+    """For each profile name, (leader name, steps) to wait for before building, or None.
+
+    Profiles are put in a trie by their TSLPatcher load order. At every
+    node several profiles pass through, the first of them leads and the
+    others wait until it has patched that many steps, then replay those
+    steps from the shared patcher cache. A profile waits on the deepest
+    node it doesn't lead, which is always led by an earlier profile.
+    """
+    roots = {}
+    for profile in profiles:
+        node = roots.setdefault(start_state(profile), PrefixNode())
+        for path in profile.tsl_files:
+            node = node.children.setdefault((path, profile.options["patcher_choices"].get(path)), PrefixNode())
+            node.profiles.append(profile)
+    waits = {profile.name: None for profile in profiles}
+    stack = [(node, 1) for root in roots.values() for node in root.children.values()]
+    while stack:
+        node, depth = stack.pop()
+        for profile in node.profiles[1:]:
+            if waits[profile.name] is None or waits[profile.name][1] < depth:
+                waits[profile.name] = (node.profiles[0].name, depth)
+        stack.extend((child, depth + 1) for child in node.children.values())
+    return waits
+
+
+class ProfileReporter(Reporter):
+    """Forwards one profile's messages, tagged with its name, and tracks how far its patching got"""
+
+    def __init__(self, name, reporter, cancelled):
+        self.name = name
+        self.reporter = reporter
+        self.cancelled = cancelled
+        self.steps = 0
+        self.finished = False
+        self.condition = threading.Condition()
+
+    def log(self, message):
+        if message.strip():
+            with LOG_LOCK:
+                self.reporter.log(f"[{self.name}] {message.strip()}")
+
+    def set_status(self, message):
+        self.reporter.set_status(f"[{self.name}] {message}")
+
+    def is_cancelled(self):
+        return self.cancelled.is_set() or self.reporter.is_cancelled()
+
+    def patched(self, archive_path):
+        with self.condition:
+            self.steps += 1
+            self.condition.notify_all()
+
+    def finish(self):
+        """Release everyone waiting on this profile, however its build ended"""
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+    def wait_for(self, steps):
+        """Block until this profile has patched steps TSLPatcher mods or stopped"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.finished or self.steps >= steps)
+
+
+class BuildMatrix:
+    """Builds several profiles from mostly the same archives, sharing the work they have in common.
+
+    Every archive is extracted once into a shared cache. TSLPatcher
+    steps that profiles share at the start of their load order run once
+    (see plan_waits) and are replayed by the others. The profiles then
+    build side by side, each into its own output directory.
+    """
+
+    def __init__(self, output_dir, profiles, reporter=None, max_parallel=None):
+        self.output_dir = output_dir
+        self.profiles = profiles
+        self.reporter = reporter or Reporter()
+        self.max_parallel = max_parallel or len(profiles)
+        self.shared_dir = os.path.join(output_dir, SHARED_DIR_NAME)
+        self.cancelled = threading.Event()
+        self.reaper = Reaper(log=self.reporter.log)
+        self.reporters = {p.name: ProfileReporter(p.name, self.reporter, self.cancelled) for p in profiles}
+        self.engines = {}
+
+    def log(self, message):
+        with LOG_LOCK:
+            self.reporter.log(message)
+
+    def prefetch(self):
+        """Extract every archive the profiles use into the shared cache, once each"""
+        cache = ExtractCache(os.path.join(self.shared_dir, CACHE_DIR_NAME))
+        jobs = {}
+        for profile in self.profiles:
+            loose_filter = profile.options["loose_filter"]
+            for archive_path, member_filter in ([(path, loose_filter) for path in profile.loose_files] +
+                                                [(path, None) for path in profile.tsl_files]):
+                signature = member_filter.signature() if member_filter else None
+                jobs[(archive_path, signature)] = (archive_path, None, cache.cache_dir,
+                                                   cache.known_digest(archive_path), AUTO, member_filter)
+        extracted = 0
+        for (archive_path, *_), result, error in archive_utils.extract_many(jobs.values(), extract=extract_cached):
+            if error is None:
+                digest, key, tree_bytes, hit, stats = result
+                cache.record(archive_path, digest, key, tree_bytes)
+                extracted += not hit
+            else:
+                # The profiles using it report the error when they extract it themselves
+                self.log(f"Warning: could not extract {os.path.basename(archive_path)}: {str(error)}")
+        cache.save()
+        self.log(f"Shared cache holds all {len(jobs)} archives ({extracted} extracted now)")
+
+    def run(self):
+        """Build every profile. Returns {profile name: True if it built cleanly}"""
+        waits = plan_waits(self.profiles)
+        for name, wait in waits.items():
+            if wait is not None:
+                self.log(f"{name} shares its first {wait[1]} TSLPatcher mods with {wait[0]}; "
+                         f"it starts once {wait[0]} has patched them")
+        os.makedirs(self.shared_dir, exist_ok=True)
+        self.prefetch()
+
+        results = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="profile")
+        try:
+            # Leaders come before the profiles waiting on them, so they always get a worker first
+            futures = {p.name: pool.submit(self.build_profile, p, waits[p.name]) for p in self.profiles}
+            for name, future in futures.items():
+                results[name] = future.result()
+        except BaseException:
+            self.cancelled.set()
+            raise
+        finally:
+            pool.shutdown(wait=True)
+            self.evict_shared()
+        return results
+
+    def evict_shared(self):
+        """Trim the shared caches once every profile is done, keeping what any of them used"""
+        engines = list(self.engines.values())
+        caches = [
+            ("extraction", ExtractCache(os.path.join(self.shared_dir, CACHE_DIR_NAME)),
+             set().union(*[engine.used_extract_keys for engine in engines])),
+            ("TSLPatcher result", PatcherCache(os.path.join(self.shared_dir, PATCHER_CACHE_DIR_NAME)),
+             set().union(*[engine.used_patcher_keys for engine in engines])),
+        ]
+        for description, cache, used in caches:
+            for key, info in cache.evict(keep=used):
+                self.log(f"Evicted cached {description} of {info['name']}")
+            cache.save()
+
+    def build_profile(self, profile, wait):
+        """Build one profile once the profile it shares steps with is far enough along"""
+        reporter = self.reporters[profile.name]
+        try:
+            if wait is not None:
+                self.reporters[wait[0]].wait_for(wait[1])
+            # cProfile can't watch several builds running in one process. The shared caches
+            # are trimmed once all profiles are done, so no build evicts what another one uses
+            options = dict(profile.options, cache_dir=self.shared_dir, profile=False, evict_caches=False)
+            engine = InstallEngine(profile.output_dir, profile.loose_files, profile.tsl_files, options,
+                                   reporter=reporter, reaper=self.reaper)
+            self.engines[profile.name] = engine
+            return engine.install()
+        except InstallCancelled:
+            raise
+        except Exception as e:
+            reporter.log(f"Build failed: {str(e)}")
+            return False
+        finally:
+            reporter.finish()
@@ -0,0 +1,190 @@
+import json
+import os
+
+import archive_utils
+
+LOOSE = "loose"
+TSLPATCHER = "tslpatcher"
+MOD_TYPES = (LOOSE, TSLPATCHER)
+MOD_TYPE_NAMES = {LOOSE: "loose-file", TSLPATCHER: "TSLPatcher"}
+# Preflight status of a queued archive
+PENDING = "pending"
+CHECKED = "checked"
+PROBLEMS = "problems"
+MISSING = "missing"
+LOAD_ORDER_VERSION = 1
+LOAD_ORDER_EXTENSION = ".json"
+
+
+class ModEntry:
+    """One queued mod archive"""
+
+    __slots__ = ("path", "mod_type", "digest", "size", "preflight")
+
+    def __init__(self, path, mod_type, digest=None, size=None, preflight=PENDING):
+        self.path = path
+        self.mod_type = mod_type
+        self.digest = digest
+        self.size = size
+        self.preflight = preflight
+
+    def label(self):
+        """Text shown for the mod in the GUI's lists"""
+        if self.preflight == MISSING:
+            return f"{self.path}  (missing)"
+        if self.preflight == PROBLEMS:
+            return f"{self.path}  (has problems, see log)"
+        return self.path
+
+
+def path_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def archive_paths(paths):
+    """Archives among paths, with dropped folders replaced by the archives directly inside them"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in sorted(os.listdir(path), key=str.lower)
+                         if archive_utils.is_archive(name))
+        elif archive_utils.is_archive(path):
+            found.append(path)
+    return found
+
+
+class ModQueue:
+    """Load order of the loose-file and TSLPatcher mods.
+
+    Entries are indexed by normalized path, so an archive can only be
+    queued once (in either list) and lookups don't scan the lists.
+    Changes touch each list once however many mods are selected; the GUI
+    redraws its listboxes from the model afterwards.
+    """
+
+    def __init__(self):
+        self.lists = {mod_type: [] for mod_type in MOD_TYPES}
+        self.index = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return path_key(path) in self.index
+
+    def get(self, path):
+        return self.index.get(path_key(path))
+
+    def entries(self, mod_type):
+        return self.lists[mod_type]
+
+    def paths(self, mod_type):
+        return [entry.path for entry in self.lists[mod_type]]
+
+    def add(self, paths, mod_type):
+        """Append archives to a list in order. Returns (added entries, paths that were already queued)"""
+        added = []
+        skipped = []
+        for path in paths:
+            key = path_key(path)
+            if key in self.index:
+                skipped.append(path)
+                continue
+            try:
+                size = os.path.getsize(path)
+                status = PENDING
+            except OSError:
+                size, status = None, MISSING
+            entry = self.index[key] = ModEntry(path, mod_type, size=size, preflight=status)
+            added.append(entry)
+        self.lists[mod_type].extend(added)
+        return added, skipped
+
+    def remove(self, mod_type, positions):
+        """Remove the entries at positions from a list. Returns the removed entries"""
+        entries = self.lists[mod_type]
+        positions = set(positions)
+        removed = [entries[i] for i in sorted(positions)]
+        self.lists[mod_type] = [entry for i, entry in enumerate(entries) if i not in positions]
+        for entry in removed:
+            del self.index[path_key(entry.path)]
+        return removed
+
+    def clear(self):
+        for mod_type in MOD_TYPES:
+            self.lists[mod_type] = []
+        self.index.clear()
+
+    def move(self, mod_type, positions, direction):
+        """Move the entries at positions one step up (-1) or down (1) together.
+
+        Entries keep their order relative to each other; a selected block
+        already at the end of the list stays there and holds back the
+        entries behind it. Returns the entries' new positions.
+        """
+        entries = self.lists[mod_type]
+        moved = set()
+        # Start from the leading edge, so each entry moves into a spot that's already settled
+        for pos in sorted(positions, reverse=direction > 0):
+            target = pos + direction
+            if 0 <= target < len(entries) and target not in moved:
+                entries[pos], entries[target] = entries[target], entries[pos]
+                moved.add(target)
+            else:
+                moved.add(pos)
+        return sorted(moved)
+
+    def update_preflight(self, path, info):
+        """Record an archive check result. Returns the entry if its status changed, else None"""
+        entry = self.get(path)
+        if entry is None:
+            return None
+        status = PROBLEMS if info["problems"] else CHECKED
+        size = info["size"] or entry.size
+        if (entry.preflight, entry.size) == (status, size):
+            return None
+        entry.preflight, entry.size = status, size
+        return entry
+
+    def update_digests(self, digests):
+        """Store archive hashes computed by an install ({path: digest})"""
+        for path, digest in digests.items():
+            entry = self.get(path)
+            if entry is not None:
+                entry.digest = digest
+
+    def save(self, order_path, patcher_choices=None):
+        """Write the load order, with each archive's size and hash, to a JSON file"""
+        data = {"version": LOAD_ORDER_VERSION}
+        for mod_type in MOD_TYPES:
+            data[mod_type] = [{"path": entry.path, "size": entry.size, "digest": entry.digest}
+                              for entry in self.lists[mod_type]]
+        data["patcher_options"] = {path: name for path, name in (patcher_choices or {}).items() if path in self}
+        temp_path = order_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, order_path)
+
+    def load(self, order_path):
+        """Replace the queue with a saved load order.
+
+        Returns (patcher options, paths whose size changed since the order
+        was saved). Archives that no longer exist stay queued as missing.
+        """
+        with open(order_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != LOAD_ORDER_VERSION:
+            raise ValueError(f"{os.path.basename(order_path)} is not a load order file this version can read")
+        self.clear()
+        changed = []
+        for mod_type in MOD_TYPES:
+            records = data.get(mod_type, [])
+            added, _ = self.add([record["path"] for record in records], mod_type)
+            saved = {path_key(record["path"]): record for record in records}
+            for entry in added:
+                record = saved[path_key(entry.path)]
+                if entry.size is not None and record.get("size") not in (None, entry.size):
+                    changed.append(entry.path)
+                else:
+                    entry.digest = record.get("digest")
+        return dict(data.get("patcher_options", {})), changed
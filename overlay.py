@@ -0,0 +1,197 @@
+import json
+import os
+
+ORIGINS_FILE = "final_override_origins.json"
+TSLPATCHER_ORIGIN = "TSLPatcher"
+LOOSE_ORIGIN = "loose-file mods"
+MERGED_ORIGIN = "merged modules"
+MERGED_TLK_ORIGIN = "merged dialog.tlk"
+MERGED_2DA_ORIGIN = "merged 2DA"
+OPTIMIZED_TEXTURE_ORIGIN = "optimized textures"
+
+
+class OverlayPlan:
+    """Map of final package path to the source file that wins it.
+
+    Sources are added in precedence order; the last one added for a path
+    wins and the earlier ones are recorded as shadowed. Paths are matched
+    case-insensitively, like the game matches resource names.
+    """
+
+    def __init__(self):
+        self.candidates = {}
+
+    def add(self, dest_rel, src_path, origin):
+        """Add a source for dest_rel (relative to the package root, '/' separated)"""
+        self.candidates.setdefault(dest_rel.lower(), []).append((dest_rel, src_path, origin))
+
+    def remove(self, dest_rel):
+        """Drop every source of dest_rel"""
+        self.candidates.pop(dest_rel.lower(), None)
+
+    def winners(self):
+        """Yield (dest_rel, src_path, origin) for the file that ends up at each path"""
+        for entries in self.candidates.values():
+            yield entries[-1]
+
+    def conflicts(self):
+        """Yield (winner, shadowed) for every path supplied by more than one source"""
+        for entries in self.candidates.values():
+            if len(entries) > 1:
+                yield entries[-1], entries[:-1]
+
+    def classify(self, digests):
+        """Split multi-source paths into (duplicates, conflicts).
+
+        digests maps source path to content hash. A path is a duplicate
+        when every source holds the same content, so it doesn't matter
+        which one wins; otherwise a later mod really replaces a file.
+        Both are lists of (winner, shadowed) like conflicts().
+        """
+        duplicates = []
+        conflicts = []
+        for winner, shadowed in self.conflicts():
+            if all(digests.get(s) == digests.get(winner[1]) for _, s, _ in shadowed):
+                duplicates.append((winner, shadowed))
+            else:
+                conflicts.append((winner, shadowed))
+        return duplicates, conflicts
+
+    def sources(self):
+        """Every source path in the plan, winners and shadowed"""
+        return [src_path for entries in self.candidates.values() for _, src_path, _ in entries]
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def write_report(self, report_path, digests=None, modules=None):
+        """Write a JSON report of which source shadowed which file.
+
+        With digests, identical copies are listed separately from real
+        conflicts. modules maps a path to its resource-level comparison
+        (see erf.compare_archives). Returns the number of real conflicts.
+        """
+        if digests is None:
+            duplicates, conflicts = [], list(self.conflicts())
+        else:
+            duplicates, conflicts = self.classify(digests)
+
+        def describe(entries):
+            return [{
+                "path": dest_rel,
+                "winner": {"origin": origin, "source": src_path},
+                "shadowed": [{"origin": o, "source": s} for _, s, o in shadowed],
+            } for (dest_rel, src_path, origin), shadowed in entries]
+
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": len(self), "conflicts": describe(conflicts),
+                       "duplicates": describe(duplicates), "modules": modules or {}}, f, indent=2)
+        return len(conflicts)
+
+
+def save_origins(work_dir, origins, stage_dirs=()):
+    """Record which loose-file mods supplied each final_override path.
+
+    origins maps a '/' separated path relative to final_override to the
+    (mod name, staged source path) pairs that supplied it, in load order.
+    stage_dirs are the mods' staging directories in load order, so files
+    from different folders that land on one package path can be ranked.
+    """
+    with open(os.path.join(work_dir, ORIGINS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"stages": list(stage_dirs), "files": origins}, f)
+
+
+def load_origins(work_dir):
+    """Load (origins, stage dirs) saved by save_origins, or empty ones"""
+    path = os.path.join(work_dir, ORIGINS_FILE)
+    if not os.path.exists(path):
+        return {}, []
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if "files" not in data:
+        # Written before stage dirs were recorded
+        return data, []
+    return data["files"], data["stages"]
+
+
+def flattened_files(source_dir, dest_prefix):
+    """Yield (dest_rel, src_path) for every file below source_dir, dropping subdirectories"""
+    for root, dirs, files in os.walk(source_dir):
+        for file in files:
+            # dialog.tlk doesn't go in Override
+            if file.lower() == 'dialog.tlk':
+                continue
+            yield f"{dest_prefix}/{file}", os.path.join(root, file)
+
+
+def add_flattened(plan, source_dir, dest_prefix, origin):
+    """Add every file below source_dir to plan under dest_prefix"""
+    for dest_rel, src_path in flattened_files(source_dir, dest_prefix):
+        plan.add(dest_rel, src_path, origin)
+
+
+def load_rank(src_path, origins, stage_ranks, origins_root):
+    """Load order position of the mod that last supplied a final_override file, or -1 if unknown"""
+    rel = os.path.relpath(src_path, origins_root).replace(os.sep, '/')
+    history = origins.get(rel)
+    if not history:
+        return -1
+    staged_path = history[-1][1]
+    stage_dir = staged_path[:len(staged_path) - len(rel)].rstrip('/' + os.sep)
+    return stage_ranks.get(os.path.normpath(stage_dir), -1)
+
+
+def add_with_history(plan, dest_rel, src_path, origin, origins=None, origins_root=None):
+    """Add src_path to plan, preceded by the staged copies it replaced in final_override"""
+    history = []
+    if origins is not None:
+        rel = os.path.relpath(src_path, origins_root).replace(os.sep, '/')
+        history = origins.get(rel, [])
+    for mod_name, staged_path in history[:-1]:
+        plan.add(dest_rel, staged_path, mod_name)
+    plan.add(dest_rel, src_path, history[-1][0] if history else origin)
+
+
+def plan_overlay(work_dir):
+    """Resolve the final package layout without copying anything.
+
+    Precedence matches the order files used to be copied in: TSLPatcher
+    results from dummy_kotor first, then loose-file mods from
+    final_override on top. dialog.tlk is the exception: the copy the
+    patchers worked on already includes the loose-file one.
+    """
+    plan = OverlayPlan()
+
+    dummy_override = os.path.join(work_dir, "dummy_kotor", "Override")
+    dummy_modules = os.path.join(work_dir, "dummy_kotor", "Modules")
+    if os.path.exists(dummy_override):
+        add_flattened(plan, dummy_override, "Override", TSLPATCHER_ORIGIN)
+    if os.path.exists(dummy_modules):
+        add_flattened(plan, dummy_modules, "Modules", TSLPATCHER_ORIGIN)
+
+    final_override = os.path.join(work_dir, "final_override")
+    if os.path.exists(final_override):
+        origins, stage_dirs = load_origins(work_dir)
+        files = []
+        for item in os.listdir(final_override):
+            src_path = os.path.join(final_override, item)
+            if os.path.isfile(src_path):
+                dest_rel = item if item.lower() == 'dialog.tlk' else f"Override/{item}"
+                files.append((dest_rel, src_path))
+            elif os.path.isdir(src_path):
+                # Look for files in Override subdirectory, else use the directory itself
+                override_subdir = os.path.join(src_path, "Override")
+                files.extend(flattened_files(override_subdir if os.path.exists(override_subdir) else src_path,
+                                             "Override"))
+        # Files from different folders can land on one path; the one from the latest mod wins
+        stage_ranks = {os.path.normpath(stage_dir): i for i, stage_dir in enumerate(stage_dirs)}
+        files.sort(key=lambda file: load_rank(file[1], origins, stage_ranks, final_override))
+        for dest_rel, src_path in files:
+            add_with_history(plan, dest_rel, src_path, LOOSE_ORIGIN, origins, final_override)
+
+    # TSLPatcher appends to the dialog.tlk copied from final_override, so its copy comes last
+    dummy_tlk = os.path.join(work_dir, "dummy_kotor", "dialog.tlk")
+    if os.path.exists(dummy_tlk):
+        plan.add("dialog.tlk", dummy_tlk, TSLPATCHER_ORIGIN)
+
+    return plan
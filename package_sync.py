@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+
+from fastcopy import Copier
+from hashing import hash_file
+
+MANIFEST_NAME = "output_manifest.json"
+
+
+def load_manifest(manifest_path):
+    """Load the per-file records of the previous output, or an empty map"""
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_path, files):
+    """Write the output manifest atomically"""
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({"files": files}, f, indent=1)
+    os.replace(temp_path, manifest_path)
+
+
+def list_tree(root_dir):
+    """Return the '/' separated relative paths of every file below root_dir"""
+    paths = []
+    for root, dirs, files in os.walk(root_dir):
+        for file in files:
+            rel = os.path.relpath(os.path.join(root, file), root_dir)
+            paths.append(rel.replace(os.sep, '/'))
+    return paths
+
+
+def remove_empty_dirs(root_dir, keep=()):
+    """Delete empty directories below root_dir, except the ones named in keep"""
+    for root, dirs, files in os.walk(root_dir, topdown=False):
+        rel = os.path.relpath(root, root_dir).replace(os.sep, '/')
+        if root != root_dir and rel not in keep and not os.listdir(root):
+            os.rmdir(root)
+
+
+def is_up_to_date(src_path, dest_path, record, source_digest=hash_file):
+    """Check whether dest_path already holds src_path's content according to record.
+
+    source_digest(path) hashes the source; pass a HashStore's digest to
+    reuse hashes computed earlier in the build.
+    """
+    if record is None or not os.path.exists(dest_path):
+        return False
+    dest_stat = os.stat(dest_path)
+    if dest_stat.st_size != record["size"] or dest_stat.st_mtime_ns != record["mtime"]:
+        return False
+    src_stat = os.stat(src_path)
+    if src_stat.st_size != record["size"]:
+        return False
+    if src_stat.st_mtime_ns == record["source_mtime"]:
+        return True
+    # Re-extracted sources get new mtimes; fall back to comparing content.
+    # Fast copies don't hash while copying, so the output hash is filled in here.
+    if record.get("hash") is None:
+        record["hash"] = hash_file(dest_path)
+    return source_digest(src_path) == record["hash"]
+
+
+def sync_package(plan, android_dir, manifest_path, full_rebuild=False, copier=None,
+                 log=print, check_cancelled=None, on_file=None, hash_store=None, base_dir=None):
+    """Bring android_dir in line with an OverlayPlan, touching only what changed.
+
+    Files whose content matches the previous manifest are left alone,
+    new or changed files are copied and files no longer in the plan are
+    deleted. full_rebuild wipes the tree and copies everything.
+    With base_dir, android_dir is a new, empty tree: files that are
+    up to date in base_dir (the previous output) are linked from there
+    and base_dir itself is never modified.
+    on_file(nbytes) is called after each file is checked or copied.
+    With a hash_store, source hashes are reused and copied files are
+    recorded with their hash without reading them again.
+    Returns (copied, unchanged, deleted) counts.
+    """
+    copier = copier or Copier()
+    if full_rebuild and base_dir is None and os.path.exists(android_dir):
+        log("Full rebuild: removing existing output directory")
+        shutil.rmtree(android_dir)
+    previous = {} if full_rebuild else load_manifest(manifest_path)
+    # Unchanged files are carried over from the old tree; they are never written in place
+    carry = Copier() if base_dir is not None else None
+    # Old files that still share their inode with a work file are copied, so the new tree owns them
+    unshare = Copier(allow_hardlink=False) if base_dir is not None else None
+
+    os.makedirs(os.path.join(android_dir, "Override"), exist_ok=True)
+    os.makedirs(os.path.join(android_dir, "Modules"), exist_ok=True)
+
+    desired = {dest_rel: src_path for dest_rel, src_path, origin in plan.winners()}
+
+    # Delete stale files first so a case-only rename can't clobber its replacement
+    deleted = 0
+    if base_dir is not None:
+        deleted = sum(1 for rel in list_tree(base_dir) if rel not in desired) if os.path.exists(base_dir) else 0
+    for rel in list_tree(android_dir):
+        if rel not in desired:
+            if check_cancelled:
+                check_cancelled()
+            log(f"Removing stale file: {rel}")
+            os.remove(os.path.join(android_dir, rel))
+            deleted += 1
+    remove_empty_dirs(android_dir, keep=("Override", "Modules"))
+
+    files = {}
+    copied = 0
+    unchanged = 0
+    try:
+        for dest_rel, src_path in desired.items():
+            if check_cancelled:
+                check_cancelled()
+            dest_path = os.path.join(android_dir, dest_rel)
+            check_path = os.path.join(base_dir, dest_rel) if base_dir is not None else dest_path
+            record = previous.get(dest_rel)
+            if is_up_to_date(src_path, check_path, record, hash_store.digest if hash_store else hash_file):
+                if carry is not None:
+                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                    (unshare if os.stat(check_path).st_nlink > 1 else carry).copy(check_path, dest_path)
+                unchanged += 1
+            else:
+                log(f"Copying: {dest_rel}")
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                copier.copy(src_path, dest_path)
+                record = {"hash": hash_store.cached(src_path) if hash_store else None}
+                copied += 1
+            dest_stat = os.stat(dest_path)
+            record.update(size=dest_stat.st_size, mtime=dest_stat.st_mtime_ns,
+                          source_mtime=os.stat(src_path).st_mtime_ns)
+            files[dest_rel] = record
+            if on_file:
+                on_file(record["size"])
+    finally:
+        # Keep what was verified so far so an interrupted sync resumes cheaply; a new
+        # tree that is thrown away leaves the old one and its manifest as they were
+        if base_dir is None:
+            for dest_rel, record in previous.items():
+                if dest_rel in desired and dest_rel not in files:
+                    files[dest_rel] = record
+            save_manifest(manifest_path, files)
+    if base_dir is not None:
+        save_manifest(manifest_path, files)
+
+    return copied, unchanged, deleted
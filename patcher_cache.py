@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from extract_cache import CacheStore
+from fastcopy import Copier
+from hashing import hash_file
+
+PATCHER_CACHE_DIR_NAME = "patcher_cache"
+DELTA_NAME = "delta.json"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def snapshot_tree(root_dir):
+    """Map of '/' separated relative path to (size, mtime) for every file below root_dir"""
+    snapshot = {}
+    for root, dirs, files in os.walk(root_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            stat = os.stat(path)
+            snapshot[os.path.relpath(path, root_dir).replace(os.sep, '/')] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+class TreeState:
+    """Content hashes of every file in a directory, kept current as it changes.
+
+    Only files whose size or mtime changed since the last refresh are
+    hashed again, so tracking a game directory across patcher runs costs
+    one stat per file plus hashing what the patcher actually wrote.
+    """
+
+    def __init__(self, root_dir, known=None):
+        """known gives the digests of a tree just copied to root_dir, so it isn't hashed again"""
+        self.root_dir = root_dir
+        if known is None:
+            self.digests = {}
+            self.stats = {}
+            self.refresh()
+        else:
+            self.digests = dict(known)
+            self.stats = snapshot_tree(root_dir)
+
+    def refresh(self):
+        """Pick up changes made on disk. Returns (changed paths, deleted paths)"""
+        snapshot = snapshot_tree(self.root_dir)
+        changed = []
+        for rel, stat in snapshot.items():
+            if self.stats.get(rel) == stat:
+                continue
+            self.stats[rel] = stat
+            digest = hash_file(os.path.join(self.root_dir, rel))
+            if self.digests.get(rel) != digest:
+                self.digests[rel] = digest
+                changed.append(rel)
+        deleted = [rel for rel in self.digests if rel not in snapshot]
+        for rel in deleted:
+            del self.digests[rel]
+            del self.stats[rel]
+        return changed, deleted
+
+    def apply(self, changed, deleted):
+        """Record changes whose digests are already known (a replayed delta)"""
+        for rel, digest in changed.items():
+            stat = os.stat(os.path.join(self.root_dir, rel))
+            self.stats[rel] = (stat.st_size, stat.st_mtime_ns)
+            self.digests[rel] = digest
+        for rel in deleted:
+            self.digests.pop(rel, None)
+            self.stats.pop(rel, None)
+
+    def key(self):
+        """Hash of the whole tree's paths and contents"""
+        digest = hashlib.blake2b(digest_size=20)
+        for rel in sorted(self.digests):
+            digest.update(f"{rel}\0{self.digests[rel]}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+
+def step_key(state_key, archive_digest, patcher_id):
+    """Cache key of one patcher run: game state before it, the mod and the patcher used"""
+    return hashlib.blake2b(f"{state_key}\n{archive_digest}\n{patcher_id}".encode('utf-8'),
+                           digest_size=20).hexdigest()
+
+
+class PatcherCache(CacheStore):
+    """Recorded results of TSLPatcher runs, stored as deltas of the game directory.
+
+    A delta holds the files a run created or changed and the paths it
+    deleted. Replaying it onto the same starting state gives the same
+    tree as running the patcher again.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.cache_dir, key, DELTA_NAME))
+
+    def store(self, key, name, game_dir, changed, deleted):
+        """Save a run's delta. changed maps relative path to content digest"""
+        entry = os.path.join(self.cache_dir, key)
+        temp_entry = f"{entry}.tmp-{os.getpid()}-{threading.get_ident()}"
+        if os.path.exists(temp_entry):
+            shutil.rmtree(temp_entry)
+        nbytes = 0
+        for rel in changed:
+            dest_path = os.path.join(temp_entry, "files", rel)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            shutil.copy2(os.path.join(game_dir, rel), dest_path)
+            nbytes += os.path.getsize(dest_path)
+        os.makedirs(temp_entry, exist_ok=True)
+        with open(os.path.join(temp_entry, DELTA_NAME), 'w', encoding='utf-8') as f:
+            json.dump({"mod": name, "changed": changed, "deleted": deleted}, f, indent=1)
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.rename(temp_entry, entry)
+        self.touch(key, name, nbytes)
+
+    def replay(self, key, game_dir, copier=None):
+        """Apply a stored delta to game_dir. Returns (changed digests, deleted paths, bytes copied)"""
+        entry = os.path.join(self.cache_dir, key)
+        with open(os.path.join(entry, DELTA_NAME), 'r', encoding='utf-8') as f:
+            delta = json.load(f)
+        # Never link cached files into the game directory; the next patcher edits it in place
+        copier = copier or Copier(allow_hardlink=False)
+        for rel in delta["deleted"]:
+            path = os.path.join(game_dir, rel)
+            if os.path.exists(path):
+                os.remove(path)
+        nbytes = 0
+        for rel in delta["changed"]:
+            dest_path = os.path.join(game_dir, rel)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            copier.copy(os.path.join(entry, "files", rel), dest_path)
+            nbytes += os.path.getsize(dest_path)
+        self.touch(key, delta["mod"], nbytes)
+        return delta["changed"], delta["deleted"], nbytes
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from archive_utils import find_problems, list_members, read_member
+from tslpatcher import find_option_sets
+
+INDEX_NAME = "preflight_index.json"
+PREFLIGHT_WORKERS = 4
+
+
+def scan_archive(archive_path):
+    """Read an archive's member listing and check it for problems"""
+    stat = os.stat(archive_path)
+    info = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "files": 0,
+        "bytes": 0,
+        "tslpatchdata": False,
+        "patchers": [],
+        "problems": [],
+    }
+    try:
+        members = list_members(archive_path)
+        info["files"] = len(members)
+        info["bytes"] = sum(size for name, size in members)
+        info["patchers"] = find_option_sets(
+            [name for name, size in members], lambda name: read_member(archive_path, name))
+        info["tslpatchdata"] = bool(info["patchers"])
+        info["problems"] = find_problems(archive_path)
+    except Exception as e:
+        info["problems"] = [f"cannot read archive: {e}"]
+    return info
+
+
+class PreflightIndex:
+    """Background scanner and cache of archive listings.
+
+    Archives are scanned in a thread pool as soon as they are submitted.
+    Results are kept per archive path and reused while the archive's
+    size and mtime stay the same. on_result(path, info) is called from
+    the pool thread for every fresh scan.
+    """
+
+    def __init__(self, index_path, on_result=None, max_workers=PREFLIGHT_WORKERS):
+        self.index_path = index_path
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preflight")
+        self.pending = {}
+        self.entries = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def cached(self, archive_path):
+        """Return the stored info for an archive if it's still current"""
+        with self.lock:
+            info = self.entries.get(os.path.abspath(archive_path))
+        if info is None:
+            return None
+        try:
+            stat = os.stat(archive_path)
+        except OSError:
+            return None
+        # Entries written before patcher option sets were indexed are rescanned
+        if info["size"] == stat.st_size and info["mtime"] == stat.st_mtime_ns and "patchers" in info:
+            return info
+        return None
+
+    def submit(self, archive_paths):
+        """Start scanning archives that aren't already indexed or being scanned"""
+        for archive_path in archive_paths:
+            key = os.path.abspath(archive_path)
+            with self.lock:
+                if key in self.pending:
+                    continue
+            if self.cached(archive_path) is not None:
+                continue
+            with self.lock:
+                self.pending[key] = self.pool.submit(self._scan, archive_path)
+
+    def _scan(self, archive_path):
+        key = os.path.abspath(archive_path)
+        try:
+            info = scan_archive(archive_path)
+        except OSError as e:
+            info = {"size": 0, "mtime": 0, "files": 0, "bytes": 0, "tslpatchdata": False,
+                    "patchers": [], "problems": [f"cannot open archive: {e}"]}
+        with self.lock:
+            self.entries[key] = info
+            self.pending.pop(key, None)
+        self.save()
+        if self.on_result is not None:
+            self.on_result(archive_path, info)
+        return info
+
+    def get(self, archive_path):
+        """Return the info for an archive, waiting for or running its scan"""
+        info = self.cached(archive_path)
+        if info is not None:
+            return info
+        with self.lock:
+            future = self.pending.get(os.path.abspath(archive_path))
+        if future is not None:
+            return future.result()
+        return self._scan(archive_path)
+
+    def weight(self, archive_path):
+        """Bytes of work an archive represents, for progress reporting"""
+        info = self.get(archive_path)
+        return max(info["bytes"], info["size"], 1)
+
+    def save(self):
+        """Write the index atomically"""
+        with self.lock:
+            data = json.dumps(self.entries)
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        temp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(temp_path, self.index_path)
+
+    def shutdown(self):
+        """Stop scanning archives that haven't started yet"""
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            future.cancel()
+        self.pool.shutdown(wait=False)
+
+
+class ByteProgress:
+    """Byte-weighted progress with throughput and an ETA.
+
+    report(percent, detail) is called at most every min_interval seconds
+    and always when the work completes.
+    """
+
+    def __init__(self, total_bytes, report, min_interval=0.25):
+        self.total_bytes = max(total_bytes, 1)
+        self.report = report
+        self.min_interval = min_interval
+        self.done_bytes = 0
+        self.started = time.monotonic()
+        self.last_report = 0.0
+
+    def advance(self, nbytes):
+        """Record nbytes of finished work"""
+        self.done_bytes = min(self.done_bytes + nbytes, self.total_bytes)
+        now = time.monotonic()
+        if now - self.last_report >= self.min_interval or self.done_bytes == self.total_bytes:
+            self.last_report = now
+            self.report(self.percent(), self.detail(now))
+
+    def percent(self):
+        return self.done_bytes / self.total_bytes * 100
+
+    def detail(self, now=None):
+        """Text like '120.5 MB/s, ETA 0:42'"""
+        elapsed = (now or time.monotonic()) - self.started
+        if elapsed <= 0 or self.done_bytes == 0:
+            return "estimating..."
+        rate = self.done_bytes / elapsed
+        remaining = (self.total_bytes - self.done_bytes) / rate
+        minutes, seconds = divmod(int(remaining), 60)
+        return f"{rate / 1024 ** 2:.1f} MB/s, ETA {minutes}:{seconds:02d}"
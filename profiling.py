@@ -0,0 +1,149 @@
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+REPORT_NAME = "run_report.json"
+PROFILE_NAME = "run_profile.pstats"
+# Set to 1 to run every install under cProfile (same as --profile)
+PROFILE_ENV = "KOTOR_PROFILE"
+PROFILE_TOP_FUNCTIONS = 25
+
+
+class Span:
+    """One timed piece of work, such as extracting one archive"""
+
+    def __init__(self, phase, label=""):
+        self.phase = phase
+        self.label = label
+        self.seconds = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.files = 0
+
+    def add(self, bytes_read=0, bytes_written=0, files=0):
+        """Count I/O done inside the span"""
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        self.files += files
+
+    def to_dict(self):
+        return {
+            "phase": self.phase,
+            "label": self.label,
+            "seconds": round(self.seconds, 4),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "files": self.files,
+        }
+
+
+class RunProfile:
+    """Timing spans collected over one install run.
+
+    Use span() around work done in this process, or record() for work
+    timed elsewhere (extraction runs in worker processes).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+        self.started_at = datetime.datetime.now()
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, phase, label=""):
+        """Time the body of a with block; the yielded Span takes I/O counts"""
+        span = Span(phase, label)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - started
+            with self.lock:
+                self.spans.append(span)
+
+    def record(self, phase, label="", seconds=0.0, bytes_read=0, bytes_written=0, files=0):
+        """Add a span that was timed by someone else"""
+        span = Span(phase, label)
+        span.seconds = seconds
+        span.add(bytes_read, bytes_written, files)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def phases(self):
+        """Per-phase totals in the order phases first appeared"""
+        totals = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            total = totals.setdefault(span.phase, {
+                "count": 0, "seconds": 0.0, "bytes_read": 0, "bytes_written": 0, "files": 0})
+            total["count"] += 1
+            total["seconds"] += span.seconds
+            total["bytes_read"] += span.bytes_read
+            total["bytes_written"] += span.bytes_written
+            total["files"] += span.files
+        return totals
+
+    def summary_lines(self):
+        """Table of per-phase totals for the log"""
+        lines = [f"{'Phase':<12} {'Count':>6} {'Seconds':>9} {'Read MB':>9} {'Written MB':>11} {'Files':>8}"]
+        for phase, total in self.phases().items():
+            lines.append(f"{phase:<12} {total['count']:>6} {total['seconds']:>9.2f} "
+                         f"{total['bytes_read'] / 1024 ** 2:>9.1f} {total['bytes_written'] / 1024 ** 2:>11.1f} "
+                         f"{total['files']:>8}")
+        lines.append(f"{'total':<12} {'':>6} {self.elapsed():>9.2f}")
+        return lines
+
+    def write_report(self, report_path, **details):
+        """Write the spans, phase totals and any extra details as JSON"""
+        phases = self.phases()
+        for total in phases.values():
+            total["seconds"] = round(total["seconds"], 4)
+        with self.lock:
+            spans = [span.to_dict() for span in self.spans]
+        report = {
+            "started": self.started_at.isoformat(timespec="seconds"),
+            "seconds": round(self.elapsed(), 4),
+            **details,
+            "phases": phases,
+            "spans": spans,
+        }
+        temp_path = report_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        os.replace(temp_path, report_path)
+
+
+def profiling_requested(enabled=False):
+    """True if profiling was asked for by option or by the KOTOR_PROFILE env var"""
+    return enabled or os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+
+@contextlib.contextmanager
+def cprofile_session(stats_path, log=print, top=PROFILE_TOP_FUNCTIONS):
+    """Run the with block under cProfile, save the stats and log the hottest functions.
+
+    Only the calling thread is profiled; extraction worker processes are not.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(stats_path)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(top)
+        log(f"Profile saved to {stats_path} (view with: python -m pstats {stats_path})")
+        log(output.getvalue().rstrip())
@@ -0,0 +1,184 @@
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TRASH_PREFIX = ".kotor-trash-"
+STAGING_SUFFIX = ".staging"
+DELETE_WORKERS = 4
+# The worker thread exits after this long without anything to delete
+IDLE_SECONDS = 2
+# Lowest scheduling priority; deleting old trees must never slow down a build
+LOW_PRIORITY = 19
+
+
+def lower_priority():
+    """Run the calling thread at the lowest CPU priority the OS lets us set"""
+    if hasattr(os, "setpriority") and hasattr(threading, "get_native_id"):
+        try:
+            # On Linux a thread id addresses just that thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LOW_PRIORITY)
+        except OSError:
+            pass
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except PermissionError:
+        # Read-only files (common in extracted archives on Windows)
+        os.chmod(path, 0o666)
+        os.remove(path)
+
+
+def delete_tree(path, pool):
+    """Delete a directory tree, removing its files in parallel on pool"""
+    files = []
+    dirs = []
+    for root, dirnames, filenames in os.walk(path, topdown=False):
+        files.extend(os.path.join(root, name) for name in filenames)
+        # Symlinks to directories are listed as directories but are removed like files
+        files.extend(os.path.join(root, name) for name in dirnames if os.path.islink(os.path.join(root, name)))
+        dirs.append(root)
+    list(pool.map(remove_file, files))
+    for directory in dirs:
+        os.rmdir(directory)
+
+
+class Reaper:
+    """Deletes directories in the background at low priority.
+
+    discard() renames a directory aside at once, so its path can be
+    reused straight away, and a worker thread deletes it afterwards.
+    The worker stops once it runs out of work and is started again for
+    the next tree. Trees left behind when the program exits are found
+    by sweep().
+    """
+
+    def __init__(self, max_workers=DELETE_WORKERS, log=print):
+        self.max_workers = max_workers
+        self.log = log
+        self.queue = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.queued = set()
+
+    def set_aside(self, path):
+        """Rename path to a trash name in the same directory and return the new path"""
+        parent, name = os.path.split(os.path.normpath(path))
+        trash_path = os.path.join(parent, f"{TRASH_PREFIX}{name}-{time.time_ns()}")
+        os.rename(path, trash_path)
+        return trash_path
+
+    def delete_later(self, trash_path):
+        """Queue an already renamed directory for deletion"""
+        with self.lock:
+            if trash_path in self.queued:
+                return
+            self.queued.add(trash_path)
+            # Queued under the lock, so an idle worker can't exit between the check and the put
+            self.queue.put(trash_path)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name="reaper", daemon=True)
+                self.worker.start()
+
+    def discard(self, path):
+        """Get path out of the way now and delete it in the background.
+
+        If it can't be renamed (a file is open on Windows, say), it is
+        deleted on the spot instead.
+        """
+        if not os.path.lexists(path):
+            return
+        try:
+            trash_path = self.set_aside(path)
+        except OSError:
+            shutil.rmtree(path)
+            return
+        self.delete_later(trash_path)
+
+    def sweep(self, parent):
+        """Queue trash left in parent by an earlier run"""
+        if not os.path.isdir(parent):
+            return
+        for name in os.listdir(parent):
+            if name.startswith(TRASH_PREFIX):
+                self.delete_later(os.path.join(parent, name))
+
+    def run(self):
+        lower_priority()
+        with ThreadPoolExecutor(max_workers=self.max_workers, initializer=lower_priority,
+                                thread_name_prefix="reaper") as pool:
+            while True:
+                try:
+                    trash_path = self.queue.get(timeout=IDLE_SECONDS)
+                except queue.Empty:
+                    with self.lock:
+                        if self.queue.empty():
+                            if self.worker is threading.current_thread():
+                                self.worker = None
+                            return
+                    continue
+                if trash_path is None:
+                    # Sent by shutdown()
+                    self.queue.task_done()
+                    return
+                try:
+                    delete_tree(trash_path, pool)
+                except OSError as e:
+                    self.log(f"Could not delete {trash_path}: {str(e)}")
+                finally:
+                    with self.lock:
+                        self.queued.discard(trash_path)
+                    self.queue.task_done()
+
+    def wait(self):
+        """Block until every queued directory is gone"""
+        self.queue.join()
+
+    def shutdown(self):
+        """Delete everything queued, then stop the worker thread"""
+        with self.lock:
+            worker, self.worker = self.worker, None
+            if worker is not None:
+                self.queue.put(None)
+        if worker is not None:
+            worker.join()
+
+
+def swap_into_place(staged_path, live_path, reaper):
+    """Replace live_path with staged_path, handing the old tree to the reaper.
+
+    This takes two renames within one directory: the live tree is set
+    aside, then the staged one takes its name. The live path never holds
+    a half-built tree, but it is missing between the renames; if the
+    process dies there, recover_swap() finishes the job on the next run.
+    """
+    old_path = reaper.set_aside(live_path) if os.path.lexists(live_path) else None
+    try:
+        os.rename(staged_path, live_path)
+    except OSError:
+        if old_path is not None:
+            os.rename(old_path, live_path)
+        raise
+    if old_path is not None:
+        reaper.delete_later(old_path)
+
+
+def recover_swap(staged_path, live_path):
+    """Finish a swap_into_place() that stopped between its two renames.
+
+    That left live_path missing, its old tree in the trash and
+    staged_path complete, since the swap only starts once the staged
+    tree is. Returns True if staged_path was moved into place.
+    """
+    if os.path.lexists(live_path) or not os.path.isdir(staged_path):
+        return False
+    parent, name = os.path.split(os.path.normpath(live_path))
+    if not any(entry.startswith(f"{TRASH_PREFIX}{name}-") for entry in os.listdir(parent or '.')):
+        # No old tree was set aside; the staged tree is a first build that never finished
+        return False
+    os.rename(staged_path, live_path)
+    return True
@@ -3,6 +3,8 @@ import os
 import subprocess
 import sys
 
+DEFAULT_OUTPUT = os.path.join(os.path.expanduser("~"), "Desktop", "KOTOR_Mods")
+
 def run_installer():
     """Run the KOTOR Mod Installer"""
     print("Launching KOTOR Mod Installer...")
@@ -16,7 +18,12 @@ def run_tests():
         ('Environment Test', 'test_environment.py'),
         ('File Structure Test', 'test_file_structure.py'),
         ('Combine Mods Test', 'test_combine_mods.py'),
-        ('Full Installer Test', 'test_installer.py')
+        ('Full Installer Test', 'test_installer.py'),
+        ('Export Test', 'test_export.py'),
+        ('Module Archive Test', 'test_erf.py'),
+        ('Talk Table Test', 'test_tlk.py'),
+        ('2DA Table Test', 'test_twoda.py'),
+        ('Texture Test', 'test_textures.py'),
     ]
     
     all_passed = True
@@ -38,6 +45,87 @@ def run_tests():
         print("\n❌ Some tests failed!")
         return 1
 
+def run_build(manifest_path, profile=False, resume=False):
+    """Run a headless build from a TOML manifest"""
+    from engine import InstallEngine, load_build_manifest
+    from journal import ResumeRefused
+    output_dir, loose_files, tsl_files, options = load_build_manifest(manifest_path)
+    options["profile"] = options["profile"] or profile
+    options["resume"] = resume
+    print(f"Building {len(loose_files)} loose-file and {len(tsl_files)} TSLPatcher mods into {output_dir}")
+    engine = InstallEngine(output_dir, loose_files, tsl_files, options)
+    try:
+        if engine.install():
+            return 0
+    except ResumeRefused as e:
+        print(f"\n❌ Can't resume: {str(e)}. Run the build without --resume to start over.")
+        return 1
+    finally:
+        # Replaced trees are deleted in the background; let that finish before exiting
+        engine.reaper.wait()
+        engine.reaper.shutdown()
+    print(f"\n❌ Build finished with {len(engine.errors)} errors:")
+    for error in engine.errors:
+        print(f"  {error}")
+    return 1
+
+def run_matrix(manifest_path):
+    """Build every profile of a build matrix manifest"""
+    from matrix import load_matrix_manifest
+    matrix = load_matrix_manifest(manifest_path)
+    print(f"Building {len(matrix.profiles)} profiles into {matrix.output_dir}: "
+          f"{', '.join(profile.name for profile in matrix.profiles)}")
+    try:
+        results = matrix.run()
+    finally:
+        matrix.reaper.wait()
+        matrix.reaper.shutdown()
+    failed = [name for name, ok in results.items() if not ok]
+    print()
+    for name, ok in results.items():
+        print(f"{'✓' if ok else '❌'} {name}: {os.path.join(matrix.output_dir, name)}")
+        engine = matrix.engines.get(name)
+        for error in (engine.errors if engine and not ok else []):
+            print(f"    {error}")
+    return 1 if failed else 0
+
+def list_cache(output_dir):
+    """Print the archives and TSLPatcher runs held in the caches"""
+    from extract_cache import CACHE_DIR_NAME, ExtractCache
+    from patcher_cache import PATCHER_CACHE_DIR_NAME, PatcherCache
+    caches = [
+        ("cached archives", ExtractCache(os.path.join(output_dir, "work", CACHE_DIR_NAME))),
+        ("cached TSLPatcher runs", PatcherCache(os.path.join(output_dir, "work", PATCHER_CACHE_DIR_NAME))),
+    ]
+    for description, cache in caches:
+        entries = cache.entries()
+        if not entries:
+            print(f"No {description}")
+            continue
+        for key, info in entries:
+            print(f"{key[:12]}  {info['bytes'] / 1024 ** 2:10.1f} MB  {info['name']}")
+        print(f"{len(entries)} {description}, {cache.total_bytes() / 1024 ** 2:.1f} MB total\n")
+
+def purge_cache(output_dir):
+    """Delete everything in the extraction and TSLPatcher caches"""
+    from extract_cache import CACHE_DIR_NAME, ExtractCache
+    from patcher_cache import PATCHER_CACHE_DIR_NAME, PatcherCache
+    freed = ExtractCache(os.path.join(output_dir, "work", CACHE_DIR_NAME)).purge()
+    freed += PatcherCache(os.path.join(output_dir, "work", PATCHER_CACHE_DIR_NAME)).purge()
+    print(f"Purged caches ({freed / 1024 ** 2:.1f} MB freed)")
+
+def mark_shipped(output_dir):
+    """Record the last build in output_dir as the one now on the device"""
+    from delta import mark_shipped as record_shipped
+    count = record_shipped(output_dir)
+    print(f"Marked the last build ({count} files) as shipped; later builds can write deltas against it")
+    return 0
+
+def run_benchmarks(bench_args):
+    """Run the benchmark suite, passing any extra arguments through"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'run_benchmarks.py')
+    return subprocess.run([sys.executable, script] + bench_args).returncode
+
 def cleanup():
     """Clean up temporary files"""
     print("\nCleaning up...")
@@ -47,10 +135,42 @@ def main():
     parser = argparse.ArgumentParser(description='KOTOR Mod Installer Runner')
     parser.add_argument('--test', action='store_true', help='Run tests instead of the installer')
     parser.add_argument('--clean', action='store_true', help='Clean up temporary files after running')
-    args = parser.parse_args()
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Output directory used by the installer')
+    parser.add_argument('--cache-list', action='store_true', help='List cached archives and TSLPatcher runs')
+    parser.add_argument('--cache-purge', action='store_true', help='Delete the extraction and TSLPatcher caches')
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help='Build a mod package without the GUI')
+    build_parser.add_argument('manifest', help='TOML file listing the output directory and mods in load order')
+    build_parser.add_argument('--profile', action='store_true',
+                              help='Run under cProfile and save the stats next to the output')
+    build_parser.add_argument('--resume', action='store_true',
+                              help='Continue an interrupted build from its last finished step')
+    matrix_parser = subparsers.add_parser('matrix', help='Build several profiles that share most of their mods')
+    matrix_parser.add_argument('manifest', help='TOML file with shared settings and a [profiles.<name>] table each')
+    ship_parser = subparsers.add_parser('mark-shipped', help='Record the last build as the one on the device')
+    ship_parser.add_argument('output', nargs='?', default=DEFAULT_OUTPUT, help='Output directory of the build')
+    subparsers.add_parser('bench', help='Benchmark the install pipeline (see benchmarks/run_benchmarks.py --help)',
+                          add_help=False)
+    args, extra = parser.parse_known_args()
+    if extra and args.command != 'bench':
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
     
     try:
-        if args.test:
+        if args.command == 'build':
+            result = run_build(args.manifest, args.profile, args.resume)
+        elif args.command == 'matrix':
+            result = run_matrix(args.manifest)
+        elif args.command == 'mark-shipped':
+            result = mark_shipped(args.output)
+        elif args.command == 'bench':
+            result = run_benchmarks(extra)
+        elif args.cache_list or args.cache_purge:
+            if args.cache_purge:
+                purge_cache(args.output)
+            else:
+                list_cache(args.output)
+            result = 0
+        elif args.test:
             result = run_tests()
         else:
             run_installer()
@@ -0,0 +1,132 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+from erf import (ERF_HEADER_SIZE, RIM_HEADER_SIZE, ErfError, ResourceArchive, compare_archives, merge_archives,
+                 write_erf, write_rim)
+
+UTC = 2027
+DLG = 2029
+UTM = 2051
+LOCALIZED_STRINGS = struct.pack('<II', 0, 5) + b'Danto'
+
+
+def pack_erf(resources, file_type=b'MOD ', localized_strings=LOCALIZED_STRINGS):
+    """ERF bytes for [(resref, restype, data)], laid out independently of erf.write_erf"""
+    keys_offset = ERF_HEADER_SIZE + len(localized_strings)
+    resources_offset = keys_offset + 24 * len(resources)
+    offset = resources_offset + 8 * len(resources)
+    header = struct.pack('<4s4sIIIIIIIII', file_type, b'V1.0', 1, len(localized_strings), len(resources),
+                         ERF_HEADER_SIZE, keys_offset, resources_offset, 103, 42, 0xFFFFFFFF)
+    keys = b''
+    table = b''
+    for index, (resref, restype, data) in enumerate(resources):
+        keys += struct.pack('<16sIHH', resref.encode('ascii'), index, restype, 0)
+        table += struct.pack('<II', offset, len(data))
+        offset += len(data)
+    return (header.ljust(ERF_HEADER_SIZE, b'\0') + localized_strings + keys + table +
+            b''.join(data for _, _, data in resources))
+
+
+def pack_rim(resources):
+    """RIM bytes for [(resref, restype, data)]"""
+    offset = RIM_HEADER_SIZE + 32 * len(resources)
+    keys = b''
+    for index, (resref, restype, data) in enumerate(resources):
+        keys += struct.pack('<16sIIII', resref.encode('ascii'), restype, index, offset, len(data))
+        offset += len(data)
+    header = struct.pack('<4s4sIIII', b'RIM ', b'V1.0', 0, len(resources), RIM_HEADER_SIZE, 0)
+    return header.ljust(RIM_HEADER_SIZE, b'\0') + keys + b''.join(data for _, _, data in resources)
+
+
+def contents(archive):
+    """{(resref, restype): data} of an open ResourceArchive"""
+    result = {}
+    for key, (resref, _, _) in archive.resources.items():
+        buffer = io.BytesIO()
+        archive.copy_to(key, buffer)
+        result[(resref, key[1])] = buffer.getvalue()
+    return result
+
+
+class ErfTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.temp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def rewrite(self, archive, name, writer):
+        path = os.path.join(self.temp.name, name)
+        chosen = {key: archive for key in archive.resources}
+        with open(path, 'wb') as f:
+            writer(f, chosen)
+        return path
+
+    def test_erf_round_trip(self):
+        resources = [("Carth", UTC, b"carth" * 50), ("dan13_intro", DLG, b"\x00\x01dialog"), ("empty", UTM, b"")]
+        with ResourceArchive(self.write("source.mod", pack_erf(resources))) as source:
+            path = self.rewrite(source, "copy.mod", lambda f, chosen: write_erf(f, source, chosen))
+        with ResourceArchive(path) as copy:
+            self.assertEqual(copy.file_type, b'MOD ')
+            self.assertEqual((copy.build_year, copy.build_day, copy.description), (103, 42, 0xFFFFFFFF))
+            offset, size = copy.localized_strings
+            self.assertEqual(copy.map[offset:offset + size], LOCALIZED_STRINGS)
+            self.assertEqual(contents(copy), {(resref, restype): data for resref, restype, data in resources})
+
+    def test_rim_round_trip(self):
+        resources = [("module", 2014, b"ifo data"), ("m01aa", 2012, b"are data" * 100)]
+        with ResourceArchive(self.write("source.rim", pack_rim(resources))) as source:
+            path = self.rewrite(source, "copy.rim", write_rim)
+        with ResourceArchive(path) as copy:
+            self.assertEqual(copy.file_type, b'RIM ')
+            self.assertEqual(contents(copy), {(resref, restype): data for resref, restype, data in resources})
+
+    def test_compare_archives(self):
+        earlier = self.write("earlier.mod", pack_erf([
+            ("carth", UTC, b"old carth"), ("bastila", UTC, b"same"), ("only_old", DLG, b"dropped")]))
+        later = self.write("later.mod", pack_erf([
+            ("Carth", UTC, b"new carth"), ("bastila", UTC, b"same"), ("only_new", UTM, b"store")]))
+        comparison = compare_archives([earlier, later])
+        self.assertEqual(comparison["changed"], [{"resource": "Carth.utc", "sources": [0, 1]}])
+        self.assertEqual(comparison["lost"], [{"resource": "only_old.dlg", "sources": [0]}])
+
+    def test_merge_later_archive_wins(self):
+        earlier = self.write("earlier.mod", pack_erf([("carth", UTC, b"old carth"), ("only_old", DLG, b"kept")]))
+        later = self.write("later.mod", pack_erf([("carth", UTC, b"new carth"), ("only_new", UTM, b"store")],
+                                                 file_type=b'ERF '))
+        dest_path = os.path.join(self.temp.name, "merged.mod")
+        self.assertEqual(merge_archives([earlier, later], dest_path), 3)
+        with ResourceArchive(dest_path) as merged:
+            self.assertEqual(merged.file_type, b'ERF ')
+            self.assertEqual(contents(merged), {
+                ("carth", UTC): b"new carth", ("only_old", DLG): b"kept", ("only_new", UTM): b"store"})
+
+    def test_merge_keeps_last_format(self):
+        earlier = self.write("earlier.mod", pack_erf([("module", 2014, b"old ifo"), ("m01aa", 2012, b"are")]))
+        later = self.write("later.rim", pack_rim([("module", 2014, b"new ifo")]))
+        dest_path = os.path.join(self.temp.name, "merged.rim")
+        merge_archives([earlier, later], dest_path)
+        with ResourceArchive(dest_path) as merged:
+            self.assertEqual(merged.file_type, b'RIM ')
+            self.assertEqual(contents(merged), {("module", 2014): b"new ifo", ("m01aa", 2012): b"are"})
+
+    def test_rejects_bad_archives(self):
+        good = pack_erf([("carth", UTC, b"carth")])
+        for name, data in [("text.mod", b"not an archive at all"), ("truncated.mod", good[:-3]),
+                           ("version.mod", good[:4] + b'V2.0' + good[8:])]:
+            with self.assertRaises(ErfError):
+                ResourceArchive(self.write(name, data))
+
+
+if __name__ == "__main__":
+    unittest.main()
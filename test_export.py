@@ -0,0 +1,94 @@
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from export import export_entries, export_tar, export_zip
+
+FILES = {
+    "Override/readme.txt": b"Some text that deflates well. " * 200,
+    "Override/texture.tpc": os.urandom(4096),
+    "Modules/danm13.mod": b"MOD V1.0" + bytes(1000),
+    "Override/ünïcode.2da": b"2DA V2.0\n\n",
+}
+
+
+class Cancelled(Exception):
+    pass
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.entries = []
+        for rel, data in FILES.items():
+            src_path = os.path.join(self.temp.name, "src", rel)
+            os.makedirs(os.path.dirname(src_path), exist_ok=True)
+            with open(src_path, 'wb') as f:
+                f.write(data)
+            self.entries.append((f"Android/{rel}", src_path))
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def dest(self, name):
+        return os.path.join(self.temp.name, name)
+
+    def assertNothingWritten(self, dest_path):
+        self.assertFalse(os.path.exists(dest_path))
+        self.assertFalse(os.path.exists(dest_path + ".partial"))
+
+    def test_zip_round_trip(self):
+        dest_path = self.dest("package.zip")
+        sizes = []
+        archive_bytes = export_zip(self.entries, dest_path, on_file=sizes.append)
+        self.assertEqual(archive_bytes, os.path.getsize(dest_path))
+        self.assertEqual(sorted(sizes), sorted(len(data) for data in FILES.values()))
+        with zipfile.ZipFile(dest_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), [arcname for arcname, _ in self.entries])
+            for rel, data in FILES.items():
+                info = zf.getinfo(f"Android/{rel}")
+                self.assertEqual(zf.read(info), data)
+                stored = rel.endswith(('.tpc', '.mod'))
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+
+    def test_tar_round_trip(self):
+        dest_path = self.dest("package.tar")
+        export_tar(self.entries, dest_path)
+        with tarfile.open(dest_path) as tar:
+            self.assertEqual(tar.getnames(), [arcname for arcname, _ in self.entries])
+            for rel, data in FILES.items():
+                self.assertEqual(tar.extractfile(f"Android/{rel}").read(), data)
+
+    def test_cancel_leaves_nothing(self):
+        for name in ("package.zip", "package.tar"):
+            checked = []
+
+            def check_cancelled():
+                checked.append(True)
+                if len(checked) > 2:
+                    raise Cancelled()
+
+            dest_path = self.dest(name)
+            with self.assertRaises(Cancelled):
+                export_entries(self.entries, dest_path, check_cancelled=check_cancelled)
+            self.assertNothingWritten(dest_path)
+
+    def test_failure_leaves_nothing(self):
+        entries = self.entries + [("Android/Override/gone.tga", self.dest("missing.tga"))]
+        for name in ("package.zip", "package.tar"):
+            dest_path = self.dest(name)
+            with self.assertRaises(OSError):
+                export_entries(entries, dest_path)
+            self.assertNothingWritten(dest_path)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            export_entries(self.entries, self.dest("package.7z"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+import textures
+from textures import (KEEP_EXTENSION, TGA_HEADER, TPC_DXT1, TPC_DXT5, TPC_HEADER, Image, TextureCache, TextureError,
+                      compress_dxt, downscale, optimize_texture, read_tga, write_tga, write_tpc)
+
+
+def pack_tga(width, height, channels, pixels, rle=False, bottom_up=False):
+    """TGA bytes for top-to-bottom pixels, laid out independently of textures.write_tga"""
+    row_size = width * channels
+    rows = [pixels[y * row_size:(y + 1) * row_size] for y in range(height)]
+    if bottom_up:
+        rows.reverse()
+    data = b''.join(rows)
+    if rle:
+        # One run-length packet per row; the rows are flat colours
+        data = b''.join(bytes([0x80 | (width - 1)]) + row[:channels] for row in rows)
+    descriptor = (0 if bottom_up else 0x20) | (8 if channels == 4 else 0)
+    header = TGA_HEADER.pack(0, 0, 10 if rle else 2, 0, 0, 0, 0, 0, width, height, channels * 8, descriptor)
+    return header + data
+
+
+def decode_dxt1_block(block):
+    """The 16 (b, g, r) colours of a four-colour DXT1 block"""
+    c0, c1, indices = struct.unpack('<HHI', block)
+
+    def expand(c):
+        r, g, b = c >> 11, (c >> 5) & 0x3F, c & 0x1F
+        return b << 3 | b >> 2, g << 2 | g >> 4, r << 3 | r >> 2
+
+    e0, e1 = expand(c0), expand(c1)
+    palette = [e0, e1, tuple((2 * a + b) // 3 for a, b in zip(e0, e1)),
+               tuple((a + 2 * b) // 3 for a, b in zip(e0, e1))]
+    return [palette[(indices >> (2 * i)) & 3] for i in range(16)]
+
+
+def gradient(width, height, channels):
+    return bytearray((x * 7 + y * 3 + k * 50) % 256
+                     for y in range(height) for x in range(width) for k in range(channels))
+
+
+class TextureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.temp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_tga_round_trip(self):
+        for channels in (3, 4):
+            pixels = gradient(6, 5, channels)
+            for bottom_up in (False, True):
+                image = read_tga(pack_tga(6, 5, channels, pixels, bottom_up=bottom_up))
+                self.assertEqual((image.width, image.height, image.channels), (6, 5, channels))
+                self.assertEqual(bytes(image.pixels), bytes(pixels))
+                again = read_tga(write_tga(image))
+                self.assertEqual(bytes(again.pixels), bytes(pixels))
+
+    def test_rle_tga(self):
+        pixels = bytearray(b''.join(bytes((y, 2 * y, 3 * y, 255)) * 8 for y in range(4)))
+        image = read_tga(pack_tga(8, 4, 4, pixels, rle=True, bottom_up=True))
+        self.assertEqual(bytes(image.pixels), bytes(pixels))
+
+    def test_rejects_unsupported_tgas(self):
+        good = pack_tga(4, 4, 3, gradient(4, 4, 3))
+        for data in (b"TGA", good[:2] + bytes([1]) + good[3:], good[:-5], good[:16] + bytes([16]) + good[17:]):
+            with self.assertRaises(TextureError):
+                read_tga(data)
+
+    def test_downscale(self):
+        image = Image(4, 2, 3, bytearray([0, 0, 0, 4, 4, 4, 10, 20, 30, 10, 20, 30,
+                                          8, 8, 8, 4, 4, 4, 10, 20, 30, 30, 40, 50]))
+        half = downscale(image)
+        self.assertEqual((half.width, half.height), (2, 1))
+        self.assertEqual(bytes(half.pixels), bytes([4, 4, 4, 15, 25, 35]))
+        # A one pixel wide image is only halved in height
+        column = downscale(Image(1, 2, 3, bytearray([0, 10, 20, 2, 12, 22])))
+        self.assertEqual((column.width, column.height, bytes(column.pixels)), (1, 1, bytes([1, 11, 21])))
+
+    def test_dxt1_flat_colours_are_exact(self):
+        # Colours made of 5/6/5 bit values expand back to themselves
+        colours = [(0x08, 0x0C, 0x10), (0xFF, 0xFF, 0xFF), (0x84, 0x82, 0x00), (0x00, 0x00, 0x00)]
+        pixels = bytearray()
+        for y in range(4):
+            for colour in colours:
+                pixels += bytes(colour) * 4
+        image = Image(16, 4, 3, pixels)
+        data = compress_dxt(image, alpha=False)
+        self.assertEqual(len(data), 4 * 8)
+        for block, colour in enumerate(colours):
+            self.assertEqual(decode_dxt1_block(data[8 * block:8 * block + 8]), [colour] * 16)
+
+    def test_dxt1_two_colours(self):
+        dark, light = (0x00, 0x00, 0x00), (0xFF, 0xFF, 0xFF)
+        pixels = bytearray(b''.join(bytes(dark if (x + y) % 2 else light) for y in range(4) for x in range(4)))
+        decoded = decode_dxt1_block(compress_dxt(Image(4, 4, 3, pixels), alpha=False))
+        self.assertEqual(decoded, [dark if (i % 4 + i // 4) % 2 else light for i in range(16)])
+
+    def test_tpc_layout(self):
+        for channels, alpha_value, encoding, block_size in ((3, None, TPC_DXT1, 8), (4, 128, TPC_DXT5, 16)):
+            pixels = gradient(16, 8, channels)
+            if alpha_value is not None:
+                pixels[3::4] = bytes([alpha_value]) * (16 * 8)
+            data = write_tpc(Image(16, 8, channels, pixels))
+            first_size, _, width, height, found_encoding, mipmaps = TPC_HEADER.unpack_from(data)
+            self.assertEqual((width, height, found_encoding), (16, 8, encoding))
+            # 16x8, 8x4, 4x2, 2x1, 1x1; levels under 4x4 still take a whole block
+            self.assertEqual(mipmaps, 5)
+            self.assertEqual(first_size, 4 * 2 * block_size)
+            self.assertEqual(len(data), TPC_HEADER.size + (8 + 2 + 1 + 1 + 1) * block_size)
+            if alpha_value is not None:
+                self.assertEqual(data[TPC_HEADER.size:TPC_HEADER.size + 2], bytes([alpha_value] * 2))
+
+    @unittest.skipIf(textures.numpy is None, "numpy is not installed")
+    def test_numpy_matches_pure_python(self):
+        rng = random.Random(7)
+        for width, height, channels in ((1, 1, 3), (2, 1, 4), (3, 5, 4), (8, 8, 3), (33, 17, 4)):
+            pixels = bytearray(rng.getrandbits(8) for _ in range(width * height * channels))
+            image = Image(width, height, channels, pixels)
+            fast = (downscale(image).pixels, [compress_dxt(image, alpha) for alpha in (False, channels == 4)])
+            numpy, textures.numpy = textures.numpy, None
+            try:
+                slow = (downscale(image).pixels, [compress_dxt(image, alpha) for alpha in (False, channels == 4)])
+            finally:
+                textures.numpy = numpy
+            self.assertEqual(fast, slow)
+
+    def test_optimize_texture(self):
+        cache_dir = os.path.join(self.temp.name, "cache")
+        os.makedirs(cache_dir)
+        big = self.write("big.tga", pack_tga(64, 64, 4, gradient(64, 64, 4)))
+        result = optimize_texture(big, os.path.join(cache_dir, "big"), 16, False)
+        self.assertTrue(result.endswith(".tga"))
+        with open(result, 'rb') as f:
+            image = read_tga(f.read())
+        self.assertEqual((image.width, image.height), (16, 16))
+        result = optimize_texture(big, os.path.join(cache_dir, "big-tpc"), 32, True)
+        self.assertTrue(result.endswith(".tpc"))
+        # Already small enough and not compressed: ships as it is
+        small = self.write("small.tga", pack_tga(8, 8, 3, gradient(8, 8, 3)))
+        self.assertIsNone(optimize_texture(small, os.path.join(cache_dir, "small"), 16, False))
+        self.assertTrue(os.path.exists(os.path.join(cache_dir, "small" + KEEP_EXTENSION)))
+
+    def test_cache_lookup(self):
+        cache = TextureCache(os.path.join(self.temp.name, "cache"), 16)
+        os.makedirs(cache.cache_dir)
+        self.assertEqual(cache.lookup("digest", True), (False, None))
+        path = optimize_texture(self.write("a.tga", pack_tga(32, 32, 3, gradient(32, 32, 3))),
+                                cache.stem("digest", True), 16, True)
+        self.assertEqual(cache.lookup("digest", True), (True, path))
+        # Compressed and uncompressed results are kept apart
+        self.assertEqual(cache.lookup("digest", False), (False, None))
+        cache.used.clear()
+        cache.prune()
+        self.assertEqual(os.listdir(cache.cache_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from tlk import TLK_ENTRY, TLK_HEADER, TalkTable, TlkError, diff_tlk, merge_tlk
+
+TEXT_PRESENT = 0x1
+SOUND_PRESENT = 0x2
+
+
+def pack_tlk(entries, language=0):
+    """TLK V3.0 bytes for [(text, sound resref)], with the texts stored back to front.
+
+    Storing them in reverse keeps the fixture's string offsets different
+    from what merge_tlk writes, so comparisons can't depend on them.
+    """
+    encoded = [text.encode('cp1252') for text, _ in entries]
+    offsets = {}
+    strings = b''
+    for index in reversed(range(len(entries))):
+        offsets[index] = len(strings)
+        strings += encoded[index]
+    records = b''
+    for index, (text, sound) in enumerate(entries):
+        flags = TEXT_PRESENT | (SOUND_PRESENT if sound else 0)
+        records += TLK_ENTRY.pack(flags, sound.encode('ascii'), 0, 0, offsets[index], len(encoded[index]), 0.0)
+    strings_offset = TLK_HEADER.size + len(records)
+    return TLK_HEADER.pack(b'TLK ', b'V3.0', language, len(entries), strings_offset) + records + strings
+
+
+def read_entries(path):
+    """[(text, sound resref)] of a talk table"""
+    with TalkTable(path) as table:
+        entries = []
+        for index in range(len(table)):
+            sound = TLK_ENTRY.unpack(table.record(index))[1].rstrip(b'\0').decode('ascii')
+            entries.append((table.text(index), sound))
+        return entries
+
+
+BASE = [("", ""), ("Hello there.", "n_hello"), ("I am Carth Onasi.", "n_carth"), ("Goodbye.", "")]
+
+
+class TlkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, name, entries, language=0):
+        path = os.path.join(self.temp.name, name)
+        with open(path, 'wb') as f:
+            f.write(pack_tlk(entries, language))
+        return path
+
+    def test_round_trip(self):
+        entries = BASE + [("Café – special characters", "n_cafe")]
+        base = self.write("base.tlk", entries, language=3)
+        dest_path = os.path.join(self.temp.name, "dialog.tlk")
+        changes, conflicts = merge_tlk(base, [], dest_path)
+        self.assertEqual((changes, conflicts), ({}, []))
+        self.assertEqual(read_entries(dest_path), entries)
+        with TalkTable(dest_path) as merged, TalkTable(base) as original:
+            self.assertEqual(merged.language, 3)
+            self.assertEqual(diff_tlk(original, merged), ([], [], []))
+
+    def test_diff(self):
+        base = self.write("base.tlk", BASE)
+        other = self.write("other.tlk", [BASE[0], ("Hi.", "n_hello"), BASE[2], BASE[3], ("New line.", "")])
+        shorter = self.write("shorter.tlk", [BASE[0], BASE[1], ("I am Carth Onasi.", "n_carth2")])
+        with TalkTable(base) as b, TalkTable(other) as o, TalkTable(shorter) as s:
+            self.assertEqual(diff_tlk(b, o), ([1], [4], []))
+            # A changed sound counts as a change even when the text is the same
+            self.assertEqual(diff_tlk(b, s), ([2], [], [3]))
+
+    def test_merge_applies_every_mod(self):
+        base = self.write("base.tlk", BASE)
+        first = self.write("first.tlk", [BASE[0], ("Greetings.", "n_hello"), BASE[2], BASE[3]])
+        second = self.write("second.tlk", BASE[:3] + [("Farewell.", ""), ("Added by the second mod.", "")])
+        dest_path = os.path.join(self.temp.name, "dialog.tlk")
+        changes, conflicts = merge_tlk(base, [first, second], dest_path)
+        self.assertEqual(changes, {first: 1, second: 2})
+        self.assertEqual(conflicts, [])
+        self.assertEqual(read_entries(dest_path), [
+            BASE[0], ("Greetings.", "n_hello"), BASE[2], ("Farewell.", ""), ("Added by the second mod.", "")])
+
+    def test_merge_conflict_last_mod_wins(self):
+        base = self.write("base.tlk", BASE)
+        first = self.write("first.tlk", [BASE[0], ("Greetings.", "n_hello"), ("I am Carth.", "n_carth"), BASE[3]])
+        second = self.write("second.tlk", [BASE[0], ("Greetings.", "n_hello"), ("Carth Onasi, Republic.", "n_carth"),
+                                           BASE[3]])
+        dest_path = os.path.join(self.temp.name, "dialog.tlk")
+        changes, conflicts = merge_tlk(base, [first, second], dest_path)
+        self.assertEqual(changes, {first: 2, second: 2})
+        # Both mods set entry 1 to the same text, so only entry 2 is a conflict
+        self.assertEqual(conflicts, [(2, [first, second])])
+        self.assertEqual(read_entries(dest_path)[1:3],
+                         [("Greetings.", "n_hello"), ("Carth Onasi, Republic.", "n_carth")])
+
+    def test_rejects_bad_tables(self):
+        good = pack_tlk(BASE)
+        for name, data in [("short.tlk", b"TLK "), ("version.tlk", good[:4] + b'V4.0' + good[8:]),
+                           ("truncated.tlk", good[:TLK_HEADER.size + TLK_ENTRY.size])]:
+            path = os.path.join(self.temp.name, name)
+            with open(path, 'wb') as f:
+                f.write(data)
+            with self.assertRaises(TlkError):
+                TalkTable(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from twoda import TwoDAError, Table, TableCache, diff_tables, merge_tables, parse, write_binary
+
+COLUMNS = ["label", "name", "cost"]
+ROWS = [
+    ("0", {"label": "Blaster", "name": "1001", "cost": "100"}),
+    ("1", {"label": "Vibroblade", "name": "1002", "cost": ""}),
+    ("2", {"label": "Lightsaber", "name": "1003", "cost": "100"}),
+]
+
+
+def pack_text(columns, rows):
+    """Text V2.0 table bytes; blank cells are written as ****"""
+    lines = ["2DA V2.0", "", " ".join(columns)]
+    for label, values in rows:
+        cells = [values.get(column) or "****" for column in columns]
+        lines.append(" ".join([label] + [f'"{cell}"' if " " in cell else cell for cell in cells]))
+    return ("\r\n".join(lines) + "\r\n").encode('latin-1')
+
+
+def pack_binary(columns, rows):
+    """Binary V2.b table bytes, with every cell's string stored separately"""
+    data = b''
+    offsets = []
+    for _, values in rows:
+        for column in columns:
+            offsets.append(len(data))
+            data += values.get(column, "").encode('latin-1') + b'\0'
+    return (b'2DA V2.b\n' + ''.join(f"{column}\t" for column in columns).encode('latin-1') + b'\0' +
+            struct.pack('<I', len(rows)) + ''.join(f"{label}\t" for label, _ in rows).encode('latin-1') +
+            struct.pack(f'<{len(offsets)}H', *offsets) + struct.pack('<H', len(data)) + data)
+
+
+def cells(table):
+    """[(label, {column: value})] of a table"""
+    return [(table.labels[row], table.row(row)) for row in range(len(table))]
+
+
+class TwoDATest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.temp.name, name)
+
+    def rewritten(self, table):
+        path = self.path("rewritten.2da")
+        write_binary(table, path)
+        with open(path, 'rb') as f:
+            return parse(f.read())
+
+    def test_text_round_trip(self):
+        rows = ROWS + [("3", {"label": "Heavy repeater", "name": "1004", "cost": "250"})]
+        table = parse(pack_text(COLUMNS, rows))
+        self.assertEqual(table.columns, COLUMNS)
+        self.assertEqual(cells(table), rows)
+        self.assertEqual(cells(self.rewritten(table)), rows)
+
+    def test_binary_round_trip(self):
+        table = parse(pack_binary(COLUMNS, ROWS))
+        self.assertEqual(cells(table), ROWS)
+        rewritten = self.rewritten(table)
+        self.assertEqual(rewritten.columns, COLUMNS)
+        self.assertEqual(cells(rewritten), ROWS)
+        # Equal values are written once however many cells hold them
+        with open(self.path("rewritten.2da"), 'rb') as f:
+            self.assertEqual(f.read().count(b'100\0'), 1)
+
+    def test_diff(self):
+        base = parse(pack_text(COLUMNS, ROWS))
+        other = parse(pack_text(COLUMNS + ["icon"], [
+            ("0", dict(ROWS[0][1], icon="iw_blaster")), ("1", dict(ROWS[1][1], cost="50")), ROWS[2],
+            ("3", {"label": "Bowcaster", "name": "1005", "cost": "300"})]))
+        changed, added, new_columns = diff_tables(base, other)
+        self.assertEqual(changed, {(0, "icon"): "iw_blaster", (1, "cost"): "50"})
+        self.assertEqual(added, {3: ("3", {"label": "Bowcaster", "name": "1005", "cost": "300", "icon": ""})})
+        self.assertEqual(new_columns, ["icon"])
+
+    def test_merge_applies_every_table(self):
+        base = parse(pack_text(COLUMNS, ROWS))
+        first = parse(pack_text(COLUMNS, [ROWS[0], ("1", dict(ROWS[1][1], cost="50")), ROWS[2]]))
+        second = parse(pack_binary(COLUMNS + ["icon"], [
+            ("0", dict(ROWS[0][1], icon="iw_blaster")), ROWS[1], ROWS[2],
+            ("3", {"label": "Bowcaster", "name": "1005", "cost": "300"})]))
+        merged, changes, conflicts = merge_tables(base, [first, second])
+        self.assertEqual(changes, [1, 2])
+        self.assertEqual(conflicts, [])
+        self.assertEqual(cells(merged), [
+            ("0", dict(ROWS[0][1], icon="iw_blaster")), ("1", dict(ROWS[1][1], cost="50", icon="")),
+            ("2", dict(ROWS[2][1], icon="")), ("3", {"label": "Bowcaster", "name": "1005", "cost": "300", "icon": ""})])
+        # The base table is left as it was
+        self.assertEqual(cells(base), ROWS)
+
+    def test_merge_conflicts_later_table_wins(self):
+        base = parse(pack_text(COLUMNS, ROWS))
+        first = parse(pack_text(COLUMNS, [
+            ("0", dict(ROWS[0][1], cost="80")), ROWS[1], ("2", dict(ROWS[2][1], cost="90")),
+            ("3", {"label": "Bowcaster", "name": "1005", "cost": "300"})]))
+        second = parse(pack_text(COLUMNS, [
+            ("0", dict(ROWS[0][1], cost="80")), ROWS[1], ("2", dict(ROWS[2][1], cost="95")),
+            ("3", {"label": "Disruptor", "name": "1006", "cost": "400"})]))
+        merged, changes, conflicts = merge_tables(base, [first, second])
+        # Both tables set row 0's cost to the same value, so that isn't a conflict
+        self.assertEqual(conflicts, [(2, "cost", [0, 1]), (3, None, [0, 1])])
+        self.assertEqual(merged.get(0, "cost"), "80")
+        self.assertEqual(merged.get(2, "cost"), "95")
+        self.assertEqual(cells(merged)[3], ("3", {"label": "Disruptor", "name": "1006", "cost": "400"}))
+
+    def test_cache_reuses_parsed_tables(self):
+        path = self.path("baseitems.2da")
+        with open(path, 'wb') as f:
+            f.write(pack_text(COLUMNS, ROWS))
+        cache_dir = self.path("cache")
+        self.assertEqual(cells(TableCache(cache_dir).load(path, "digest")), ROWS)
+        # A cached table is returned without reading the file again
+        os.remove(path)
+        cache = TableCache(cache_dir)
+        self.assertEqual(cells(cache.load(path, "digest")), ROWS)
+        cache.used.clear()
+        cache.prune()
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_rejects_bad_tables(self):
+        good = pack_binary(COLUMNS, ROWS)
+        for data in (b"not a table", b"2DA V2.0\n\n", good[:good.index(b'\0') + 10]):
+            with self.assertRaises(TwoDAError):
+                parse(data)
+        big = Table(["label"])
+        big.append_row("0", {"label": "x" * 70000})
+        with self.assertRaises(TwoDAError):
+            write_binary(big, self.path("big.2da"))
+
+
+if __name__ == "__main__":
+    unittest.main()
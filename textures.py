@@ -0,0 +1,342 @@
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import numpy
+except ImportError:  # Optional; the same conversion runs in pure Python, only much slower
+    numpy = None
+
+TEXTURE_CACHE_DIR_NAME = "texture_cache"
+TEXTURE_REPORT_NAME = "texture_report.json"
+# Longest side, in pixels, of textures optimized for phones from the GUI
+DEFAULT_MAX_TEXTURE_SIZE = 1024
+# Bump when the optimized output for the same input changes
+CACHE_VERSION = 1
+TGA_HEADER = struct.Struct('<BBBHHBHHHHBB')
+TGA_TRUE_COLOR = 2
+TGA_TRUE_COLOR_RLE = 10
+# Data size of the first mipmap, alpha test, width, height, encoding, mipmap count
+TPC_HEADER = struct.Struct('<IfHHBB114x')
+TPC_DXT1 = 2
+TPC_DXT5 = 4
+# DXT1 codes for the colours at 0, 1/3, 2/3 and 1 of the way from the darkest to the brightest endpoint
+DXT1_CODES = (1, 3, 2, 0)
+# DXT5 codes for the alpha levels at 0/7 .. 7/7 of the way from the lowest to the highest endpoint
+DXT5_ALPHA_CODES = (1, 7, 6, 5, 4, 3, 2, 0)
+# Rough pure-Python conversion speed, in source bytes per second per worker, for the log's time estimate
+PURE_PYTHON_BYTES_PER_SECOND = 3 * 1024 ** 2
+RESULT_EXTENSIONS = (".tpc", ".tga")
+# Marks an input that is shipped as it is (not worth changing, or a TGA kind we don't touch)
+KEEP_EXTENSION = ".keep"
+
+
+class TextureError(ValueError):
+    """Raised for TGA files this module doesn't convert"""
+
+
+class Image:
+    """Uncompressed BGR or BGRA pixels, rows top to bottom"""
+
+    def __init__(self, width, height, channels, pixels):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.pixels = pixels
+
+
+def read_tga(data):
+    """Decode a 24 or 32 bit true-colour TGA, plain or run-length encoded"""
+    if len(data) < TGA_HEADER.size:
+        raise TextureError("too small to be a TGA file")
+    (id_length, colormap_type, image_type, _, colormap_length, colormap_depth,
+     _, _, width, height, depth, descriptor) = TGA_HEADER.unpack_from(data)
+    if image_type not in (TGA_TRUE_COLOR, TGA_TRUE_COLOR_RLE) or depth not in (24, 32):
+        raise TextureError("not a 24 or 32 bit true-colour TGA")
+    if descriptor & 0x10:
+        raise TextureError("right-to-left TGAs aren't supported")
+    if not width or not height:
+        raise TextureError("the image is empty")
+    channels = depth // 8
+    pos = TGA_HEADER.size + id_length + (colormap_length * ((colormap_depth + 7) // 8) if colormap_type else 0)
+    size = width * height * channels
+    if image_type == TGA_TRUE_COLOR:
+        pixels = bytearray(data[pos:pos + size])
+    else:
+        pixels = bytearray()
+        while len(pixels) < size and pos < len(data):
+            packet = data[pos]
+            count = (packet & 0x7F) + 1
+            if packet & 0x80:
+                pixels += data[pos + 1:pos + 1 + channels] * count
+                pos += 1 + channels
+            else:
+                pixels += data[pos + 1:pos + 1 + count * channels]
+                pos += 1 + count * channels
+        del pixels[size:]
+    if len(pixels) != size:
+        raise TextureError("the pixel data is truncated")
+    if not descriptor & 0x20:
+        # Stored bottom row first
+        row_size = width * channels
+        pixels = bytearray().join(pixels[y:y + row_size] for y in range(size - row_size, -1, -row_size))
+    return Image(width, height, channels, pixels)
+
+
+def write_tga(image):
+    """Encode an image as an uncompressed TGA"""
+    alpha_bits = 8 if image.channels == 4 else 0
+    header = TGA_HEADER.pack(0, 0, TGA_TRUE_COLOR, 0, 0, 0, 0, 0, image.width, image.height,
+                             image.channels * 8, 0x20 | alpha_bits)
+    return header + bytes(image.pixels)
+
+
+def downscale(image):
+    """Halve an image in each direction longer than one pixel, averaging 2x2 boxes"""
+    width, height, channels = image.width, image.height, image.channels
+    step_x = 2 if width > 1 else 1
+    step_y = 2 if height > 1 else 1
+    new_width, new_height = width // step_x, height // step_y
+    if numpy is not None:
+        boxes = numpy.frombuffer(image.pixels, numpy.uint8).reshape(height, width, channels)
+        boxes = boxes[:new_height * step_y, :new_width * step_x].reshape(
+            new_height, step_y, new_width, step_x, channels).astype(numpy.uint16)
+        # A 2x1 or 1x2 box counts each pixel twice, like the four-pixel sum below
+        total = boxes.sum(axis=(1, 3), dtype=numpy.uint16) * (4 // (step_x * step_y))
+        return Image(new_width, new_height, channels, bytearray(((total + 2) >> 2).astype(numpy.uint8)))
+    row_size = width * channels
+    stride = channels * step_x
+    pixels = image.pixels
+    out = bytearray(new_width * new_height * channels)
+    out_row_size = new_width * channels
+    for y in range(new_height):
+        top = pixels[y * step_y * row_size:(y * step_y + 1) * row_size]
+        bottom = pixels[(y * step_y + step_y - 1) * row_size:(y * step_y + step_y) * row_size]
+        row = bytearray(out_row_size)
+        for k in range(channels):
+            odd = k + channels * (step_x - 1)
+            row[k::channels] = bytes((a + b + c + d + 2) >> 2 for a, b, c, d in zip(
+                top[k::stride], top[odd::stride], bottom[k::stride], bottom[odd::stride]))
+        out[y * out_row_size:(y + 1) * out_row_size] = row
+    return Image(new_width, new_height, channels, out)
+
+
+def has_alpha(image):
+    return image.channels == 4 and min(image.pixels[3::4]) < 255
+
+
+def color_block(blues, greens, reds):
+    """DXT1 block for 16 pixels, with the colour bounding box corners as endpoints"""
+    r_max, r_min = max(reds), min(reds)
+    g_max, g_min = max(greens), min(greens)
+    b_max, b_min = max(blues), min(blues)
+    c0 = (r_max >> 3) << 11 | (g_max >> 2) << 5 | b_max >> 3
+    c1 = (r_min >> 3) << 11 | (g_min >> 2) << 5 | b_min >> 3
+    if c0 == c1:
+        return struct.pack('<HHI', c0, c1, 0)
+    # c0 is at least c1 in every field, so c0 > c1 and the block uses four colours
+    dr, dg, db = r_max - r_min, g_max - g_min, b_max - b_min
+    length = dr * dr + dg * dg + db * db
+    indices = 0
+    for i, (b, g, r) in enumerate(zip(blues, greens, reds)):
+        along = (r - r_min) * dr + (g - g_min) * dg + (b - b_min) * db
+        indices |= DXT1_CODES[(along * 6 + length) // (2 * length)] << (2 * i)
+    return struct.pack('<HHI', c0, c1, indices)
+
+
+def alpha_block(alphas):
+    """DXT5 alpha block for 16 pixels, interpolating between the lowest and highest alpha"""
+    a0, a1 = max(alphas), min(alphas)
+    if a0 == a1:
+        return bytes((a0, a1)) + bytes(6)
+    span = a0 - a1
+    indices = 0
+    for i, a in enumerate(alphas):
+        indices |= DXT5_ALPHA_CODES[((a - a1) * 14 + span) // (2 * span)] << (3 * i)
+    return bytes((a0, a1)) + indices.to_bytes(6, 'little')
+
+
+def compress_dxt_array(image, alpha):
+    """compress_dxt with numpy, every block of the level at once; the output is the same"""
+    width, height, channels = image.width, image.height, image.channels
+    pixels = numpy.frombuffer(image.pixels, numpy.uint8).reshape(height, width, channels)
+    pad_y, pad_x = -height % 4, -width % 4
+    if pad_y or pad_x:
+        pixels = numpy.pad(pixels, ((0, pad_y), (0, pad_x), (0, 0)), mode='edge')
+    rows, columns = (height + pad_y) // 4, (width + pad_x) // 4
+    # One row per block, its 16 pixels in the order compress_dxt reads them
+    blocks = pixels.reshape(rows, 4, columns, 4, channels).swapaxes(1, 2).reshape(-1, 16, channels).astype(numpy.int64)
+    shifts = numpy.arange(16, dtype=numpy.uint64)
+
+    highs, lows = blocks.max(axis=1), blocks.min(axis=1)
+    c0 = (highs[:, 2] >> 3) << 11 | (highs[:, 1] >> 2) << 5 | highs[:, 0] >> 3
+    c1 = (lows[:, 2] >> 3) << 11 | (lows[:, 1] >> 2) << 5 | lows[:, 0] >> 3
+    spans = (highs - lows)[:, :3]
+    length = (spans * spans).sum(axis=1)[:, None]
+    along = ((blocks[:, :, :3] - lows[:, None, :3]) * spans[:, None, :]).sum(axis=2)
+    codes = numpy.array(DXT1_CODES, numpy.uint64)[(along * 6 + length) // numpy.maximum(2 * length, 1)]
+    indices = numpy.bitwise_or.reduce(codes << (2 * shifts), axis=1)
+    indices[c0 == c1] = 0
+    out = c0.astype(numpy.uint64) | c1.astype(numpy.uint64) << 16 | indices << 32
+
+    if alpha:
+        a0, a1 = highs[:, 3][:, None], lows[:, 3][:, None]
+        span = a0 - a1
+        levels = ((blocks[:, :, 3] - a1) * 14 + span) // numpy.maximum(2 * span, 1)
+        codes = numpy.array(DXT5_ALPHA_CODES, numpy.uint64)[levels]
+        indices = numpy.bitwise_or.reduce(codes << (3 * shifts), axis=1)
+        indices[span[:, 0] == 0] = 0
+        alphas = a0[:, 0].astype(numpy.uint64) | a1[:, 0].astype(numpy.uint64) << 8 | indices << 16
+        out = numpy.stack((alphas, out), axis=1)
+    return bytearray(out.astype('<u8'))
+
+
+def compress_dxt(image, alpha):
+    """DXT1 (or DXT5 with alpha) data for one mipmap level"""
+    if numpy is not None:
+        return compress_dxt_array(image, alpha)
+    width, height, channels = image.width, image.height, image.channels
+    row_size = width * channels
+    out = bytearray()
+    # Blocks hanging over the edge of a small mipmap repeat the last row or column
+    for block_y in range(0, height, 4):
+        planes = []
+        for y in (min(block_y + i, height - 1) for i in range(4)):
+            row = image.pixels[y * row_size:(y + 1) * row_size]
+            planes.append([row[k::channels] for k in range(channels)])
+        for block_x in range(0, width, 4):
+            xs = [min(block_x + i, width - 1) for i in range(4)]
+            blues, greens, reds, alphas = [], [], [], []
+            for plane in planes:
+                blues += [plane[0][x] for x in xs]
+                greens += [plane[1][x] for x in xs]
+                reds += [plane[2][x] for x in xs]
+                if alpha:
+                    alphas += [plane[3][x] for x in xs]
+            if alpha:
+                out += alpha_block(alphas)
+            out += color_block(blues, greens, reds)
+    return out
+
+
+def write_tpc(image):
+    """Encode an image as a DXT compressed TPC with a full mipmap chain"""
+    alpha = has_alpha(image)
+    levels = [compress_dxt(image, alpha)]
+    mipmap = image
+    while mipmap.width > 1 or mipmap.height > 1:
+        mipmap = downscale(mipmap)
+        levels.append(compress_dxt(mipmap, alpha))
+    header = TPC_HEADER.pack(len(levels[0]), 0.0, image.width, image.height,
+                             TPC_DXT5 if alpha else TPC_DXT1, len(levels))
+    return header + b''.join(levels)
+
+
+def is_power_of_two(n):
+    return n > 0 and n & (n - 1) == 0
+
+
+def can_compress(image):
+    """Whether the game can use the image as a DXT texture with mipmaps"""
+    return is_power_of_two(image.width) and is_power_of_two(image.height) and min(image.width, image.height) >= 4
+
+
+def optimize_texture(src_path, cache_stem, max_size, compress):
+    """Downscale and/or compress one TGA into the cache.
+
+    Returns the cached file, or None when the source should ship as it
+    is (already small enough, not a true-colour TGA, or no smaller once
+    converted). Runs in a worker process.
+    """
+    with open(src_path, 'rb') as f:
+        data = f.read()
+    result = None
+    try:
+        image = read_tga(data)
+        changed = False
+        while max_size and max(image.width, image.height) > max_size:
+            image = downscale(image)
+            changed = True
+        if compress and can_compress(image):
+            result = (write_tpc(image), ".tpc")
+        elif changed:
+            result = (write_tga(image), ".tga")
+    except TextureError:
+        pass
+    if result is None or len(result[0]) >= len(data):
+        open(cache_stem + KEEP_EXTENSION, 'wb').close()
+        return None
+    output, ext = result
+    temp_path = f"{cache_stem}.partial-{os.getpid()}"
+    with open(temp_path, 'wb') as f:
+        f.write(output)
+    os.replace(temp_path, cache_stem + ext)
+    return cache_stem + ext
+
+
+def pure_python_estimate(source_bytes, job_count):
+    """Rough seconds converting job_count textures takes without numpy, or None if numpy is installed"""
+    if numpy is not None or not job_count:
+        return None
+    workers = max(1, min(job_count, os.cpu_count() or 1))
+    return source_bytes / PURE_PYTHON_BYTES_PER_SECOND / workers
+
+
+def optimize_many(jobs, max_workers=None):
+    """Run optimize_texture(*job) for every job tuple in a process pool.
+
+    Yields (job, result, error) as each texture finishes, like
+    archive_utils.extract_many.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    workers = max_workers or max(1, min(len(jobs), os.cpu_count() or 1))
+    if workers == 1:
+        for job in jobs:
+            try:
+                yield job, optimize_texture(*job), None
+            except Exception as e:
+                yield job, None, e
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(optimize_texture, *job): job for job in jobs}
+        try:
+            for future in as_completed(futures):
+                error = future.exception()
+                yield futures[future], (None if error else future.result()), error
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class TextureCache:
+    """Optimized textures kept by source hash and settings, so each is only converted once"""
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.used = set()
+
+    def stem(self, digest, compress):
+        """Path, without extension, of a source's cache entry"""
+        name = f"{digest}-{self.max_size or 0}-{int(bool(compress))}-v{CACHE_VERSION}"
+        self.used.add(name)
+        return os.path.join(self.cache_dir, name)
+
+    def lookup(self, digest, compress):
+        """(True, cached path or None) for a texture converted before, else (False, None)"""
+        stem = self.stem(digest, compress)
+        for ext in RESULT_EXTENSIONS:
+            if os.path.exists(stem + ext):
+                return True, stem + ext
+        return os.path.exists(stem + KEEP_EXTENSION), None
+
+    def prune(self):
+        """Delete entries that weren't used since this cache was opened"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if os.path.splitext(name)[0] not in self.used:
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,158 @@
+import array
+import mmap
+import os
+import struct
+
+TLK_NAME = "dialog.tlk"
+TLK_HEADER = struct.Struct('<4s4sIII')
+# Flags, sound resref, volume variance, pitch variance, string offset, string size, sound length
+TLK_ENTRY = struct.Struct('<I16sIIIIf')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class TlkError(ValueError):
+    """Raised for files that aren't valid TLK V3.0 talk tables"""
+
+
+class TalkTable:
+    """dialog.tlk read through a memory map.
+
+    Only the header is parsed up front; entries are unpacked from the
+    map when asked for, so opening the base game's table is instant and
+    comparing two tables never decodes strings that are equal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = None
+        try:
+            if os.fstat(self.file.fileno()).st_size < TLK_HEADER.size:
+                raise TlkError(f"{os.path.basename(path)} is too small to be a talk table")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            file_type, version, self.language, self.count, self.strings_offset = TLK_HEADER.unpack_from(self.map)
+            if file_type != b'TLK ' or version != b'V3.0':
+                raise TlkError(f"{os.path.basename(path)} is not a TLK V3.0 file")
+            if TLK_HEADER.size + self.count * TLK_ENTRY.size > len(self.map):
+                raise TlkError(f"{os.path.basename(path)} is truncated")
+        except TlkError:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        """The 40 byte entry record of a string reference"""
+        start = TLK_HEADER.size + index * TLK_ENTRY.size
+        return self.map[start:start + TLK_ENTRY.size]
+
+    def text_range(self, index):
+        """(start, end) of an entry's text in the file"""
+        _, _, _, _, offset, size, _ = TLK_ENTRY.unpack(self.record(index))
+        start = self.strings_offset + offset
+        if start + size > len(self.map):
+            raise TlkError(f"{os.path.basename(self.path)}: string {index} runs past the end")
+        return start, start + size
+
+    def text(self, index):
+        """Decoded text of a string reference"""
+        start, end = self.text_range(index)
+        return self.map[start:end].decode('cp1252', errors='replace')
+
+    def same_entry(self, index, other, other_index=None):
+        """Whether an entry holds the same text, sound and flags as one in another table"""
+        other_index = index if other_index is None else other_index
+        mine, theirs = self.record(index), other.record(other_index)
+        # Everything but the string offset, which only says where the text sits in each file
+        if mine[:28] != theirs[:28] or mine[32:] != theirs[32:]:
+            return False
+        start, end = self.text_range(index)
+        other_start, other_end = other.text_range(other_index)
+        return self.map[start:end] == other.map[other_start:other_end]
+
+    def copy_text(self, index, f):
+        """Stream an entry's text into an open file"""
+        start, end = self.text_range(index)
+        with memoryview(self.map) as view:
+            while start < end:
+                f.write(view[start:min(start + COPY_CHUNK_SIZE, end)])
+                start += COPY_CHUNK_SIZE
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def diff_tlk(base, other):
+    """Compare two TalkTables. Returns sorted (changed, added, removed) string references"""
+    common = min(len(base), len(other))
+    changed = [i for i in range(common) if not base.same_entry(i, other)]
+    added = list(range(common, len(other)))
+    removed = list(range(common, len(base)))
+    return changed, added, removed
+
+
+def merge_tlk(base_path, mod_paths, dest_path):
+    """Write one talk table with every mod's changes to a base table applied.
+
+    mod_paths are in load order. Each entry comes from the last mod that
+    changed or added it, or from the base. Returns (changes, conflicts):
+    changes maps each mod path to its number of changed and added
+    entries, conflicts lists (string reference, mod paths) where
+    several mods set different text for the same entry.
+    """
+    tables = []
+    try:
+        base = TalkTable(base_path)
+        tables.append(base)
+        for path in mod_paths:
+            tables.append(TalkTable(path))
+        mods = tables[1:]
+        count = max(len(t) for t in tables)
+        # Index into tables of the table each entry is taken from
+        chosen = array.array('H', bytes(2 * count))
+        changes = {path: 0 for path in mod_paths}
+        conflicts = []
+        for index in range(count):
+            setters = []
+            for table_index, mod in enumerate(mods, 1):
+                if index >= len(mod):
+                    continue
+                if index < len(base) and base.same_entry(index, mod):
+                    continue
+                setters.append(table_index)
+            if not setters:
+                continue
+            winner = setters[-1]
+            chosen[index] = winner
+            for table_index in setters:
+                changes[tables[table_index].path] += 1
+            if any(not tables[winner].same_entry(index, tables[t]) for t in setters[:-1]):
+                conflicts.append((index, [tables[t].path for t in setters]))
+
+        temp_path = dest_path + ".partial"
+        with open(temp_path, 'wb') as f:
+            strings_offset = TLK_HEADER.size + count * TLK_ENTRY.size
+            f.write(TLK_HEADER.pack(b'TLK ', b'V3.0', base.language, count, strings_offset))
+            offset = 0
+            for index in range(count):
+                table = tables[chosen[index]]
+                flags, sound, volume, pitch, _, size, length = TLK_ENTRY.unpack(table.record(index))
+                f.write(TLK_ENTRY.pack(flags, sound, volume, pitch, offset, size, length))
+                offset += size
+            for index in range(count):
+                tables[chosen[index]].copy_text(index, f)
+        os.replace(temp_path, dest_path)
+        return changes, conflicts
+    finally:
+        for table in tables:
+            table.close()
@@ -0,0 +1,227 @@
+import configparser
+import os
+import shutil
+
+from erf import MODULE_EXTENSIONS
+
+TSLPATCHDATA = "tslpatchdata"
+CONFIG_NAMES = ("changes.ini", "install.ini")
+NAMESPACES_NAME = "namespaces.ini"
+# Preferred patcher executables, best first; any other .exe next to tslpatchdata is a fallback
+PATCHER_EXECUTABLES = ("tslpatcher.exe", "holopatcher.exe")
+# changes.ini list sections read_footprint understands
+FOOTPRINT_LISTS = ("installlist", "tlklist", "2dalist", "gfflist", "compilelist", "ssflist", "hacklist")
+
+
+def parse_namespaces(data):
+    """Read the option list of a namespaces.ini as (namespace, settings) pairs"""
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.optionxform = str
+    config.read_string(data.decode('utf-8', errors='replace'))
+    sections = {name.lower(): name for name in config.sections()}
+    if "namespaces" not in sections:
+        return []
+    namespaces = []
+    for _, namespace in config.items(sections["namespaces"]):
+        section = sections.get(namespace.lower())
+        namespaces.append((namespace, dict(config.items(section)) if section else {}))
+    return namespaces
+
+
+def pick_executable(names):
+    """Choose the patcher among the .exe files next to a tslpatchdata folder"""
+    by_lower = {os.path.basename(name).lower(): name for name in names}
+    for preferred in PATCHER_EXECUTABLES:
+        if preferred in by_lower:
+            return by_lower[preferred]
+    return sorted(names)[0] if names else None
+
+
+def find_option_sets(member_names, read_member):
+    """Find every installable TSLPatcher option in an archive from its member listing.
+
+    read_member(name) returns a member's bytes and is only called for
+    namespaces.ini files. Returns a list of dicts, in archive order:
+
+        name         label shown to the user, unique within the archive
+        root         '/' separated folder holding tslpatchdata ('' for the archive root)
+        tslpatchdata the tslpatchdata folder as spelled in the archive
+        executable   patcher .exe next to tslpatchdata, or None
+        config       ini file TSLPatcher reads, relative to data_path
+        data_path    folder inside tslpatchdata with this option's files ('' for tslpatchdata)
+        namespace    namespaces.ini entry this option comes from, or None
+    """
+    names = [name.replace('\\', '/') for name in member_names]
+    folders = {}
+    for name in names:
+        parts = name.split('/')
+        for i, part in enumerate(parts[:-1]):
+            if part.lower() == TSLPATCHDATA:
+                folders.setdefault('/'.join(parts[:i + 1]), []).append('/'.join(parts[i + 1:]))
+                break
+
+    option_sets = []
+    for folder, contents in folders.items():
+        root = folder.rpartition('/')[0]
+        prefix = f"{root}/" if root else ""
+        executables = [name for name in names
+                       if name.startswith(prefix) and '/' not in name[len(prefix):]
+                       and name.lower().endswith('.exe')]
+        base = {
+            "root": root,
+            "tslpatchdata": folder,
+            "executable": pick_executable(executables),
+            "namespace": None,
+        }
+        label = root.rpartition('/')[2] or "(archive root)"
+        by_lower = {rel.lower(): rel for rel in contents}
+
+        if NAMESPACES_NAME in by_lower:
+            for namespace, settings in parse_namespaces(read_member(f"{folder}/{by_lower[NAMESPACES_NAME]}")):
+                option_sets.append(dict(
+                    base, name=f"{label}: {settings.get('Name', namespace)}",
+                    config=settings.get("IniName", "changes.ini"),
+                    data_path=settings.get("DataPath", "").replace('\\', '/').strip('/'),
+                    namespace=namespace))
+            continue
+        config = next((by_lower[c] for c in CONFIG_NAMES if c in by_lower), "changes.ini")
+        option_sets.append(dict(base, name=label, config=config, data_path=""))
+
+    # Several option folders can share a label; keep names unique so they can be chosen
+    seen = {}
+    for option in option_sets:
+        count = seen.get(option["name"], 0) + 1
+        seen[option["name"]] = count
+        if count > 1:
+            option["name"] = f"{option['name']} ({count})"
+    return option_sets
+
+
+def select_option(option_sets, choice=None):
+    """Return the option set named choice, or the first one when there is no choice"""
+    if choice is None:
+        return option_sets[0] if option_sets else None
+    for option in option_sets:
+        if option["name"] == choice:
+            return option
+    return None
+
+
+def prepare_option(extract_path, option):
+    """Make an extracted mod install only the chosen namespace option.
+
+    TSLPatcher would otherwise ask which option to install. The option's
+    files are copied over tslpatchdata, its ini becomes changes.ini and
+    namespaces.ini is removed. Returns the folder to run the patcher in.
+    """
+    root = os.path.join(extract_path, *option["root"].split('/')) if option["root"] else extract_path
+    if option["namespace"] is None:
+        return root
+    tslpatchdata = os.path.join(extract_path, *option["tslpatchdata"].split('/'))
+    if option["data_path"]:
+        shutil.copytree(os.path.join(tslpatchdata, *option["data_path"].split('/')), tslpatchdata,
+                        dirs_exist_ok=True)
+    config_path = os.path.join(tslpatchdata, option["config"])
+    changes_path = os.path.join(tslpatchdata, "changes.ini")
+    if os.path.normcase(config_path) != os.path.normcase(changes_path) and os.path.exists(config_path):
+        shutil.copy2(config_path, changes_path)
+    for name in os.listdir(tslpatchdata):
+        if name.lower() == NAMESPACES_NAME:
+            os.remove(os.path.join(tslpatchdata, name))
+    return root
+
+
+def option_config_path(extract_path, option):
+    """The ini file TSLPatcher will read for an option, before prepare_option runs"""
+    tslpatchdata = os.path.join(extract_path, *option["tslpatchdata"].split('/'))
+    if option["data_path"]:
+        config_path = os.path.join(tslpatchdata, *option["data_path"].split('/'), option["config"])
+        if os.path.exists(config_path):
+            return config_path
+    return os.path.join(tslpatchdata, option["config"])
+
+
+def footprint_destination(folder, name):
+    """Lowercased '/' separated game path of a file installed into folder"""
+    folder = folder.replace('\\', '/').strip().strip('/')
+    return f"{folder}/{name}".lower() if folder not in ("", ".") else name.lower()
+
+
+def read_footprint(config_path):
+    """Game files a changes.ini reads or writes, as lowercased '/' separated paths.
+
+    Returns None when the ini can't be read or uses a list section this
+    doesn't know, since such a mod could touch anything.
+    """
+    config = configparser.ConfigParser(interpolation=None, strict=False, allow_no_value=True)
+    config.optionxform = str
+    try:
+        with open(config_path, 'rb') as f:
+            config.read_string(f.read().decode('cp1252', errors='replace'))
+    except (OSError, configparser.Error):
+        return None
+    sections = {name.lower(): name for name in config.sections()}
+
+    def values(section):
+        # Keys starting with ! are settings, not files
+        return [value.strip() for key, value in config.items(sections[section])
+                if value and value.strip() and not key.startswith('!')]
+
+    def settings(section):
+        return {key.lower(): value for key, value in config.items(sections[section])} if section in sections else {}
+
+    footprint = set()
+    for section in sections:
+        if not section.endswith("list"):
+            continue
+        if section not in FOOTPRINT_LISTS:
+            return None
+        if section == "installlist":
+            for key, folder in config.items(sections[section]):
+                if key.lower() in sections and folder:
+                    for name in values(key.lower()):
+                        footprint.add(footprint_destination(folder, name))
+        elif section == "tlklist":
+            if values(section):
+                footprint.add("dialog.tlk")
+        elif section == "2dalist":
+            footprint.update(footprint_destination("Override", name) for name in values(section))
+        else:
+            default_destination = settings(section).get("!defaultdestination") or "Override"
+            for name in values(section):
+                file_settings = settings(name.lower())
+                saved_as = file_settings.get("!saveas") or file_settings.get("!filename") or name
+                if section == "compilelist" and saved_as.lower().endswith(".nss"):
+                    saved_as = saved_as[:-len(".nss")] + ".ncs"
+                destination = (file_settings.get("!destination") or default_destination).replace('\\', '/')
+                if destination.lower().endswith(MODULE_EXTENSIONS):
+                    # Patched inside a module archive; the whole archive is read and rewritten
+                    footprint.add(destination.strip('/').lower())
+                else:
+                    footprint.add(footprint_destination(destination, saved_as))
+    return frozenset(footprint)
+
+
+def option_footprint(extract_path, option):
+    """Game files one install option touches, or None if that can't be told from its ini"""
+    return read_footprint(option_config_path(extract_path, option))
+
+
+def plan_waves(footprints):
+    """Split patcher runs into waves that can run side by side.
+
+    footprints is a list of (item, footprint) in load order. Runs in one
+    wave touch disjoint files, so their order within the wave doesn't
+    matter; a run that overlaps the current wave, or whose footprint is
+    unknown (None), starts a new wave. Returns a list of item lists.
+    """
+    waves = []
+    touched = None
+    for item, footprint in footprints:
+        if footprint is None or touched is None or touched & footprint:
+            waves.append([item])
+            touched = set(footprint) if footprint is not None else None
+        else:
+            waves[-1].append(item)
+            touched |= footprint
+    return waves
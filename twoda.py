@@ -0,0 +1,251 @@
+import array
+import os
+import pickle
+import shlex
+import struct
+
+BINARY_MAGIC = b'2DA V2.b'
+TEXT_MAGIC = b'2DA V2.0'
+BLANK = "****"
+TABLE_CACHE_DIR_NAME = "twoda_cache"
+# Bump when Table's pickled layout changes
+CACHE_VERSION = 1
+
+
+class TwoDAError(ValueError):
+    """Raised for files that aren't valid 2DA tables"""
+
+
+class Table:
+    """A 2DA table stored column by column.
+
+    Every cell is an index into strings, the table's pool of distinct
+    values (index 0 is the blank cell), so a column is one compact array
+    and equal values are stored once.
+    """
+
+    def __init__(self, columns, labels=()):
+        self.columns = list(columns)
+        self.labels = list(labels)
+        self.strings = [""]
+        self.index = {"": 0}
+        self.cells = {name: array.array('I', bytes(4 * len(self.labels))) for name in self.columns}
+
+    def intern(self, value):
+        if value == BLANK:
+            value = ""
+        string_id = self.index.get(value)
+        if string_id is None:
+            string_id = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get(self, row, column):
+        return self.strings[self.cells[column][row]]
+
+    def column_values(self, column):
+        strings = self.strings
+        return [strings[i] for i in self.cells[column]]
+
+    def row(self, row):
+        return {column: self.get(row, column) for column in self.columns}
+
+    def add_column(self, column):
+        self.columns.append(column)
+        self.cells[column] = array.array('I', bytes(4 * len(self.labels)))
+
+    def append_row(self, label, values=None):
+        self.labels.append(label)
+        values = values or {}
+        for column in self.columns:
+            self.cells[column].append(self.intern(values.get(column, "")))
+
+    def set(self, row, column, value):
+        self.cells[column][row] = self.intern(value)
+
+    def copy(self):
+        table = Table([])
+        table.columns = list(self.columns)
+        table.labels = list(self.labels)
+        table.strings = list(self.strings)
+        table.index = dict(self.index)
+        table.cells = {name: array.array('I', cells) for name, cells in self.cells.items()}
+        return table
+
+
+def parse_binary(data):
+    """Parse a binary V2.b table"""
+    pos = data.index(b'\n') + 1
+    end = data.index(b'\0', pos)
+    columns = data[pos:end].decode('latin-1').split('\t')[:-1]
+    pos = end + 1
+    row_count, = struct.unpack_from('<I', data, pos)
+    pos += 4
+    labels = []
+    for _ in range(row_count):
+        end = data.index(b'\t', pos)
+        labels.append(data[pos:end].decode('latin-1'))
+        pos = end + 1
+    cell_count = row_count * len(columns)
+    offsets = array.array('H', data[pos:pos + 2 * cell_count])
+    if len(offsets) != cell_count:
+        raise TwoDAError("cell offsets are truncated")
+    pos += 2 * cell_count + 2
+    table = Table(columns, labels)
+    # Each distinct offset is one string; decode it once
+    ids = {}
+    for i, offset in enumerate(offsets):
+        string_id = ids.get(offset)
+        if string_id is None:
+            start = pos + offset
+            string_id = ids[offset] = table.intern(data[start:data.index(b'\0', start)].decode('latin-1'))
+        table.cells[columns[i % len(columns)]][i // len(columns)] = string_id
+    return table
+
+
+def parse_text(data):
+    """Parse a text V2.0 table"""
+    lines = data.decode('latin-1').splitlines()
+    # Line 2 holds an optional DEFAULT: value; the header is the first non-blank line after it
+    body = [line for line in lines[2:] if line.strip()]
+    if not body:
+        raise TwoDAError("the table has no column header")
+    columns = body[0].split()
+    table = Table(columns)
+    for line in body[1:]:
+        values = shlex.split(line, posix=True) if '"' in line else line.split()
+        table.append_row(values[0], dict(zip(columns, values[1:])))
+    return table
+
+
+def parse(data):
+    """Parse a 2DA table in either format"""
+    try:
+        if data.startswith(BINARY_MAGIC):
+            return parse_binary(data)
+        if data.startswith(TEXT_MAGIC):
+            return parse_text(data)
+    except (ValueError, struct.error) as e:
+        raise TwoDAError(f"damaged 2DA table: {str(e)}")
+    raise TwoDAError("not a 2DA V2.b or V2.0 table")
+
+
+def write_binary(table, path):
+    """Write a table as binary V2.b, the format the game reads"""
+    data = bytearray()
+    offsets = {}
+    for value in table.strings:
+        offsets[value] = len(data)
+        data += value.encode('latin-1', errors='replace') + b'\0'
+    if len(data) > 0xFFFF:
+        raise TwoDAError(f"{os.path.basename(path)} holds too much text for a binary 2DA")
+    string_offsets = array.array('H', (offsets[value] for value in table.strings))
+    cells = array.array('H', bytes(2 * len(table) * len(table.columns)))
+    width = len(table.columns)
+    for c, column in enumerate(table.columns):
+        cells[c::width] = array.array('H', (string_offsets[i] for i in table.cells[column]))
+    temp_path = path + ".partial"
+    with open(temp_path, 'wb') as f:
+        f.write(BINARY_MAGIC + b'\n')
+        f.write(''.join(f"{column}\t" for column in table.columns).encode('latin-1') + b'\0')
+        f.write(struct.pack('<I', len(table)))
+        f.write(''.join(f"{label}\t" for label in table.labels).encode('latin-1'))
+        f.write(cells.tobytes())
+        f.write(struct.pack('<H', len(data)))
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def diff_tables(base, other):
+    """Changes other makes to base: ({(row, column): value}, {row: (label, values)}, new columns)"""
+    changed = {}
+    rows = min(len(base), len(other))
+    for column in other.columns:
+        if column not in base.cells:
+            continue
+        mine = other.column_values(column)
+        theirs = base.column_values(column)
+        if mine[:rows] != theirs[:rows]:
+            for row in range(rows):
+                if mine[row] != theirs[row]:
+                    changed[(row, column)] = mine[row]
+    new_columns = [column for column in other.columns if column not in base.cells]
+    for column in new_columns:
+        for row, value in enumerate(other.column_values(column)[:rows]):
+            if value:
+                changed[(row, column)] = value
+    added = {row: (other.labels[row], other.row(row)) for row in range(rows, len(other))}
+    return changed, added, new_columns
+
+
+def merge_tables(base, tables):
+    """Apply every table's changes to base in load order.
+
+    Rows keep their index, since other files refer to rows by number;
+    two tables adding different rows at the same index is a conflict
+    the later table wins. Returns (merged table, changes per table,
+    conflicts as (row, column or None, table indexes)).
+    """
+    merged = base.copy()
+    changes = []
+    setters = {}
+    for index, table in enumerate(tables):
+        changed, added, new_columns = diff_tables(base, table)
+        for column in new_columns:
+            if column not in merged.cells:
+                merged.add_column(column)
+        for (row, column), value in changed.items():
+            merged.set(row, column, value)
+            setters.setdefault((row, column), []).append((index, value))
+        for row, (label, values) in sorted(added.items()):
+            while len(merged) <= row:
+                merged.append_row(str(len(merged)))
+            merged.labels[row] = label
+            for column in merged.columns:
+                merged.set(row, column, values.get(column, ""))
+            setters.setdefault((row, None), []).append((index, tuple(sorted(values.items()))))
+        changes.append(len(changed) + len(added))
+    conflicts = [(row, column, [index for index, _ in entries])
+                 for (row, column), entries in sorted(setters.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+                 if len({value for _, value in entries}) > 1]
+    return merged, changes, conflicts
+
+
+class TableCache:
+    """Parsed tables pickled by content hash, so unchanged tables aren't parsed again"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.used = set()
+
+    def load(self, path, digest):
+        """Parse path, or load it from the cache if a file with this hash was parsed before"""
+        self.used.add(digest)
+        cache_path = os.path.join(self.cache_dir, f"{digest}.pickle")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    version, table = pickle.load(f)
+                if version == CACHE_VERSION:
+                    return table
+            except (OSError, pickle.PickleError, EOFError, ValueError):
+                pass
+        with open(path, 'rb') as f:
+            table = parse(f.read())
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{cache_path}.tmp-{os.getpid()}"
+        with open(temp_path, 'wb') as f:
+            pickle.dump((CACHE_VERSION, table), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+        return table
+
+    def prune(self):
+        """Delete cached tables that weren't used since this cache was opened"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pickle") and name[:-len(".pickle")] not in self.used:
+                os.remove(os.path.join(self.cache_dir, name))